@@ -1,27 +1,217 @@
-import bcrypt
-import mysql.connector
+import argparse
+import json
+from contextlib import closing, contextmanager
 from dotenv import load_dotenv
 import os
 
-class AccessBD:
-    def __init__(self):
+try:
+    import mysql.connector
+except ImportError:
+    # Solo hace falta con DB_BACKEND=mysql
+    mysql = None
+
+from cpu_pool import check_password, hash_password
+from db_pool import ConnectionPool
+from lru_cache import LRUCache
+from metrics import stage
+from storage import EMOTIONS, Storage
+
+
+def format_date(value, fmt: str) -> str:
+    """Las fechas llegan como date/datetime desde MySQL y como texto ISO desde SQLite"""
+    return value.strftime(fmt) if hasattr(value, "strftime") else str(value)
+
+
+class AccessBD(Storage):
+    """
+    Almacenamiento en MySQL.
+    Las consultas son SQL estándar salvo las sentencias de clase de abajo, que usan sintaxis
+    propia de MySQL; SQLiteBD hereda de esta clase y solo redefine la conexión y esas sentencias.
+    """
+
+    backend = "mysql"
+    # Excepción del conector cuando falla una clave foránea o única
+    integrity_error = mysql.connector.IntegrityError if mysql is not None else ()
+
+    # Entrada anterior de una fecha, bloqueada hasta el commit para restar sus valores
+    SELECT_DIARY_FOR_UPDATE = """
+    SELECT happy, angry, surprise, sad, fear
+    FROM diary_entries
+    WHERE user_id = %s AND date = %s
+    FOR UPDATE
+    """
+
+    UPSERT_DIARY_ENTRY = """
+    INSERT INTO diary_entries (user_id, date, entry, happy, angry, surprise, sad, fear)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE 
+    entry = VALUES(entry), 
+    happy = VALUES(happy),
+    angry = VALUES(angry),
+    surprise = VALUES(surprise),
+    sad = VALUES(sad),
+    fear = VALUES(fear)
+    """
+
+    ADD_EMOTION_AGGREGATES = """
+    INSERT INTO emotion_aggregates (user_id, entries, version, happy_sum, angry_sum, surprise_sum, sad_sum, fear_sum)
+    VALUES (%s, %s, 1, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+    entries = entries + VALUES(entries),
+    version = version + 1,
+    happy_sum = happy_sum + VALUES(happy_sum),
+    angry_sum = angry_sum + VALUES(angry_sum),
+    surprise_sum = surprise_sum + VALUES(surprise_sum),
+    sad_sum = sad_sum + VALUES(sad_sum),
+    fear_sum = fear_sum + VALUES(fear_sum)
+    """
+
+    # MySQL evalúa las asignaciones en orden: 'profile' se compara con la versión antigua
+    UPSERT_PROFILE_SNAPSHOT = """
+    INSERT INTO profile_snapshots (user_id, diary_version, profile, updated_at)
+    VALUES (%s, %s, %s, NOW())
+    ON DUPLICATE KEY UPDATE
+    profile = IF(VALUES(diary_version) >= diary_version, VALUES(profile), profile),
+    updated_at = IF(VALUES(diary_version) >= diary_version, VALUES(updated_at), updated_at),
+    diary_version = GREATEST(diary_version, VALUES(diary_version))
+    """
+
+    REBUILD_EMOTION_AGGREGATES = """
+    INSERT INTO emotion_aggregates (user_id, entries, version, happy_sum, angry_sum, surprise_sum, sad_sum, fear_sum)
+    SELECT user_id, COUNT(*), 1,
+           COALESCE(SUM(happy), 0), COALESCE(SUM(angry), 0), COALESCE(SUM(surprise), 0),
+           COALESCE(SUM(sad), 0), COALESCE(SUM(fear), 0)
+    FROM diary_entries
+    GROUP BY user_id
+    ON DUPLICATE KEY UPDATE
+    entries = VALUES(entries),
+    version = version + 1,
+    happy_sum = VALUES(happy_sum),
+    angry_sum = VALUES(angry_sum),
+    surprise_sum = VALUES(surprise_sum),
+    sad_sum = VALUES(sad_sum),
+    fear_sum = VALUES(fear_sum)
+    """
+
+    UPSERT_JOB = """
+    INSERT INTO jobs (id, user_id, kind, status, progress, message, result, error, created_at, updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+    status = VALUES(status),
+    progress = VALUES(progress),
+    message = VALUES(message),
+    result = VALUES(result),
+    error = VALUES(error),
+    updated_at = VALUES(updated_at)
+    """
+
+    def __init__(self, pool_size: int = None):
         load_dotenv()
-        self.connection = self.get_db_connection()
+        if pool_size is None:
+            pool_size = int(os.getenv('DB_POOL_SIZE', 5))
+        self.pool = ConnectionPool(
+            self.get_db_connection,
+            size=pool_size,
+            timeout=float(os.getenv('DB_POOL_TIMEOUT', 30)),
+            ping=self.ping_connection,
+            ping_after=float(os.getenv('DB_POOL_PING_AFTER', 30)),
+            reset=self.reset_connection
+        )
+        # Caché username -> id para ahorrar la consulta a 'users' en cada operación
+        self.user_ids = LRUCache(int(os.getenv('USER_ID_CACHE_SIZE', 1024)))
+        # Funciones a avisar tras cada escritura en el diario: callback(username, diary_entry, version)
+        self.diary_listeners = []
+        # Pool de procesos opcional (cpu_pool.CPUPool) para ejecutar bcrypt fuera de este proceso
+        self.cpu_pool = None
 
     def get_db_connection(self):
+        if mysql is None:
+            raise RuntimeError("Falta mysql-connector-python (o usa DB_BACKEND=sqlite)")
         return mysql.connector.connect(
             host=os.getenv('DB_HOST'),
             user=os.getenv('DB_USER'),
             password=os.getenv('DB_PASSWORD'),
-            database=os.getenv('DB_NAME')
+            database=os.getenv('DB_NAME'),
+            # Sin autocommit, una conexión que solo ha leído se queda con la instantánea de su
+            # primera lectura (REPEATABLE READ) y no ve lo que confirman las demás. Las escrituras
+            # de varias sentencias abren su transacción con begin_write
+            autocommit=True
         )
 
+    def ping_connection(self, connection):
+        """Comprobar que una conexión ociosa sigue viva, reconectando si el servidor la cerró"""
+        connection.ping(reconnect=True, attempts=2, delay=0)
+
+    def reset_connection(self, connection):
+        """Al devolver una conexión al pool, deshacer la transacción que haya quedado abierta"""
+        if connection.in_transaction:
+            connection.rollback()
+
+    def pool_stats(self) -> dict:
+        """Estadísticas del pool de conexiones"""
+        return self.pool.stats()
+
+    def run_cpu(self, fn, *args):
+        """Ejecutar trabajo de CPU (bcrypt) en el pool de procesos, si hay uno configurado"""
+        if self.cpu_pool is None:
+            return fn(*args)
+        return self.cpu_pool.run(fn, *args)
+
+    def user_id_cache_stats(self) -> dict:
+        """Estadísticas de la caché de ids de usuario (aciertos, fallos, tasa de acierto)"""
+        return self.user_ids.stats()
+
+    def begin_write(self, cursor):
+        """Empezar una transacción para una escritura de varias sentencias (termina con commit)"""
+        cursor.execute("START TRANSACTION")
+
+    def get_user_id(self, cursor, username: str):
+        """Obtener el id de un usuario, consultando la base de datos solo si no está en caché"""
+        user_id = self.user_ids.get(username)
+        if user_id is None:
+            with stage("bd_id_usuario"):
+                cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
+                result = cursor.fetchone()
+            if result is None:
+                return None
+            user_id = result[0]
+            self.user_ids.put(username, user_id)
+        return user_id
+
+    def add_diary_listener(self, callback):
+        """
+        Registrar una función que se llama con (username, diary_entry, version) tras cada escritura en el
+        diario; 'version' es la de los agregados de emociones que deja esa escritura
+        """
+        self.diary_listeners.append(callback)
+
+    def notify_diary_change(self, username: str, diary_entry: dict, version: int):
+        for callback in self.diary_listeners:
+            try:
+                callback(username, diary_entry, version)
+            except Exception as e:
+                print(f"Error avisando del cambio en el diario: {e}")
+
+    def invalidate_user_id(self, username: str):
+        """Olvidar el id cacheado de un usuario"""
+        self.user_ids.pop(username)
+
+    @contextmanager
+    def user_id_guard(self, *usernames: str):
+        """Si una escritura falla por clave foránea, los ids cacheados ya no son válidos"""
+        try:
+            yield
+        except self.integrity_error:
+            for username in usernames:
+                self.invalidate_user_id(username)
+            raise
+
     def list_to_entris_json(self, entries: list) -> list:
         """Convertir la lista de entradas del diario a un formato JSON"""
         json_entries = []
         for entry in entries:
             json_entry = {
-                "date": entry[0].strftime("%Y-%m-%d"),
+                "date": format_date(entry[0], "%Y-%m-%d"),
                 "entry": entry[1],
                 "emotions": {
                     "Happy": entry[2],
@@ -51,105 +241,47 @@ class AccessBD:
         return messages
     
     def insert(self, query, values):
-        cursor = self.connection.cursor()
-        cursor.execute(query, values)
-        self.connection.commit()
-        cursor.close()
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor:
+            cursor.execute(query, values)
+            connection.commit()
 
     def select(self, query, values):
-        cursor = self.connection.cursor()
-        cursor.execute(query, values)
-        result = cursor.fetchall()
-        cursor.close()
-        return result
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor:
+            cursor.execute(query, values)
+            return cursor.fetchall()
     
-    def create_tables(self):
-        """Ejecutar esta función al principio del programa para crear las tablas necesarias"""
-
-        cursor = self.connection.cursor()
-        # Crear la tabla 'users' si no existe
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            username VARCHAR(255) UNIQUE,
-            password VARCHAR(255) NOT NULL,
-            ngrama INT DEFAULT 0
-        )
-        """)
-
-        # Crear la tabla 'diary_entries' si no existe
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS diary_entries (
-            user_id INT,
-            date DATE,
-            entry TEXT,
-            happy DECIMAL(3,2),
-            angry DECIMAL(3,2),
-            surprise DECIMAL(3,2),
-            sad DECIMAL(3,2),
-            fear DECIMAL(3,2),
-            UNIQUE (user_id, date),
-            PRIMARY KEY (user_id, date),
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
-        """)
-
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS chat_history (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            user_id INT,
-            date DATETIME,
-            human_message TEXT,
-            bot_message TEXT,
-            happy DECIMAL(3,2),
-            angry DECIMAL(3,2),
-            surprise DECIMAL(3,2),
-            sad DECIMAL(3,2),
-            fear DECIMAL(3,2),
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
-        """)
-
-        # Guardar los cambios y cerrar el cursor
-        self.connection.commit()
-        cursor.close()
-
     def register_user(self, username: str, password: str):
-        cursor = self.connection.cursor()
-
-        # Hashear la contraseña antes de guardarla en la base de datos
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        # Hashear la contraseña antes de guardarla en la base de datos (como texto, en ambos motores)
+        hashed_password = self.run_cpu(hash_password, password).decode('utf-8')
 
-        cursor.execute("INSERT INTO users (username, password) VALUES (%s, %s)", (username, hashed_password))
-        self.connection.commit()
-        cursor.close()
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor:
+            cursor.execute("INSERT INTO users (username, password) VALUES (%s, %s)", (username, hashed_password))
+            connection.commit()
+            self.user_ids.put(username, cursor.lastrowid)
 
     def change_password(self, username: str, new_password: str):
-        cursor = self.connection.cursor()
-
         # Hashear la nueva contraseña antes de guardarla en la base de datos
-        hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
-
-        cursor.execute("UPDATE users SET password = %s WHERE username = %s", (hashed_password, username))
+        hashed_password = self.run_cpu(hash_password, new_password).decode('utf-8')
 
-        self.connection.commit()
-        cursor.close()
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor:
+            cursor.execute("UPDATE users SET password = %s WHERE username = %s", (hashed_password, username))
+            connection.commit()
 
     def check_user(self, username: str) -> bool:
-        cursor = self.connection.cursor()
-        cursor.execute("SELECT COUNT(*) FROM users WHERE username = %s", (username,))
-        (count,) = cursor.fetchone()
-        cursor.close()
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor:
+            cursor.execute("SELECT COUNT(*) FROM users WHERE username = %s", (username,))
+            (count,) = cursor.fetchone()
         return count > 0
 
     def verify_user(self, username: str, password: str) -> bool:
-        cursor = self.connection.cursor()
-        cursor.execute("SELECT password FROM users WHERE username = %s", (username,))
-        result = cursor.fetchone()
-        cursor.close()
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor:
+            cursor.execute("SELECT id, password FROM users WHERE username = %s", (username,))
+            result = cursor.fetchone()
 
         if result:
-            match = bcrypt.checkpw(password.encode('utf-8'), result[0].encode('utf-8'))
+            user_id, hashed_password = result
+            self.user_ids.put(username, user_id)
+            match = self.run_cpu(check_password, password, hashed_password)
             if not match:
                 print("Contraseña incorrecta")
             return match
@@ -159,38 +291,120 @@ class AccessBD:
 
 
     def insert_diary_entry(self, user: str, diary_entry: dict):
-        cursor = self.connection.cursor()
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor, self.user_id_guard(user):
+            # Obtener el id del usuario
+            user_id = self.get_user_id(cursor, user)
+            if user_id is None:
+                print("Usuario no encontrado")
+                return
+
+            # Redondear como lo hará DECIMAL(3,2), para que los agregados cuadren con las filas
+            emotions = [round(float(diary_entry['emotions'][emo]), 2) for emo in EMOTIONS]
+
+            # Bloquear la entrada anterior de esa fecha (si existe) para restar sus valores
+            self.begin_write(cursor)
+            cursor.execute(self.SELECT_DIARY_FOR_UPDATE, (user_id, diary_entry['date']))
+            previous = cursor.fetchone()
+            
+            # Insertar la entrada del diario
+            cursor.execute(self.UPSERT_DIARY_ENTRY, (user_id, diary_entry['date'], diary_entry['entry'], *emotions))
+
+            # Actualizar los agregados en la misma transacción: una entrada nueva suma uno
+            # al contador, una sobrescrita solo cambia las sumas en la diferencia
+            if previous is None:
+                new_entries = 1
+                deltas = emotions
+            else:
+                new_entries = 0
+                deltas = [new - float(old or 0) for new, old in zip(emotions, previous)]
+            cursor.execute(self.ADD_EMOTION_AGGREGATES, (user_id, new_entries, *deltas))
+            # Versión que deja esta escritura (la fila sigue bloqueada por la transacción)
+            cursor.execute("SELECT version FROM emotion_aggregates WHERE user_id = %s", (user_id,))
+            (version,) = cursor.fetchone()
+
+            # Guardar los cambios
+            connection.commit()
+
+        self.notify_diary_change(user, diary_entry, version)
+
+    def get_emotion_profile(self, user: str) -> dict:
+        """
+        Obtener la media de cada emoción en el diario de un usuario, a partir de los agregados
+        :param user: Nombre de usuario
+        :return: {"entries": n, "version": v, "averages": {"Happy": ..., ...}} o None si no hay entradas
+        """
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor:
+            user_id = self.get_user_id(cursor, user)
+            if user_id is None:
+                return None
+            cursor.execute("""
+                           SELECT entries, version, happy_sum, angry_sum, surprise_sum, sad_sum, fear_sum
+                           FROM emotion_aggregates
+                           WHERE user_id = %s
+                           """, (user_id,))
+            row = cursor.fetchone()
+        if row is None or row[0] == 0:
+            return None
+        entries, version = row[0], row[1]
+        return {
+            "entries": entries,
+            "version": version,
+            "averages": {emo: float(total) / entries for emo, total in zip(EMOTIONS, row[2:])}
+        }
+
+    def get_profile_snapshot(self, user: str) -> dict:
+        """
+        Obtener el último perfil guardado de un usuario
+        :return: {"profile": {...}, "fresh": bool} o None si no hay perfil guardado.
+                 'fresh' indica si el diario no ha cambiado desde que se calculó
+        """
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor:
+            user_id = self.get_user_id(cursor, user)
+            if user_id is None:
+                return None
+            cursor.execute("""
+                           SELECT s.profile, s.diary_version, a.version
+                           FROM profile_snapshots s
+                           LEFT JOIN emotion_aggregates a ON a.user_id = s.user_id
+                           WHERE s.user_id = %s
+                           """, (user_id,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        profile, diary_version, current_version = row
+        return {"profile": json.loads(profile), "fresh": diary_version == (current_version or 0)}
 
-        # Obtener el id del usuario
-        cursor.execute("SELECT id FROM users WHERE username = %s", (user,))
-        result = cursor.fetchone()
-        if result:
-            user_id = result[0]
-        else:
-            print("Usuario no encontrado")
-        
-        # Insertar la entrada del diario
+    def save_profile_snapshot(self, user: str, profile: dict, diary_version: int):
+        """
+        Guardar el perfil calculado para una versión del diario
+        Si ya hay guardado uno de una versión posterior, se conserva ese
+        """
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor, self.user_id_guard(user):
+            user_id = self.get_user_id(cursor, user)
+            if user_id is None:
+                return
+            cursor.execute(self.UPSERT_PROFILE_SNAPSHOT,
+                           (user_id, diary_version, json.dumps(profile, ensure_ascii=False)))
+            connection.commit()
+
+    def rebuild_emotion_aggregates(self, cursor=None):
+        """
+        Recalcular los agregados de emociones desde la tabla diary_entries (backfill)
+        :param cursor: Cursor de quien ya tiene una conexión (una migración), que hace el commit;
+                       si no se pasa, se usa una conexión del pool
+        """
+        if cursor is None:
+            with self.pool.connection() as connection, closing(connection.cursor()) as cursor:
+                self.rebuild_emotion_aggregates(cursor)
+                connection.commit()
+            return
+        self.begin_write(cursor)
+        cursor.execute(self.REBUILD_EMOTION_AGGREGATES)
+        # Usuarios que ya no tienen entradas
         cursor.execute("""
-        INSERT INTO diary_entries (user_id, date, entry, happy, angry, surprise, sad, fear)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE 
-        entry = VALUES(entry), 
-        happy = VALUES(happy),
-        angry = VALUES(angry),
-        surprise = VALUES(surprise),
-        sad = VALUES(sad),
-        fear = VALUES(fear)
-        """, (user_id, diary_entry['date'], 
-              diary_entry['entry'], 
-              diary_entry['emotions']['Happy'], 
-              diary_entry['emotions']['Angry'], 
-              diary_entry['emotions']['Surprise'], 
-              diary_entry['emotions']['Sad'], 
-              diary_entry['emotions']['Fear']))
-
-        # Guardar los cambios y cerrar el cursor
-        self.connection.commit()
-        cursor.close()
+        DELETE FROM emotion_aggregates
+        WHERE user_id NOT IN (SELECT DISTINCT user_id FROM diary_entries)
+        """)
 
     def get_diary_entries(self, user: str, limit: int = 50) -> list:
         """
@@ -198,62 +412,89 @@ class AccessBD:
         :param user: Nombre de usuario
         :param limit: Número de entradas a obtener. Si es None, se obtienen todas las entradas        
         """
-        cursor = self.connection.cursor()
-
-        # Obtener el id del usuario
-        cursor.execute("SELECT id FROM users WHERE username = %s", (user,))
-        result = cursor.fetchone()
-        if result:
-            user_id = result[0]
-        else:
-            return []
-        
-        if limit is None:
-            cursor.execute("""
-                       SELECT date, entry, happy, angry, surprise, sad, fear
-                       FROM diary_entries
-                       WHERE user_id = %s
-                       ORDER BY date
-                       """, (user_id,))
-        else:
-            cursor.execute("""
-                        SELECT *
-                        FROM (
-                            SELECT date, entry, happy, angry, surprise, sad, fear
-                            FROM diary_entries
-                            WHERE user_id = %s
-                            ORDER BY date DESC
-                            LIMIT %s
-                        ) subquery
-                        ORDER BY date ASC;
-                        """, (user_id, limit))
-        entries = cursor.fetchall()
-        cursor.close()
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor:
+            # Obtener el id del usuario
+            user_id = self.get_user_id(cursor, user)
+            if user_id is None:
+                return []
+            
+            if limit is None:
+                cursor.execute("""
+                           SELECT date, entry, happy, angry, surprise, sad, fear
+                           FROM diary_entries
+                           WHERE user_id = %s
+                           ORDER BY date
+                           """, (user_id,))
+            else:
+                cursor.execute("""
+                            SELECT *
+                            FROM (
+                                SELECT date, entry, happy, angry, surprise, sad, fear
+                                FROM diary_entries
+                                WHERE user_id = %s
+                                ORDER BY date DESC
+                                LIMIT %s
+                            ) subquery
+                            ORDER BY date ASC;
+                            """, (user_id, limit))
+            entries = cursor.fetchall()
         return self.list_to_entris_json(entries)
     
+    def get_diary_page(self, user: str, since: str = None, until: str = None, before: str = None,
+                       limit: int = 50) -> tuple[list, str]:
+        """
+        Obtener entradas del diario por rango de fechas, paginadas por clave (user_id, date)
+        Cada página cuesta lo mismo por larga que sea la historia: se recorre el índice desde el cursor
+        :param user: Nombre de usuario
+        :param since: Primera fecha incluida (YYYY-MM-DD)
+        :param until: Última fecha incluida (YYYY-MM-DD)
+        :param before: Cursor de la página anterior; se devuelven las entradas anteriores a él
+        :param limit: Número máximo de entradas
+        :return: (entradas en orden ascendente, cursor de la siguiente página o None si no hay más)
+        """
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor:
+            # Obtener el id del usuario
+            user_id = self.get_user_id(cursor, user)
+            if user_id is None:
+                return [], None
+
+            conditions = ["user_id = %s"]
+            values = [user_id]
+            for condition, value in (("date >= %s", since), ("date <= %s", until), ("date < %s", before)):
+                if value is not None:
+                    conditions.append(condition)
+                    values.append(value)
+            # Una fila de más para saber si hay otra página
+            cursor.execute(f"""
+                           SELECT date, entry, happy, angry, surprise, sad, fear
+                           FROM diary_entries
+                           WHERE {" AND ".join(conditions)}
+                           ORDER BY date DESC
+                           LIMIT %s
+                           """, (*values, limit + 1))
+            rows = cursor.fetchall()
+        entries = self.list_to_entris_json(reversed(rows[:limit]))
+        next_cursor = entries[0]["date"] if len(rows) > limit else None
+        return entries, next_cursor
+
     def get_diary_entry(self, user: str, date: str) -> dict:
         """
         Obtener una entrada del diario de un usuario
         :param user: Nombre de usuario  
         :param date: Fecha de la entrada
         """
-        cursor = self.connection.cursor()
-
-        # Obtener el id del usuario
-        cursor.execute("SELECT id FROM users WHERE username = %s", (user,))
-        result = cursor.fetchone()
-        if result:
-            user_id = result[0]
-        else:
-            return {}
-        
-        cursor.execute("""
-                       SELECT date, entry, happy, angry, surprise, sad, fear
-                       FROM diary_entries
-                       WHERE user_id = %s AND date = %s
-                       """, (user_id, date))
-        entry = cursor.fetchone()
-        cursor.close()
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor:
+            # Obtener el id del usuario
+            user_id = self.get_user_id(cursor, user)
+            if user_id is None:
+                return {}
+            
+            cursor.execute("""
+                           SELECT date, entry, happy, angry, surprise, sad, fear
+                           FROM diary_entries
+                           WHERE user_id = %s AND date = %s
+                           """, (user_id, date))
+            entry = cursor.fetchone()
         if entry:
             return self.list_to_entris_json([entry])[0]
         else:
@@ -261,100 +502,203 @@ class AccessBD:
 
     def insert_chat_history(self, user: str, chat_history: dict):
         """Insertar la última pieza de la conversación entre el usuario y el bot"""
-        cursor = self.connection.cursor()
-
-        # Obtener el id del usuario
-        cursor.execute("SELECT id FROM users WHERE username = %s", (user,))
-        result = cursor.fetchone()
-        if result:
-            user_id = result[0]
-        else:
-            print("Usuario no encontrado")
-        
-        # Insertar el historial del chat
-        cursor.execute("""
-        INSERT INTO chat_history (user_id, date, human_message, bot_message, happy, angry, surprise, sad, fear)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (user_id, chat_history['date'], 
-              chat_history['human_message'], 
-              chat_history['bot_message'],
-              chat_history['emotions']['Happy'], 
-              chat_history['emotions']['Angry'], 
-              chat_history['emotions']['Surprise'], 
-              chat_history['emotions']['Sad'], 
-              chat_history['emotions']['Fear']))
-
-        # Guardar los cambios y cerrar el cursor
-        self.connection.commit()
-        cursor.close()
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor, self.user_id_guard(user):
+            # Obtener el id del usuario
+            user_id = self.get_user_id(cursor, user)
+            if user_id is None:
+                print("Usuario no encontrado")
+                return
+            
+            # Insertar el historial del chat
+            cursor.execute("""
+            INSERT INTO chat_history (user_id, date, human_message, bot_message, happy, angry, surprise, sad, fear)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, (user_id, chat_history['date'], 
+                  chat_history['human_message'], 
+                  chat_history['bot_message'],
+                  chat_history['emotions']['Happy'], 
+                  chat_history['emotions']['Angry'], 
+                  chat_history['emotions']['Surprise'], 
+                  chat_history['emotions']['Sad'], 
+                  chat_history['emotions']['Fear']))
+
+            # Guardar los cambios
+            connection.commit()
+
+    def insert_chat_history_batch(self, turns: list) -> int:
+        """
+        Insertar varios turnos del chat con un solo executemany y un solo commit
+        :param turns: Lista de (usuario, pieza de conversación) como las de insert_chat_history
+        :return: Número de turnos insertados (se descartan los de usuarios que no existen)
+        """
+        usernames = {user for user, _ in turns}
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor, self.user_id_guard(*usernames):
+            user_ids = {user: self.get_user_id(cursor, user) for user in usernames}
+            rows = []
+            for user, chat_history in turns:
+                if user_ids[user] is None:
+                    print(f"Usuario no encontrado: {user}")
+                    continue
+                emotions = chat_history['emotions']
+                rows.append((user_ids[user], chat_history['date'],
+                             chat_history['human_message'],
+                             chat_history['bot_message'],
+                             *(emotions.get(emo, 0) for emo in EMOTIONS)))
+            if not rows:
+                return 0
+
+            cursor.executemany("""
+            INSERT INTO chat_history (user_id, date, human_message, bot_message, happy, angry, surprise, sad, fear)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """, rows)
+            connection.commit()
+            return len(rows)
 
     def get_chat_history(self, user: str, limit: int = None) -> list:
         """Obtener todo el historial del chat de un usuario"""
-        cursor = self.connection.cursor()
-
-        # Obtener el id del usuario
-        cursor.execute("SELECT id FROM users WHERE username = %s", (user,))
-        result = cursor.fetchone()
-        if result:
-            user_id = result[0]
-        else:
-            return []
-        
-        if limit is None:
-        
-            cursor.execute("""
-                        SELECT human_message, bot_message, date
-                        FROM chat_history
-                        WHERE user_id = %s
-                        ORDER BY date
-                        """, (user_id,))
-        else:
-            cursor.execute("""
-                        SELECT *
-                        FROM (
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor:
+            # Obtener el id del usuario
+            user_id = self.get_user_id(cursor, user)
+            if user_id is None:
+                return []
+            
+            if limit is None:
+            
+                cursor.execute("""
                             SELECT human_message, bot_message, date
                             FROM chat_history
                             WHERE user_id = %s
-                            ORDER BY date DESC
-                            LIMIT %s
-                        ) subquery
-                        ORDER BY date ASC;
-                        """, (user_id, limit))
-        entries = cursor.fetchall()
-        cursor.close()
+                            ORDER BY date
+                            """, (user_id,))
+            else:
+                cursor.execute("""
+                            SELECT *
+                            FROM (
+                                SELECT human_message, bot_message, date
+                                FROM chat_history
+                                WHERE user_id = %s
+                                ORDER BY date DESC
+                                LIMIT %s
+                            ) subquery
+                            ORDER BY date ASC;
+                            """, (user_id, limit))
+            entries = cursor.fetchall()
         return self.list_to_chat_json(entries)   
 
+    def get_chat_page(self, user: str, before: str = None, limit: int = 10) -> tuple[list, str]:
+        """
+        Obtener los turnos del chat anteriores a un cursor, paginados por clave (user_id, date, id)
+        :param user: Nombre de usuario
+        :param before: Cursor devuelto por la página anterior ("fecha|id"); None para los más recientes
+        :param limit: Número máximo de turnos (cada turno son dos mensajes)
+        :return: (mensajes en orden cronológico, cursor de la siguiente página o None si no hay más)
+        """
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor:
+            # Obtener el id del usuario
+            user_id = self.get_user_id(cursor, user)
+            if user_id is None:
+                return [], None
+
+            if before is None:
+                cursor.execute("""
+                            SELECT human_message, bot_message, date, id
+                            FROM chat_history
+                            WHERE user_id = %s
+                            ORDER BY date DESC, id DESC
+                            LIMIT %s
+                            """, (user_id, limit + 1))
+            else:
+                # Varios turnos pueden compartir segundo: el id desempata
+                before_date, before_id = before.split("|")
+                cursor.execute("""
+                            SELECT human_message, bot_message, date, id
+                            FROM chat_history
+                            WHERE user_id = %s AND (date < %s OR (date = %s AND id < %s))
+                            ORDER BY date DESC, id DESC
+                            LIMIT %s
+                            """, (user_id, before_date, before_date, int(before_id), limit + 1))
+            rows = cursor.fetchall()
+        page = rows[:limit][::-1]
+        next_cursor = None
+        if len(rows) > limit:
+            oldest = page[0]
+            next_cursor = f"{format_date(oldest[2], '%Y-%m-%d %H:%M:%S')}|{oldest[3]}"
+        return self.list_to_chat_json(page), next_cursor
+
+    def get_last_chat_id(self, user: str) -> int:
+        """Id del último turno del chat de un usuario (0 si no tiene); cambia con cada turno que se guarda"""
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor:
+            user_id = self.get_user_id(cursor, user)
+            if user_id is None:
+                return 0
+            # Mismo orden que get_chat_page: una sola lectura del índice (user_id, date)
+            cursor.execute("""
+                           SELECT id
+                           FROM chat_history
+                           WHERE user_id = %s
+                           ORDER BY date DESC, id DESC
+                           LIMIT 1
+                           """, (user_id,))
+            row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def save_job(self, job: dict):
+        """Guardar el estado de un trabajo en segundo plano (jobs.JobQueue)"""
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor, self.user_id_guard(job['user']):
+            user_id = self.get_user_id(cursor, job['user'])
+            if user_id is None:
+                return
+            result = json.dumps(job['result'], ensure_ascii=False) if job['result'] is not None else None
+            cursor.execute(self.UPSERT_JOB, (job['id'], user_id, job['kind'], job['status'], job['progress'],
+                                             job['message'], result, job['error'],
+                                             job['created_at'], job['updated_at']))
+            connection.commit()
+
+    def get_job(self, job_id: str) -> dict:
+        """Obtener un trabajo guardado, con el mismo formato que en JobQueue; None si no existe"""
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor:
+            cursor.execute("""
+                           SELECT j.id, u.username, j.kind, j.status, j.progress, j.message, j.result, j.error,
+                                  j.created_at, j.updated_at
+                           FROM jobs j
+                           JOIN users u ON u.id = j.user_id
+                           WHERE j.id = %s
+                           """, (job_id,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        keys = ("id", "user", "kind", "status", "progress", "message", "result", "error", "created_at", "updated_at")
+        job = dict(zip(keys, row))
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def delete_jobs(self, before: float) -> int:
+        """Borrar los trabajos que no se actualizan desde 'before' (segundos desde epoch)"""
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor:
+            cursor.execute("DELETE FROM jobs WHERE updated_at < %s", (before,))
+            connection.commit()
+            return cursor.rowcount
+
     def close(self):
-        self.connection.close()
+        self.pool.close()
 
 
-    def create_index(self, table_name, column_name):
-        cursor = self.connection.cursor()
-        cursor.execute(f"CREATE INDEX idx_{table_name}_{column_name} ON {table_name} ({column_name})")
-        self.connection.commit()
-        cursor.close()
-        
-    
     def drop_table(self):
-        cursor = self.connection.cursor()
-        cursor.execute("DROP TABLE diary_entries")
-        
-        self.connection.commit()
-        cursor.close()
+        with self.pool.connection() as connection, closing(connection.cursor()) as cursor:
+            cursor.execute("DROP TABLE diary_entries")
+            connection.commit()
 
 if __name__ == '__main__':
-    access_bd = AccessBD()
-    access_bd.create_tables()
-    """
-    #Creamos un índice por nombre de usuario
-    access_bd.create_index("users", "username")
-    #Un índice por user_id en las tablas de entradas del diario y chat_history
-    access_bd.create_index("diary_entries", "user_id")
-    access_bd.create_index("chat_history", "user_id")
-
-    #estos indices nos permitirán hacer búsquedas más rápidas en la base de datos
-    """
-
+    from storage import create_storage
+
+    # Las tablas y los índices se crean con las migraciones: python migrations.py
+    parser = argparse.ArgumentParser(description="Mantenimiento de la base de datos de EmotionAI")
+    parser.add_argument("--backfill-aggregates", action="store_true",
+                        help="Recalcular los agregados de emociones desde diary_entries")
+    args = parser.parse_args()
+
+    access_bd = create_storage()
+    if args.backfill_aggregates:
+        access_bd.rebuild_emotion_aggregates()
+        print("Agregados de emociones recalculados")
     access_bd.close()
-
-    
@@ -0,0 +1,48 @@
+import asyncio
+import contextvars
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import DB_ERRORS, DB_SECONDS, endpoint_var
+from storage import Storage, create_storage
+
+
+class AsyncAccessBD:
+    """
+    Versión asíncrona del almacenamiento (AccessBD o SQLiteBD) para usar desde los endpoints de FastAPI.
+    Cada operación se ejecuta en un pool de hilos acotado al tamaño del pool de
+    conexiones, así las consultas (y el bcrypt de verify_user) no bloquean el event loop.
+    Cada operación se mide (emotionai_db_query_seconds) con el endpoint que la ha pedido.
+    """
+
+    def __init__(self, db: Storage = None, max_workers: int = None):
+        self.db = db if db is not None else create_storage()
+        if max_workers is None:
+            max_workers = self.db.pool.size
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bd")
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def run_in_executor(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            # Ejecutar con el contexto de la petición, para que lo medido dentro lleve su endpoint
+            context = contextvars.copy_context()
+            start = time.perf_counter()
+            try:
+                return await loop.run_in_executor(self.executor, functools.partial(context.run, attr, *args, **kwargs))
+            except Exception:
+                DB_ERRORS.inc(endpoint=endpoint_var.get(), query=name)
+                raise
+            finally:
+                DB_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint_var.get(), query=name)
+
+        return run_in_executor
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.db.close()
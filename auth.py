@@ -0,0 +1,50 @@
+import os
+import secrets
+from datetime import datetime, timedelta, timezone
+
+import jwt
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+load_dotenv()
+
+ALGORITHM = "HS256"
+TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_EXPIRE_MINUTES", 12 * 60))
+
+SECRET_KEY = os.getenv("JWT_SECRET")
+if not SECRET_KEY:
+    # Sin secreto configurado los tokens solo valen mientras viva este proceso
+    print("JWT_SECRET no definido: se usa un secreto aleatorio para esta ejecución")
+    SECRET_KEY = secrets.token_urlsafe(32)
+
+bearer = HTTPBearer(auto_error=False)
+
+
+def create_token(username: str) -> str:
+    """Crear un token de sesión firmado para el usuario"""
+    now = datetime.now(timezone.utc)
+    payload = {
+        "sub": username,
+        "iat": now,
+        "exp": now + timedelta(minutes=TOKEN_EXPIRE_MINUTES),
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def decode_token(token: str) -> str:
+    """Validar un token de sesión y devolver el nombre de usuario"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="La sesión ha caducado")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Token inválido")
+    return payload["sub"]
+
+
+async def current_user(credentials: HTTPAuthorizationCredentials = Depends(bearer)) -> str:
+    """Dependencia de FastAPI para los endpoints protegidos (cabecera Authorization: Bearer <token>)"""
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Falta el token de sesión")
+    return decode_token(credentials.credentials)
@@ -0,0 +1,128 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Vocabulario de las respuestas del chat; una palabra equivale a un token
+WORDS = ("entiendo", "cómo", "te", "sientes", "hoy", "es", "normal", "que", "a", "veces", "cueste",
+         "respirar", "hablar", "con", "alguien", "puede", "ayudarte", "cuéntame", "más", "sobre", "eso")
+
+
+def seeded(messages: list) -> random.Random:
+    """Generador determinista a partir de los mensajes: el mismo prompt da la misma respuesta"""
+    digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).digest()
+    return random.Random(digest)
+
+
+def reply_for(messages: list, reply_tokens: int) -> str:
+    """Respuesta con el formato que espera cada prompt de la aplicación"""
+    rng = seeded(messages)
+    prompt = messages[0].get("content", "") if messages else ""
+    if "eneagrama_type" in prompt:
+        number = rng.randint(1, 9)
+        return json.dumps({
+            "eneagrama_type": f"Eneatipo {number}",
+            "description": " ".join(rng.choices(WORDS, k=reply_tokens // 2)),
+            "recommendation": " ".join(rng.choices(WORDS, k=reply_tokens // 2)),
+        }, ensure_ascii=False)
+    if "Openness" in prompt:
+        traits = ("Openness", "Conscientiousness", "Extraversion", "Agreeableness", "Neuroticism")
+        return json.dumps({trait: rng.randint(0, 100) for trait in traits})
+    if '"objetivos"' in prompt:
+        return json.dumps({"objetivos": [" ".join(rng.choices(WORDS, k=8)) for _ in range(5)]}, ensure_ascii=False)
+    return " ".join(rng.choices(WORDS, k=reply_tokens))
+
+
+def tokens(text: str) -> list[str]:
+    """Trozos de la respuesta que se envían como tokens al hacer streaming"""
+    return [word + " " for word in text.split(" ")]
+
+
+def create_app(latency: float, tokens_per_second: float, reply_tokens: int, error_rate: float, seed: int) -> FastAPI:
+    """
+    Servidor compatible con /v1/chat/completions de Mistral para las pruebas de carga
+    :param latency: Segundos hasta el primer token
+    :param tokens_per_second: Velocidad de generación; 0 para responder sin esperas
+    :param reply_tokens: Longitud de las respuestas del chat
+    :param error_rate: Fracción de peticiones que reciben un 503 (la secuencia depende de 'seed')
+    """
+    app = FastAPI()
+    errors = random.Random(seed)
+    stats = {"requests": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+    def token_delay() -> float:
+        return 1 / tokens_per_second if tokens_per_second > 0 else 0
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        if errors.random() < error_rate:
+            stats["errors"] += 1
+            return JSONResponse(status_code=503, content={"message": "Servicio no disponible (simulado)"})
+
+        messages = body.get("messages", [])
+        text = reply_for(messages, reply_tokens)
+        pieces = tokens(text)
+        prompt_tokens = sum(len(str(m.get("content", ""))) // 4 for m in messages)
+        stats["prompt_tokens"] += prompt_tokens
+        stats["completion_tokens"] += len(pieces)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(pieces),
+                 "total_tokens": prompt_tokens + len(pieces)}
+        model = body.get("model", "fake")
+        created = int(time.time())
+        await asyncio.sleep(latency)
+
+        if not body.get("stream"):
+            await asyncio.sleep(token_delay() * len(pieces))
+            return {
+                "id": "fake", "object": "chat.completion", "model": model, "created": created,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        async def events():
+            for index, piece in enumerate(pieces):
+                last = index == len(pieces) - 1
+                chunk = {
+                    "id": "fake", "object": "chat.completion.chunk", "model": model, "created": created,
+                    "choices": [{"index": 0, "delta": {"role": "assistant", "content": piece},
+                                 "finish_reason": "stop" if last else None}],
+                }
+                if last:
+                    chunk["usage"] = usage
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                await asyncio.sleep(token_delay())
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def fake_stats():
+        return stats
+
+    return app
+
+
+if __name__ == "__main__":
+    # python -m bench.fake_mistral --latency 0.8 --tokens-per-second 40
+    parser = argparse.ArgumentParser(description="Sustituto local y determinista de la API de Mistral")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.5, help="Segundos hasta el primer token")
+    parser.add_argument("--tokens-per-second", type=float, default=50)
+    parser.add_argument("--reply-tokens", type=int, default=60, help="Tokens de cada respuesta del chat")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de respuestas 503")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    uvicorn.run(
+        create_app(args.latency, args.tokens_per_second, args.reply_tokens, args.error_rate, args.seed),
+        host=args.host, port=args.port, log_level="warning"
+    )
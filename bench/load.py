@@ -0,0 +1,196 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import time
+from datetime import datetime
+
+import httpx
+
+from bench.seed import PASSWORD, PHRASES, username
+
+# Peticiones de cada endpoint: (método, ruta, cuerpo a partir de un generador aleatorio)
+ENDPOINTS = {
+    "chat": ("POST", "/chat", lambda rng: {"content": rng.choice(PHRASES)}),
+    "chat_stream": ("POST", "/chat/stream", lambda rng: {"content": rng.choice(PHRASES)}),
+    "chat_window": ("GET", "/chat", None),
+    "chat_history": ("GET", "/chat/historial", None),
+    "diario": ("GET", "/diario", None),
+    "perfilado": ("GET", "/perfilado", None),
+    "objetivo": ("GET", "/Objetivo", None),
+}
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Percentil por rango más cercano sobre una lista ordenada"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(values: list) -> dict:
+    values = sorted(values)
+    return {
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "max": values[-1] if values else 0.0,
+    }
+
+
+async def login(client: httpx.AsyncClient, users: int) -> list[str]:
+    """Tokens de los usuarios de prueba (creados con bench.seed)"""
+    async def one(index):
+        response = await client.post("/login", json={"username": username(index), "password": PASSWORD})
+        response.raise_for_status()
+        return response.json()["token"]
+    return await asyncio.gather(*(one(index) for index in range(users)))
+
+
+async def server_backend(client: httpx.AsyncClient) -> str:
+    """Motor de base de datos del backend medido, para comparar ejecuciones con MySQL y con SQLite"""
+    try:
+        response = await client.get("/stats")
+        return response.json().get("db_backend")
+    except (httpx.HTTPError, ValueError):
+        return None
+
+
+async def request(client: httpx.AsyncClient, endpoint: str, token: str, rng: random.Random) -> tuple[bool, float, float]:
+    """
+    Una petición al endpoint
+    :return: (correcta, segundos hasta el primer byte, segundos totales)
+    """
+    method, path, body = ENDPOINTS[endpoint]
+    start = time.perf_counter()
+    first_byte = None
+    async with client.stream(method, path, json=body(rng) if body else None,
+                             headers={"Authorization": f"Bearer {token}"}) as response:
+        async for _ in response.aiter_bytes():
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+        total = time.perf_counter() - start
+    return response.status_code < 400, first_byte if first_byte is not None else total, total
+
+
+async def run_level(client: httpx.AsyncClient, endpoint: str, tokens: list, concurrency: int,
+                    requests: int, seed: int) -> dict:
+    """'requests' peticiones con 'concurrency' clientes simultáneos; cada cliente usa un usuario"""
+    rng = random.Random(seed)
+    latencies, first_bytes = [], []
+    errors = 0
+    remaining = requests
+
+    async def worker(index):
+        nonlocal remaining, errors
+        worker_rng = random.Random(rng.random())
+        token = tokens[index % len(tokens)]
+        while remaining > 0:
+            remaining -= 1
+            try:
+                ok, first_byte, total = await request(client, endpoint, token, worker_rng)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            if not ok:
+                errors += 1
+            latencies.append(total)
+            first_bytes.append(first_byte)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(index) for index in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    to_ms = lambda stats: {key: round(value * 1000, 2) for key, value in stats.items()}
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": to_ms(summarize(latencies)),
+        "first_byte_ms": to_ms(summarize(first_bytes)),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(previous: dict, current: dict):
+    """Diferencias de p95 y rendimiento con una ejecución anterior"""
+    backends = previous["meta"].get("db_backend"), current["meta"].get("db_backend")
+    if backends[0] != backends[1]:
+        print(f"Base de datos: {backends[0]} -> {backends[1]}")
+    before = {(r["endpoint"], r["concurrency"]): r for r in previous["results"]}
+    for result in current["results"]:
+        old = before.get((result["endpoint"], result["concurrency"]))
+        if old is None:
+            continue
+        p95, old_p95 = result["latency_ms"]["p95"], old["latency_ms"]["p95"]
+        change = (p95 - old_p95) / old_p95 * 100 if old_p95 else 0.0
+        print(f"{result['endpoint']:>12} x{result['concurrency']:<4} p95 {old_p95:>9.1f} -> {p95:>9.1f} ms "
+              f"({change:+.1f}%), {old['throughput_rps']} -> {result['throughput_rps']} req/s")
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        tokens = await login(client, args.users)
+        backend = await server_backend(client)
+        results = []
+        for endpoint in args.endpoints:
+            for concurrency in args.concurrency:
+                if args.warmup:
+                    await run_level(client, endpoint, tokens, concurrency, args.warmup, args.seed)
+                result = await run_level(client, endpoint, tokens, concurrency, args.requests, args.seed)
+                results.append(result)
+                print(f"{endpoint:>12} x{concurrency:<4} p50 {result['latency_ms']['p50']:>9.1f} ms  "
+                      f"p95 {result['latency_ms']['p95']:>9.1f} ms  p99 {result['latency_ms']['p99']:>9.1f} ms  "
+                      f"{result['throughput_rps']:>8.1f} req/s  errores {result['errors']}")
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "url": args.url,
+            "db_backend": backend,
+            "users": args.users,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Resultados en {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    # python -m bench.load --endpoints chat perfilado --concurrency 1 8 32 --requests 200
+    parser = argparse.ArgumentParser(description="Pruebas de carga de los endpoints de EmotionAI")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=20, help="Usuarios de prueba creados con bench.seed")
+    parser.add_argument("--endpoints", nargs="+", choices=sorted(ENDPOINTS), default=sorted(ENDPOINTS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="Peticiones por endpoint y nivel")
+    parser.add_argument("--warmup", type=int, default=10, help="Peticiones previas que no se miden")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=f"bench/results/{datetime.now():%Y%m%d-%H%M%S}.json")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior con el que comparar")
+    asyncio.run(main(parser.parse_args()))
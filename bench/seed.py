@@ -0,0 +1,84 @@
+import argparse
+import random
+from datetime import date, datetime, timedelta
+
+from migrations import migrate
+from storage import EMOTIONS, Storage, create_storage
+
+# Los usuarios de prueba son bench_0000, bench_0001... con la misma contraseña
+USER_PREFIX = "bench_"
+PASSWORD = "bench-password"
+
+PHRASES = (
+    "hoy me he levantado con energía", "el trabajo ha sido agotador", "he quedado con mis amigos",
+    "no he dormido bien", "me preocupa el examen de la semana que viene", "he salido a correr por el parque",
+    "discutí con mi hermana", "me siento orgulloso de lo que he conseguido", "echo de menos a mi familia",
+    "la reunión salió mejor de lo esperado", "estoy cansado de la rutina", "he empezado un libro nuevo",
+    "me han dado una buena noticia", "tengo miedo de no estar a la altura", "ha sido un día tranquilo",
+)
+
+
+def username(index: int) -> str:
+    return f"{USER_PREFIX}{index:04d}"
+
+
+def random_text(rng: random.Random, sentences: int) -> str:
+    return ". ".join(rng.choice(PHRASES).capitalize() for _ in range(sentences)) + "."
+
+
+def random_emotions(rng: random.Random) -> dict:
+    """Puntuaciones que suman 1, como las de text2emotion"""
+    weights = [rng.random() for _ in EMOTIONS]
+    total = sum(weights)
+    return {emotion: round(weight / total, 2) for emotion, weight in zip(EMOTIONS, weights)}
+
+
+def seed(access_bd: Storage, users: int, days: int, chat_turns: int, end: date, rng: random.Random):
+    """Crear (o completar) los usuarios de prueba con su diario y su historial del chat"""
+    for index in range(users):
+        name = username(index)
+        if access_bd.check_user(name):
+            print(f"{name} ya existe, se omite")
+            continue
+        access_bd.register_user(name, PASSWORD)
+
+        for day in range(days):
+            entry_date = end - timedelta(days=days - 1 - day)
+            access_bd.insert_diary_entry(name, {
+                "date": entry_date.isoformat(),
+                "entry": random_text(rng, rng.randint(2, 8)),
+                "emotions": random_emotions(rng),
+            })
+
+        start = datetime.combine(end - timedelta(days=days), datetime.min.time())
+        turns = []
+        for turn in range(chat_turns):
+            moment = start + timedelta(minutes=turn * max(1, days * 24 * 60 // max(1, chat_turns)))
+            turns.append((name, {
+                "date": moment.strftime("%Y-%m-%d %H:%M:%S"),
+                "human_message": random_text(rng, rng.randint(1, 3)),
+                "bot_message": random_text(rng, rng.randint(2, 5)),
+                "emotions": random_emotions(rng),
+            }))
+        for start_turn in range(0, len(turns), 500):
+            access_bd.insert_chat_history_batch(turns[start_turn:start_turn + 500])
+        print(f"{name}: {days} entradas del diario, {chat_turns} turnos del chat")
+
+
+if __name__ == "__main__":
+    # python -m bench.seed --users 50 --days 365 --chat-turns 200
+    parser = argparse.ArgumentParser(description="Datos de prueba reproducibles para las pruebas de carga")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--days", type=int, default=90, help="Entradas del diario por usuario (una por día)")
+    parser.add_argument("--chat-turns", type=int, default=50, help="Turnos del chat por usuario")
+    parser.add_argument("--end-date", type=date.fromisoformat, default=date(2025, 1, 31),
+                        help="Fecha de la última entrada (YYYY-MM-DD)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    access_bd = create_storage()
+    try:
+        migrate(access_bd)
+        seed(access_bd, args.users, args.days, args.chat_turns, args.end_date, random.Random(args.seed))
+    finally:
+        access_bd.close()
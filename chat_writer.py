@@ -0,0 +1,215 @@
+import asyncio
+import json
+import os
+import random
+import time
+
+
+class ChatHistoryWriter:
+    """
+    Escritura diferida del historial del chat: los turnos se encolan sin esperar a la base de datos
+    y se insertan por lotes (un executemany y un commit por lote).
+    Un lote se escribe al llegar a 'batch_size' turnos o al pasar 'flush_interval' segundos desde el
+    primero, y al cerrar se escribe todo lo pendiente. Si un lote sigue fallando tras los
+    reintentos, se guarda en un fichero JSONL (con fsync) y se vuelve a intentar más tarde.
+    :param db: AsyncAccessBD
+    :param batch_size: Turnos por lote como máximo
+    :param flush_interval: Segundos que un turno puede esperar en la cola
+    :param spool_dir: Directorio de los lotes pendientes de reintentar
+    """
+
+    def __init__(self, db, batch_size: int = None, flush_interval: float = None, spool_dir: str = None):
+        self.db = db
+        self.batch_size = batch_size or int(os.getenv("CHAT_BATCH_SIZE", 50))
+        self.flush_interval = flush_interval if flush_interval is not None else float(os.getenv("CHAT_FLUSH_INTERVAL", 0.5))
+        self.max_retries = int(os.getenv("CHAT_WRITE_RETRIES", 3))
+        self.replay_interval = float(os.getenv("CHAT_REPLAY_INTERVAL", 60))
+        self.spool_dir = spool_dir or os.getenv("CHAT_SPOOL_DIR", ".chat_spool")
+        os.makedirs(self.spool_dir, exist_ok=True)
+        # Un fichero por proceso, para que varios workers no escriban en el mismo
+        self.spool_path = os.path.join(self.spool_dir, f"{os.getpid()}.jsonl")
+        self.queue = asyncio.Queue(maxsize=int(os.getenv("CHAT_QUEUE_MAX", 10000)))
+        # username -> turnos encolados o en un lote que se está escribiendo, del más antiguo al más reciente
+        self._unwritten = {}
+        # Turnos que no cupieron en la cola y esperan a guardarse en el fichero
+        self._overflow = []
+        self._spooling = None
+        self._task = None
+        self._last_replay = 0.0
+        self._stats = {"queued": 0, "written": 0, "batches": 0, "retries": 0, "spooled": 0, "replayed": 0}
+
+    async def start(self):
+        """Reintentar lo que quedó pendiente de ejecuciones anteriores y empezar a escribir"""
+        await self.replay()
+        self._task = asyncio.create_task(self._run())
+
+    def add(self, username: str, turn: dict):
+        """Encolar un turno; no espera a la base de datos"""
+        try:
+            self.queue.put_nowait((username, turn))
+        except asyncio.QueueFull:
+            # Cola llena (la BD no da abasto): no se pierde, va al fichero desde una tarea aparte
+            # (el fsync no puede bloquear el bucle de eventos)
+            self._overflow.append((username, turn))
+            if self._spooling is None:
+                self._spooling = asyncio.create_task(self._spool_overflow())
+        else:
+            self._stats["queued"] += 1
+        self._unwritten.setdefault(username, []).append(turn)
+
+    def pending(self, username: str) -> list[dict]:
+        """Turnos del usuario que aún no están en la base de datos, del más antiguo al más reciente"""
+        return list(self._unwritten.get(username, ()))
+
+    def _forget(self, batch: list):
+        # Los turnos desbordados pueden llegar al fichero antes que los encolados: se quita cada uno
+        for username, turn in batch:
+            turns = self._unwritten.get(username, [])
+            for i, pending in enumerate(turns):
+                if pending is turn:
+                    del turns[i]
+                    break
+            if not turns:
+                self._unwritten.pop(username, None)
+
+    async def _spool_overflow(self):
+        """Guardar en el fichero los turnos que no cupieron en la cola, fuera del bucle de eventos"""
+        try:
+            while self._overflow:
+                batch, self._overflow = self._overflow, []
+                try:
+                    await asyncio.to_thread(self._spool, batch)
+                finally:
+                    self._forget(batch)
+        finally:
+            self._spooling = None
+
+    async def _run(self):
+        # None en la cola indica que hay que cerrar: se escribe lo que haya y se termina
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                await self._write(batch)
+            finally:
+                # Escrito en la BD o en el fichero
+                self._forget(batch)
+            if stop:
+                return
+
+    async def _write(self, batch: list) -> bool:
+        """Escribir un lote con reintentos; si no se consigue, guardarlo en el fichero"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.db.insert_chat_history_batch(batch)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"Error guardando {len(batch)} turnos del chat, se reintentarán más tarde: {e}")
+                    await asyncio.to_thread(self._spool, batch)
+                    return False
+                self._stats["retries"] += 1
+                await asyncio.sleep(random.uniform(0, min(5, 0.2 * 2 ** attempt)))
+                continue
+            self._stats["written"] += len(batch)
+            self._stats["batches"] += 1
+            # La BD vuelve a responder: buen momento para recuperar lo pendiente
+            if self._stats["spooled"] and time.monotonic() - self._last_replay > self.replay_interval:
+                await self.replay()
+            return True
+
+    def _spool(self, batch: list):
+        # Se abre en cada escritura para que un replay pueda reclamar el fichero en cualquier momento
+        with open(self.spool_path, "a", encoding="utf-8") as f:
+            for username, turn in batch:
+                f.write(json.dumps({"username": username, "turn": turn}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._stats["spooled"] += len(batch)
+
+    def _claim_spool(self) -> list:
+        """
+        Reclamar los ficheros pendientes (de este u otros procesos) renombrándolos
+        :return: Lista de (ruta reclamada, turnos)
+        """
+        claimed_files = []
+        for name in sorted(os.listdir(self.spool_dir)):
+            if not name.endswith((".jsonl", ".replay")):
+                continue
+            if name.endswith(".replay") and self._replay_in_progress(name):
+                continue
+            path = os.path.join(self.spool_dir, name)
+            claimed = os.path.join(self.spool_dir, f"{name.split('.')[0]}.{os.getpid()}.replay")
+            try:
+                if path != claimed:
+                    os.replace(path, claimed)
+                with open(claimed, encoding="utf-8") as f:
+                    records = [json.loads(line) for line in f if line.strip()]
+            except (OSError, ValueError) as e:
+                print(f"No se pudo leer {path}: {e}")
+                continue
+            claimed_files.append((claimed, [(record["username"], record["turn"]) for record in records]))
+        return claimed_files
+
+    @staticmethod
+    def _replay_in_progress(name: str) -> bool:
+        """Un '.replay' es de otro proceso que sigue vivo y lo está reintentando"""
+        owner = int(name.split(".")[1])
+        if owner == os.getpid():
+            return False
+        try:
+            os.kill(owner, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    async def replay(self):
+        """
+        Volver a intentar los turnos guardados en los ficheros
+        Cada fichero se borra cuando sus turnos están en la BD (o de nuevo en el fichero de este
+        proceso), así que una caída a mitad puede repetir turnos pero no perderlos
+        """
+        self._last_replay = time.monotonic()
+        for claimed, turns in await asyncio.to_thread(self._claim_spool):
+            for start in range(0, len(turns), self.batch_size):
+                batch = turns[start:start + self.batch_size]
+                try:
+                    await self.db.insert_chat_history_batch(batch)
+                except Exception as e:
+                    print(f"Error reintentando turnos del chat: {e}")
+                    await asyncio.to_thread(self._spool, turns[start:])
+                    break
+                self._stats["replayed"] += len(batch)
+            try:
+                os.remove(claimed)
+            except OSError:
+                pass
+
+    async def close(self):
+        """Escribir todo lo que quede en la cola (y en el desbordamiento) y terminar"""
+        if self._task is not None:
+            await self.queue.put(None)
+            await self._task
+            self._task = None
+        if self._spooling is not None:
+            await self._spooling
+
+    def stats(self) -> dict:
+        return {**self._stats, "pending": self.queue.qsize() + len(self._overflow)}
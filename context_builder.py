@@ -0,0 +1,128 @@
+import hashlib
+import os
+from datetime import date
+
+from lru_cache import LRUCache
+
+
+class ContextBuilder:
+    """
+    Convierte el diario en el texto que se pasa a los prompts, sin superar un presupuesto de tokens.
+    Las entradas más recientes van completas; si no caben todas, las anteriores se resumen por
+    semanas y, si aun así no caben, por meses. Los resúmenes son deterministas (medias de las
+    emociones y extractos), así que el mismo diario produce siempre el mismo texto y las respuestas
+    del LLM siguen pudiendo reutilizarse desde la caché.
+    :param max_tokens: Presupuesto de tokens del texto completo
+    :param recent_share: Parte del presupuesto reservada a las entradas completas
+    :param cache_size: Número máximo de resúmenes memorizados
+    """
+
+    # Estimación habitual: unos 4 caracteres por token
+    CHARS_PER_TOKEN = 4
+    EXCERPTS = 3
+    EXCERPT_CHARS = 160
+
+    def __init__(self, max_tokens: int = None, recent_share: float = 0.7, cache_size: int = None):
+        self.max_tokens = max_tokens or int(os.getenv("CONTEXT_MAX_TOKENS", 4000))
+        self.recent_share = recent_share
+        self.summaries = LRUCache(cache_size or int(os.getenv("CONTEXT_SUMMARY_CACHE_SIZE", 4096)))
+
+    @classmethod
+    def estimate_tokens(cls, text: str) -> int:
+        return len(text) // cls.CHARS_PER_TOKEN + 1
+
+    @staticmethod
+    def format_entry(entry: dict) -> str:
+        """Una entrada completa, en el mismo formato que se usaba en los prompts"""
+        emotions = "".join(f"- {emotion}: {value}\n" for emotion, value in entry["emotions"].items())
+        return f"Fecha: {entry['date']}\nEntrada: {entry['entry']}\nEmociones:\n{emotions}\n"
+
+    @staticmethod
+    def week_label(day: str) -> str:
+        year, week, _ = date.fromisoformat(day).isocalendar()
+        return f"Semana {week} de {year}"
+
+    @staticmethod
+    def month_label(day: str) -> str:
+        return f"Mes {day[:7]}"
+
+    @staticmethod
+    def group(entries: list, label) -> list[tuple[str, list]]:
+        """Agrupar entradas consecutivas (ordenadas por fecha) que comparten etiqueta"""
+        groups = []
+        for entry in entries:
+            key = label(entry["date"])
+            if groups and groups[-1][0] == key:
+                groups[-1][1].append(entry)
+            else:
+                groups.append((key, [entry]))
+        return groups
+
+    def summarize(self, label: str, entries: list) -> str:
+        """Resumen de un periodo: medias de las emociones y el principio de algunas entradas"""
+        digest = hashlib.sha1(repr([(label, e["date"], e["entry"], e["emotions"]) for e in entries]).encode("utf-8"))
+        key = digest.hexdigest()
+        summary = self.summaries.get(key)
+        if summary is not None:
+            return summary
+
+        totals = {}
+        for entry in entries:
+            for emotion, value in entry["emotions"].items():
+                totals[emotion] = totals.get(emotion, 0.0) + float(value)
+        emotions = "".join(f"- {emotion}: {total / len(entries):.2f}\n" for emotion, total in totals.items())
+        # Extractos repartidos por el periodo: primera, central y última entrada
+        step = max(1, len(entries) // self.EXCERPTS)
+        excerpts = "".join(
+            f"- {entry['date']}: {' '.join(entry['entry'].split())[:self.EXCERPT_CHARS]}\n"
+            for entry in entries[::step][:self.EXCERPTS]
+        )
+        summary = (f"Resumen: {label} ({len(entries)} entradas)\n"
+                   f"Emociones medias:\n{emotions}Extractos:\n{excerpts}\n")
+        self.summaries.put(key, summary)
+        return summary
+
+    def build(self, entries: list) -> str:
+        """
+        Texto del diario dentro del presupuesto de tokens
+        :param entries: Entradas del diario ordenadas por fecha ascendente
+        """
+        recent_budget = int(self.max_tokens * self.recent_share)
+        recent = []
+        used = 0
+        # Entradas completas desde la más reciente hacia atrás
+        index = len(entries)
+        while index > 0:
+            text = self.format_entry(entries[index - 1])
+            tokens = self.estimate_tokens(text)
+            if recent and used + tokens > recent_budget:
+                break
+            recent.append(text)
+            used += tokens
+            index -= 1
+        recent.reverse()
+
+        older = entries[:index]
+        if not older:
+            return "".join(recent)
+
+        remaining = self.max_tokens - used
+        summaries = [self.summarize(label, group) for label, group in self.group(older, self.week_label)]
+        if sum(map(self.estimate_tokens, summaries)) > remaining:
+            summaries = [self.summarize(label, group) for label, group in self.group(older, self.month_label)]
+
+        # Si ni los meses caben, se quedan los más recientes y se indica cuántos se omiten
+        kept = []
+        for summary in reversed(summaries):
+            tokens = self.estimate_tokens(summary)
+            if used + tokens > self.max_tokens:
+                break
+            kept.append(summary)
+            used += tokens
+        kept.reverse()
+        omitted = len(summaries) - len(kept)
+        header = [f"({omitted} periodos anteriores omitidos)\n\n"] if omitted else []
+        return "".join(header + kept + recent)
+
+    def stats(self) -> dict:
+        return {"max_tokens": self.max_tokens, "summaries": self.summaries.stats()}
@@ -0,0 +1,111 @@
+import asyncio
+import os
+import threading
+import time
+
+from lru_cache import LRUCache
+
+
+class ConversationStore:
+    """
+    Ventana de la conversación de cada usuario, guardada en el servidor.
+    El cliente solo envía el mensaje nuevo: la ventana se carga de la base de datos la primera vez
+    (los últimos 'window' mensajes) y después se mantiene en memoria con cada turno, recortada a
+    'window' mensajes. Los turnos ya se guardan en la base de datos (ChatHistoryWriter), así que
+    una sesión que sale de la caché no pierde nada: se vuelve a cargar al siguiente mensaje.
+    Al cargarla se añaden los turnos que el writer aún no ha escrito en la base de datos.
+    Con varios workers cada uno tiene su copia: cada 'ttl' segundos se compara el id del último
+    turno guardado del usuario con el que había al cargar la ventana, y si ha cambiado (turnos de
+    otro worker, o los de este ya escritos) se vuelve a leer.
+    :param db: AsyncAccessBD
+    :param writer: ChatHistoryWriter que escribe los turnos de este proceso
+    :param window: Mensajes que se mandan al LLM como historial (usuario y asistente)
+    :param max_users: Conversaciones que se mantienen en memoria
+    :param ttl: Segundos que se usa una ventana sin comprobar si hay turnos nuevos en la base de datos
+    """
+
+    def __init__(self, db, writer=None, window: int = None, max_users: int = None, ttl: float = None):
+        self.db = db
+        self.writer = writer
+        self.window = window or int(os.getenv("CHAT_WINDOW", 20))
+        self.ttl = ttl if ttl is not None else float(os.getenv("CHAT_SESSION_TTL", 600))
+        # username -> [mensajes, id del último turno guardado al cargarla, última comprobación]
+        self.sessions = LRUCache(max_users or int(os.getenv("CHAT_SESSIONS_MAX", 1024)))
+        self._lock = threading.Lock()
+        # Turnos que terminan mientras se carga la sesión: la lectura puede no incluirlos,
+        # porque el historial se escribe en la base de datos por lotes
+        self._pending = {}
+        self._tasks = {}
+
+    @staticmethod
+    def _turn(human_message: str, bot_message: str) -> tuple:
+        return {"role": "user", "content": human_message}, {"role": "assistant", "content": bot_message}
+
+    @staticmethod
+    def _unsaved(messages: list, turns: list) -> list:
+        """Los turnos que no están ya al final de 'messages' (los que se escribieron durante la lectura)"""
+        for saved in range(min(len(turns), len(messages) // 2), 0, -1):
+            if messages[-2 * saved:] == [message for turn in turns[:saved] for message in turn]:
+                return turns[saved:]
+        return turns
+
+    async def _load(self, username: str) -> list:
+        with self._lock:
+            self._pending[username] = []
+            unwritten = [self._turn(turn["human_message"], turn["bot_message"])
+                         for turn in (self.writer.pending(username) if self.writer is not None else ())]
+        try:
+            # El id se lee antes que los turnos: si cambia entre medias, la próxima comprobación recarga
+            last_id = await self.db.get_last_chat_id(username)
+            # get_chat_page desempata por id los turnos guardados en el mismo segundo
+            messages, _ = await self.db.get_chat_page(username, None, self.window // 2)
+        finally:
+            with self._lock:
+                pending = self._pending.pop(username)
+        session = [messages, last_id, time.monotonic()]
+        for turn in self._unsaved(messages, unwritten) + pending:
+            self._add(session, turn)
+        self.sessions.put(username, session)
+        return session
+
+    async def _refresh(self, username: str, session: list) -> list:
+        """Seguir con la ventana si no se han guardado turnos desde que se cargó; si no, recargarla"""
+        if await self.db.get_last_chat_id(username) == session[1]:
+            session[2] = time.monotonic()
+            return session
+        return await self._load(username)
+
+    async def _session(self, username: str) -> list:
+        session = self.sessions.get(username)
+        if session is not None and time.monotonic() - session[2] < self.ttl:
+            return session
+        # Peticiones simultáneas del mismo usuario comparten una sola lectura o comprobación
+        task = self._tasks.get(username)
+        if task is None:
+            task = asyncio.create_task(self._load(username) if session is None else self._refresh(username, session))
+            self._tasks[username] = task
+            task.add_done_callback(lambda _: self._tasks.pop(username, None))
+        return await asyncio.shield(task)
+
+    async def get(self, username: str) -> list[dict]:
+        """Copia de la ventana de la conversación, del mensaje más antiguo al más reciente"""
+        session = await self._session(username)
+        return list(session[0])
+
+    def _add(self, session: list, turn: tuple):
+        session[0].extend(turn)
+        del session[0][:-self.window]
+
+    def add_turn(self, username: str, human_message: str, bot_message: str):
+        """Añadir un turno (mensaje del usuario y respuesta) a la ventana, si está en memoria"""
+        turn = self._turn(human_message, bot_message)
+        with self._lock:
+            if username in self._pending:
+                self._pending[username].append(turn)
+                return
+        session = self.sessions.get(username)
+        if session is not None:
+            self._add(session, turn)
+
+    def stats(self) -> dict:
+        return {"window": self.window, "sessions": self.sessions.stats()}
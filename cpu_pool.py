@@ -0,0 +1,91 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+
+class CPUPoolSaturated(Exception):
+    """Hay demasiadas tareas de CPU en cola; la petición debe rechazarse (503)"""
+
+
+# ----------------------------------------------
+# Tareas que se ejecutan en los procesos del pool (funciones de módulo para poder serializarlas)
+# ----------------------------------------------
+def warm_worker():
+    """Inicializador de cada proceso: carga text2emotion y los datos de NLTK antes de la primera tarea"""
+    from emotion_engine import score_emotions
+    score_emotions("warm up")
+
+
+def hash_password(password: str) -> bytes:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+
+
+def check_password(password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+class CPUPool:
+    """
+    Pool de procesos para el trabajo de CPU puro (análisis de emociones y bcrypt), que en el
+    proceso del servidor competiría por el GIL con el resto de peticiones.
+    La cola está acotada: si hay 'max_pending' tareas pendientes, las nuevas esperan como mucho
+    'wait_timeout' segundos y después se rechazan con CPUPoolSaturated.
+    :param workers: Número de procesos
+    :param max_pending: Tareas en vuelo como máximo (en ejecución más en cola)
+    :param wait_timeout: Segundos que se espera por un hueco en la cola
+    """
+
+    def __init__(self, workers: int = None, max_pending: int = None, wait_timeout: float = None):
+        self.workers = workers or int(os.getenv("CPU_WORKERS", os.cpu_count() or 1))
+        self.max_pending = max_pending or int(os.getenv("CPU_MAX_PENDING", self.workers * 4))
+        self.wait_timeout = wait_timeout if wait_timeout is not None else float(os.getenv("CPU_QUEUE_TIMEOUT", 5))
+        # forkserver: los procesos no heredan los hilos ni las conexiones del servidor, y parten de
+        # un proceso que ya tiene text2emotion importado (nlp_preload, sin las descargas de NLTK)
+        context = multiprocessing.get_context(os.getenv("CPU_POOL_START_METHOD", "forkserver"))
+        if context.get_start_method() == "forkserver":
+            context.set_forkserver_preload(["emotion_engine", "nlp_preload"])
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=warm_worker)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._stats = {"submitted": 0, "rejected": 0, "pending": 0}
+
+    def warm(self):
+        """Arrancar todos los procesos ya, para que la primera petición no pague la carga de NLTK"""
+        for future in [self.executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def _release(self, _future):
+        with self._lock:
+            self._stats["pending"] -= 1
+        self._slots.release()
+
+    def submit(self, fn, *args):
+        """Encolar una tarea; bloquea como mucho 'wait_timeout' si la cola está llena"""
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise CPUPoolSaturated("Demasiadas tareas de CPU en cola")
+        with self._lock:
+            self._stats["submitted"] += 1
+            self._stats["pending"] += 1
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, fn, *args):
+        """Ejecutar una tarea en el pool y esperar al resultado"""
+        return self.submit(fn, *args).result()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "workers": self.workers, "max_pending": self.max_pending}
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
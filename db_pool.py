@@ -0,0 +1,149 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    """No se ha podido obtener una conexión del pool a tiempo"""
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones genérico y seguro entre hilos.
+    :param factory: Función sin argumentos que abre una conexión nueva
+    :param size: Número máximo de conexiones abiertas a la vez
+    :param timeout: Segundos que se espera por una conexión libre antes de fallar
+    :param ping: Función que recibe una conexión y lanza una excepción si está caída
+    :param ping_after: Segundos ociosa a partir de los que una conexión se comprueba antes de usarla
+    :param reset: Función que deja limpia una conexión al devolverla (p. ej. deshacer una transacción abierta)
+    """
+
+    def __init__(self, factory, size: int = 5, timeout: float = 30, ping=None, ping_after: float = 30,
+                 reset=None):
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self.ping = ping
+        self.ping_after = ping_after
+        self.reset = reset
+        # LIFO para reutilizar primero las conexiones más "calientes"
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "in_use": 0,
+            "created": 0,
+            "pings": 0,
+            "reconnects": 0,
+            "discarded": 0,
+            "timeouts": 0,
+            "wait_seconds": 0.0,
+        }
+
+    def _count(self, key: str, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _open(self):
+        conn = self.factory()
+        self._count("created")
+        return conn
+
+    def _discard(self, conn):
+        self._count("discarded")
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        """Sacar una conexión del pool, esperando si están todas en uso"""
+        if self._closed:
+            raise PoolTimeout("El pool está cerrado")
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            self._count("timeouts")
+            raise PoolTimeout(f"No hay conexiones libres tras {self.timeout}s")
+        self._count("wait_seconds", time.perf_counter() - start)
+
+        try:
+            try:
+                conn, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._open()
+            else:
+                # Pre-ping solo de las que llevan un rato ociosas (pueden haber caducado en el
+                # servidor): hacerlo en cada préstamo añadiría una ida y vuelta a cada operación
+                if self.ping is not None and time.monotonic() - released_at >= self.ping_after:
+                    self._count("pings")
+                    try:
+                        self.ping(conn)
+                    except Exception:
+                        self._count("reconnects")
+                        self._discard(conn)
+                        conn = self._open()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+        return conn
+
+    def release(self, conn, discard: bool = False):
+        """Devolver una conexión al pool, o cerrarla si ha quedado en mal estado"""
+        with self._lock:
+            self._stats["in_use"] -= 1
+        try:
+            if not discard and not self._closed and self.reset is not None:
+                try:
+                    self.reset(conn)
+                except Exception:
+                    discard = True
+            if discard or self._closed:
+                self._discard(conn)
+            else:
+                try:
+                    self._idle.put_nowait((conn, time.monotonic()))
+                except queue.Full:
+                    self._discard(conn)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Uso: with pool.connection() as conn: ..."""
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            # Deshacer lo que haya quedado a medias; si ni eso funciona, la conexión no vale
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            self.release(conn, discard=broken)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["size"] = self.size
+        stats["idle"] = self._idle.qsize()
+        return stats
+
+    def close(self):
+        """Cerrar todas las conexiones ociosas; las que estén en uso se cierran al devolverse"""
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
@@ -0,0 +1,171 @@
+import argparse
+import hashlib
+import os
+import threading
+import time
+
+from lru_cache import LRUCache
+
+# Datos de NLTK que necesitan text2emotion y el tokenizador
+NLTK_RESOURCES = {
+    "punkt": "tokenizers/punkt",
+    "punkt_tab": "tokenizers/punkt_tab",
+    "stopwords": "corpora/stopwords",
+    "wordnet": "corpora/wordnet",
+    "omw-1.4": "corpora/omw-1.4",
+}
+
+
+def check_nltk_data(download: bool = False) -> list[str]:
+    """
+    Comprobar sin red que los datos de NLTK están instalados (en NLTK_DATA o las rutas por defecto)
+    :param download: Descargar los que falten en lugar de solo informar
+    :return: Lista de paquetes que faltan
+    """
+    import nltk
+    missing = []
+    for package, resource in NLTK_RESOURCES.items():
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            missing.append(package)
+    if download and missing:
+        for package in missing:
+            nltk.download(package, download_dir=os.getenv("NLTK_DATA"), quiet=True)
+        return check_nltk_data(download=False)
+    return missing
+
+
+_text2emotion = None
+_text2emotion_lock = threading.Lock()
+
+
+def load_text2emotion():
+    """
+    Importar text2emotion sin red
+    Al importarse llama a nltk.download, que consulta el índice remoto aunque los datos ya estén
+    instalados; si check_nltk_data no echa nada en falta, esas llamadas se anulan durante el import
+    """
+    global _text2emotion
+    if _text2emotion is None:
+        import nltk
+        with _text2emotion_lock:
+            if _text2emotion is None:
+                download = nltk.download
+                if not check_nltk_data():
+                    nltk.download = lambda *args, **kwargs: True
+                try:
+                    import text2emotion
+                finally:
+                    nltk.download = download
+                _text2emotion = text2emotion
+    return _text2emotion
+
+
+def score_emotions(text: str) -> dict:
+    """Puntuación de text2emotion para un texto: {"Happy", "Angry", "Surprise", "Sad", "Fear"}"""
+    return load_text2emotion().get_emotion(text)
+
+
+def score_emotions_batch(texts: list[str]) -> list[dict]:
+    """Puntuar varios textos de una pasada"""
+    te = load_text2emotion()
+    return [te.get_emotion(text) for text in texts]
+
+
+class EmotionEngine:
+    """
+    Análisis de emociones sobre text2emotion con memo y API por lotes.
+    El resultado es exactamente el de text2emotion.get_emotion: se puntúa el texto tal cual llega
+    (sin colapsar espacios, porque su tratamiento de "not" depende de ellos) y el memo usa el hash
+    del texto exacto.
+    :param cache_size: Número máximo de textos memorizados
+    """
+
+    def __init__(self, cache_size: int = None):
+        self.cache = LRUCache(cache_size or int(os.getenv("EMOTION_CACHE_SIZE", 4096)))
+        # Pool de procesos opcional (cpu_pool.CPUPool) donde puntuar los textos
+        self.pool = None
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "scored": 0, "seconds": 0.0, "last_seconds": 0.0, "max_seconds": 0.0}
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _score(self, texts: list[str]) -> list[dict]:
+        """Puntuar los textos que no están en memo, en el pool de procesos si hay uno"""
+        if self.pool is None:
+            return score_emotions_batch(texts)
+        return self.pool.run(score_emotions_batch, texts)
+
+    def _record(self, calls: int, scored: int, seconds: float):
+        with self._lock:
+            self._stats["calls"] += calls
+            self._stats["scored"] += scored
+            self._stats["seconds"] += seconds
+            self._stats["last_seconds"] = seconds
+            self._stats["max_seconds"] = max(self._stats["max_seconds"], seconds)
+
+    def analyze_timed(self, text: str) -> tuple[dict, float]:
+        """Emociones de un texto y segundos que ha costado obtenerlas"""
+        start = time.perf_counter()
+        key = self.key(text)
+        emotions = self.cache.get(key)
+        scored = 0
+        if emotions is None:
+            emotions = self._score([text])[0]
+            self.cache.put(key, emotions)
+            scored = 1
+        seconds = time.perf_counter() - start
+        self._record(1, scored, seconds)
+        return dict(emotions), seconds
+
+    def analyze(self, text: str) -> dict:
+        """Mismo resultado que text2emotion.get_emotion(text)"""
+        return self.analyze_timed(text)[0]
+
+    def analyze_batch(self, texts: list[str]) -> list[dict]:
+        """
+        Emociones de varios textos, en el mismo orden
+        Los textos repetidos o ya memorizados no se vuelven a puntuar y el resto se puntúa de una vez
+        """
+        start = time.perf_counter()
+        keys = []
+        pending = {}
+        results = {}
+        for text in texts:
+            key = self.key(text)
+            keys.append(key)
+            if key in results or key in pending:
+                continue
+            emotions = self.cache.get(key)
+            if emotions is None:
+                pending[key] = text
+            else:
+                results[key] = emotions
+        if pending:
+            for key, emotions in zip(pending, self._score(list(pending.values()))):
+                self.cache.put(key, emotions)
+                results[key] = emotions
+        self._record(len(texts), len(pending), time.perf_counter() - start)
+        return [dict(results[key]) for key in keys]
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["avg_seconds"] = stats["seconds"] / stats["calls"] if stats["calls"] else 0.0
+        stats["cache"] = self.cache.stats()
+        return stats
+
+
+if __name__ == "__main__":
+    # Para empaquetar los datos de NLTK en la imagen: NLTK_DATA=./nltk_data python emotion_engine.py --download
+    parser = argparse.ArgumentParser(description="Datos de NLTK para el análisis de emociones")
+    parser.add_argument("--download", action="store_true", help="Descargar los paquetes que falten")
+    args = parser.parse_args()
+    missing = check_nltk_data(download=args.download)
+    if missing:
+        print("Faltan datos de NLTK:", ", ".join(missing))
+        raise SystemExit(1)
+    print("Datos de NLTK instalados")
@@ -1,7 +1,9 @@
 import streamlit as st
 import requests
 import datetime
+import json
 import os
+import time
 
 st.markdown(
     """
@@ -94,8 +96,8 @@ if "logged_in" not in st.session_state:
     st.session_state.logged_in = False
 if "username" not in st.session_state:
     st.session_state.username = ""
-if "password" not in st.session_state:
-    st.session_state.password = ""
+if "token" not in st.session_state:
+    st.session_state.token = ""
 if "messages" not in st.session_state:
     st.session_state.messages = []
 if "diary_text" not in st.session_state:
@@ -106,7 +108,73 @@ if "edit_mode" not in st.session_state:
 #URL="http://localhost:8000"
 URL = "https://hackudc.onrender.com"
 
-def send_message():
+def auth_headers() -> dict:
+    """Cabecera con el token de sesión emitido por /login"""
+    return {"Authorization": f"Bearer {st.session_state.token}"}
+
+def logout():
+    st.session_state.logged_in = False
+    st.session_state.username = ""
+    st.session_state.token = ""
+    st.session_state.messages = []
+    st.session_state.edit_mode = False
+    st.session_state.started_chat = False
+
+def check_session(response):
+    """Si el token ha caducado, volver a la pantalla de login"""
+    if response.status_code == 401:
+        logout()
+        st.warning("Tu sesión ha caducado. Vuelve a iniciar sesión.")
+        st.stop()
+
+def chat_bubble(role: str, content: str) -> str:
+    """HTML de una burbuja del chat"""
+    author = "Tú" if role == "user" else "Chatbot"
+    return f"""
+        <div class="chat-container chat-message {role}">
+            <div class="chat-bubble">
+                <strong>{author}:</strong> {content}
+            </div>
+        </div>
+        """
+
+def stream_chat(payload: dict):
+    """Fragmentos de la respuesta del chatbot según llegan desde /chat/stream (Server-Sent Events)"""
+    with requests.post(f"{URL}/chat/stream", json=payload, headers=auth_headers(), stream=True) as response:
+        check_session(response)
+        if not response.ok:
+            yield "Error al procesar tu mensaje."
+            return
+        for line in response.iter_lines(decode_unicode=True):
+            if line and line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if "delta" in data:
+                    yield data["delta"]
+
+def run_job(path: str, text: str) -> dict:
+    """
+    Pedir un análisis en segundo plano y consultar su estado hasta que termine, con una barra de progreso
+    Devuelve el trabajo terminado (o con error), o None si no se pudo pedir
+    """
+    response = requests.post(f"{URL}{path}", headers=auth_headers())
+    check_session(response)
+    if not response.ok:
+        return None
+    job = response.json()["trabajo"]
+    progress = st.progress(0.0, text=text)
+    while job["estado"] in ("pendiente", "en_curso"):
+        time.sleep(1)
+        response = requests.get(f"{URL}/trabajo", params={"id": job["id"]}, headers=auth_headers())
+        check_session(response)
+        if not response.ok:
+            job = None
+            break
+        job = response.json()["trabajo"]
+        progress.progress(job["progreso"], text=job["mensaje"] or text)
+    progress.empty()
+    return job
+
+def send_message(container):
     user_input = st.session_state.get("user_input", "")
     if user_input:
         st.session_state.messages.append({"role": "user", "content": user_input})
@@ -115,13 +183,18 @@ def send_message():
             # Eliminamos el primero de la IA y el primero del usuario
             st.session_state.messages.pop(0)
             st.session_state.messages.pop(0)
-        payload = {"messages": st.session_state.messages, "username": st.session_state.username}
-        response = requests.post(f"{URL}/chat", json=payload)
-        if response.ok:
-            data = response.json()
-            assistant_response = data.get("respuesta", "No se obtuvo respuesta.")
-        else:
-            assistant_response = "Error al procesar tu mensaje."
+        # Solo el mensaje nuevo: el servidor guarda el resto de la conversación
+        payload = {"content": user_input}
+        # Pintar la respuesta a medida que llega, en lugar de esperar a que esté completa
+        with container:
+            st.markdown(chat_bubble("user", user_input), unsafe_allow_html=True)
+            placeholder = st.empty()
+        assistant_response = ""
+        for fragment in stream_chat(payload):
+            assistant_response += fragment
+            placeholder.markdown(chat_bubble("assistant", assistant_response + "▌"), unsafe_allow_html=True)
+        if not assistant_response:
+            assistant_response = "No se obtuvo respuesta."
         st.session_state.messages.append({"role": "assistant", "content": assistant_response})
 
 # Página Home (sin autenticación)
@@ -142,7 +215,7 @@ if not st.session_state.logged_in:
                     st.success("¡Login exitoso!")
                     st.session_state.logged_in = True
                     st.session_state.username = username
-                    st.session_state.password = password
+                    st.session_state.token = response.json()["token"]
                     st.session_state.started_chat = False
                     st.rerun()
                 else:
@@ -166,18 +239,14 @@ else:
     service_option = st.sidebar.radio("Selecciona un servicio:", ["Chatbot", "Diario", "Perfilado", "Objetivo"])
     
     if st.sidebar.button("Cerrar sesión"):
-        st.session_state.logged_in = False
-        st.session_state.username = ""
-        st.session_state.password = ""
-        st.session_state.messages = []
-        st.session_state.edit_mode = False
-        st.session_state.started_chat = False
+        logout()
         st.rerun()
     
     if service_option == "Chatbot":
         st.title("Chatbot Emocional - Guía Psicológica")
         if not st.session_state.started_chat:
-            response = requests.get(f"{URL}/start_chat", params={"username": st.session_state.username})
+            response = requests.get(f"{URL}/chat", headers=auth_headers())
+            check_session(response)
             if response.status_code == 200:
                 data = response.json()
                 conversation = response.json().get("conversation", [])
@@ -190,56 +259,34 @@ else:
         with conversation_container:
             st.markdown("### Conversación")
             for msg in st.session_state.messages:
-                if msg["role"] == "user":
-                    st.markdown(
-                        f"""
-                        <div class="chat-container chat-message user">
-                            <div class="chat-bubble">
-                                <strong>Tú:</strong> {msg['content']}
-                            </div>
-                        </div>
-                        """, unsafe_allow_html=True
-                    )
-                else:
-                    st.markdown(
-                        f"""
-                        <div class="chat-container chat-message assistant">
-                            <div class="chat-bubble">
-                                <strong>Chatbot:</strong> {msg['content']}
-                            </div>
-                        </div>
-                        """, unsafe_allow_html=True
-                    )
+                st.markdown(chat_bubble(msg["role"], msg["content"]), unsafe_allow_html=True)
         input_container = st.container()
         with input_container:
             with st.form(key="chat_form", clear_on_submit=True):
                 st.text_input("Ingresa tu mensaje", key="user_input", placeholder="Escribe aquí tu mensaje...")
                 submitted = st.form_submit_button("Enviar")
                 if submitted:
-                    send_message()
+                    send_message(conversation_container)
                     st.rerun()
                     
     elif service_option == "Diario":
         st.title("Diario Emocional")
-        params = {"username": st.session_state.username, "password": st.session_state.password}
-        response = requests.get(f"{URL}/diario", params=params)
-        diary_entries = []
-        if response.ok:
-            data = response.json()
-            diary_entries = data.get("diario", [])
-        else:
-            st.error("Error al obtener las entradas del diario.")
-        
-        diary_by_date = {}
-        for entry in diary_entries:
-            day = entry["date"][:10]
-            diary_by_date.setdefault(day, []).append(entry)
-        
         st.subheader("Selecciona la fecha")
         selected_date = st.date_input("Fecha", value=datetime.date.today())
         selected_date_str = selected_date.strftime("%Y-%m-%d")
 
-        entries = diary_by_date.get(selected_date_str, [])
+        # Pedir solo el día seleccionado, no todo el diario
+        response = requests.get(
+            f"{URL}/diario",
+            params={"desde": selected_date_str, "hasta": selected_date_str},
+            headers=auth_headers()
+        )
+        check_session(response)
+        entries = []
+        if response.ok:
+            entries = response.json().get("diario", [])
+        else:
+            st.error("Error al obtener las entradas del diario.")
         if entries:
             for entry in entries:
                 st.markdown(
@@ -268,13 +315,12 @@ else:
             submitted = st.form_submit_button("Actualizar entrada")
             if submitted:
                 payload = {
-                    "username": st.session_state.username,
-                    "password": st.session_state.password,
                     "entry": new_diary_input,
                     "fecha": selected_date_str,
                     "editar": st.session_state.edit_mode
                 }
-                response = requests.post(f"{URL}/diario", json=payload)
+                response = requests.post(f"{URL}/diario", json=payload, headers=auth_headers())
+                check_session(response)
                 if response.ok:
                     st.success("¡Entrada actualizada y sobreescrita!")
                     st.session_state.diary_text = ""
@@ -284,10 +330,9 @@ else:
                     st.error("Error al actualizar la entrada.")
     
     elif service_option == "Objetivo":
-        params = {"username": st.session_state.username, "password": st.session_state.password}
-        response = requests.get(f"{URL}/Objetivo", params=params)
-        if response.ok:
-            data = response.json()
+        job = run_job("/Objetivo", "Generando tus objetivos...")
+        if job is not None and job["estado"] == "terminado":
+            data = job["resultado"]
             objetivos = data.get("objetivo", {"objetivos": []})
             st.markdown("### Objetivos de Mejora")
             if objetivos["objetivos"]:
@@ -302,11 +347,10 @@ else:
     
     elif service_option == "Perfilado":
         st.title("Perfil de Personalidad")
-        params = {"username": st.session_state.username, "password": st.session_state.password}
-        response = requests.get(f"{URL}/perfilado", params=params)
+        job = run_job("/perfilado", "Analizando tu diario...")
 
-        if response.ok:
-            data = response.json()
+        if job is not None and job["estado"] == "terminado":
+            data = job["resultado"]
 
             perfil = data.get("perfil", {})
             eneagrama = data['perfil'].get("eneagrama", "No se obtuvo un eneagrama.")
@@ -368,9 +412,13 @@ else:
                 st.plotly_chart(fig_radar)
                                 
                 st.markdown("### Eneagrama")
-                st.markdown(f"<p style='font-size: 20px;'>{eneagrama['eneagrama_type']}</p>", unsafe_allow_html=True)
-                st.markdown(f"<p style='font-size: 20px;'>{eneagrama['description']}</p>", unsafe_allow_html=True)
-                st.markdown(f"<p style='font-size: 20px;'>{eneagrama['recommendation']}</p>", unsafe_allow_html=True)
+                if eneagrama:
+                    st.markdown(f"<p style='font-size: 20px;'>{eneagrama.get('eneagrama_type', '')}</p>", unsafe_allow_html=True)
+                    st.markdown(f"<p style='font-size: 20px;'>{eneagrama.get('description', '')}</p>", unsafe_allow_html=True)
+                    st.markdown(f"<p style='font-size: 20px;'>{eneagrama.get('recommendation', '')}</p>", unsafe_allow_html=True)
+
+                if data.get("pendientes"):
+                    st.info("Parte del análisis todavía se está calculando. Vuelve a abrir esta página en unos segundos para verlo completo.")
 
 
                 
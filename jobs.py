@@ -0,0 +1,172 @@
+import asyncio
+import os
+import time
+import uuid
+
+from fastapi import HTTPException
+
+# Estados de un trabajo; los dos últimos son definitivos
+PENDIENTE, EN_CURSO, TERMINADO, ERROR = "pendiente", "en_curso", "terminado", "error"
+
+
+class JobQueueFull(Exception):
+    """Hay demasiados trabajos en cola"""
+
+
+class JobQueue:
+    """
+    Cola de trabajos en segundo plano para los análisis largos (perfilado y objetivos).
+    submit devuelve el trabajo enseguida y 'workers' tareas de asyncio los van ejecutando; cada
+    trabajo informa de su progreso y el cliente consulta el estado hasta que termina.
+    Un usuario no tiene dos trabajos del mismo tipo a la vez: pedirlo de nuevo devuelve el que ya está.
+    Si se le pasa la base de datos, el estado también se guarda en la tabla 'jobs': así cualquier
+    worker puede responder por un trabajo y los resultados sobreviven a un reinicio. Un trabajo sin
+    terminar de otro proceso que no se actualiza en 'timeout' segundos se da por perdido.
+    :param db: AsyncAccessBD, para guardar los trabajos; None para tenerlos solo en memoria
+    :param workers: Trabajos que se ejecutan a la vez
+    :param max_pending: Trabajos en cola como máximo antes de rechazar nuevos
+    :param ttl: Segundos que se conserva un trabajo terminado
+    """
+
+    def __init__(self, db=None, workers: int = None, max_pending: int = None, ttl: float = None):
+        self.db = db
+        self.workers = workers or int(os.getenv("JOB_WORKERS", 2))
+        self.ttl = ttl if ttl is not None else float(os.getenv("JOB_TTL", 3600))
+        self.timeout = float(os.getenv("JOB_TIMEOUT", 600))
+        self.queue = asyncio.Queue(maxsize=max_pending or int(os.getenv("JOB_QUEUE_MAX", 100)))
+        self.handlers = {}
+        self.jobs = {}
+        # (usuario, tipo) -> id del trabajo que aún no ha terminado
+        self._active = {}
+        self._tasks = []
+        self._purge_task = None
+        self._stats = {"submitted": 0, "deduplicated": 0, "completed": 0, "failed": 0, "rejected": 0}
+
+    def register(self, kind: str, handler):
+        """
+        Registrar un tipo de trabajo
+        :param handler: async handler(username, progreso) -> dict, donde progreso(fracción, mensaje)
+                        actualiza el avance del trabajo
+        """
+        self.handlers[kind] = handler
+
+    async def start(self):
+        if self.db is not None:
+            await self.db.delete_jobs(time.time() - self.ttl)
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+        self._purge_task = asyncio.create_task(self._purge())
+
+    async def submit(self, username: str, kind: str) -> dict:
+        """Encolar un trabajo (o devolver el que ya tiene el usuario en marcha) sin esperar a que se ejecute"""
+        job_id = self._active.get((username, kind))
+        if job_id is not None:
+            self._stats["deduplicated"] += 1
+            return self.public(self.jobs[job_id])
+
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex, "user": username, "kind": kind, "status": PENDIENTE, "progress": 0.0,
+            "message": None, "result": None, "error": None, "created_at": now, "updated_at": now,
+        }
+        try:
+            self.queue.put_nowait(job["id"])
+        except asyncio.QueueFull:
+            self._stats["rejected"] += 1
+            raise JobQueueFull(f"Hay {self.queue.qsize()} trabajos en cola")
+        self.jobs[job["id"]] = job
+        self._active[(username, kind)] = job["id"]
+        self._stats["submitted"] += 1
+        await self._save(job)
+        return self.public(job)
+
+    async def get(self, job_id: str, username: str) -> dict:
+        """Estado de un trabajo del usuario; None si no existe o es de otro usuario"""
+        job = self.jobs.get(job_id)
+        if job is None and self.db is not None:
+            # Puede haberlo creado otro worker, que quizá ya no existe
+            job = await self.db.get_job(job_id)
+            if (job is not None and job["status"] in (PENDIENTE, EN_CURSO)
+                    and time.time() - job["updated_at"] > self.timeout):
+                job = {**job, "status": ERROR, "error": "El trabajo se interrumpió; vuelve a pedirlo"}
+        if job is None or job["user"] != username:
+            return None
+        return self.public(job)
+
+    @staticmethod
+    def public(job: dict) -> dict:
+        """Lo que ve el cliente de un trabajo"""
+        return {
+            "id": job["id"],
+            "tipo": job["kind"],
+            "estado": job["status"],
+            "progreso": round(job["progress"], 2),
+            "mensaje": job["message"],
+            "resultado": job["result"],
+            "error": job["error"],
+        }
+
+    async def _save(self, job: dict):
+        if self.db is None:
+            return
+        try:
+            await self.db.save_job(job)
+        except Exception as e:
+            # El trabajo sigue en memoria; solo deja de verse desde otros workers
+            print(f"Error guardando el trabajo {job['id']}: {e}")
+
+    async def _update(self, job: dict, **changes):
+        job.update(changes, updated_at=time.time())
+        await self._save(job)
+
+    async def _run(self):
+        while True:
+            job_id = await self.queue.get()
+            if job_id is None:
+                return
+            job = self.jobs[job_id]
+
+            async def progreso(fraction: float, message: str = None):
+                await self._update(job, progress=max(0.0, min(1.0, fraction)), message=message)
+
+            await self._update(job, status=EN_CURSO)
+            try:
+                result = await self.handlers[job["kind"]](job["user"], progreso)
+            except HTTPException as e:
+                await self._update(job, status=ERROR, error=e.detail)
+                self._stats["failed"] += 1
+            except Exception as e:
+                print(f"Error en el trabajo {job['kind']} de {job['user']}: {e}")
+                await self._update(job, status=ERROR, error="Error interno")
+                self._stats["failed"] += 1
+            else:
+                await self._update(job, status=TERMINADO, progress=1.0, message=None, result=result)
+                self._stats["completed"] += 1
+            finally:
+                self._active.pop((job["user"], job["kind"]), None)
+
+    async def _purge(self):
+        """Olvidar los trabajos terminados hace más de 'ttl' segundos"""
+        while True:
+            await asyncio.sleep(min(self.ttl, 600))
+            cutoff = time.time() - self.ttl
+            for job_id, job in list(self.jobs.items()):
+                if job["status"] in (TERMINADO, ERROR) and job["updated_at"] < cutoff:
+                    del self.jobs[job_id]
+            if self.db is not None:
+                try:
+                    await self.db.delete_jobs(cutoff)
+                except Exception as e:
+                    print(f"Error borrando trabajos antiguos: {e}")
+
+    async def close(self):
+        """Terminar los trabajos en curso; los que siguen en cola se descartan"""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        for _ in self._tasks:
+            self.queue.put_nowait(None)
+        if self._purge_task is not None:
+            self._purge_task.cancel()
+        await asyncio.gather(*self._tasks, *filter(None, [self._purge_task]), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {**self._stats, "queued": self.queue.qsize(), "active": len(self._active), "in_memory": len(self.jobs)}
@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+
+class LLMCache:
+    """
+    Caché persistente en disco para los análisis que devuelve el LLM.
+    La clave es el hash de la entrada exacta del prompt (nombre, versión y mensajes), así que
+    una respuesta solo se reutiliza si el diario y el prompt no han cambiado.
+    Cada usuario tiene su propio directorio para poder invalidar sus entradas de golpe.
+    :param directory: Directorio donde se guardan las respuestas
+    :param ttl: Segundos que es válida una respuesta
+    :param max_entries: Número máximo de respuestas; al superarlo se borran las menos usadas
+    """
+
+    def __init__(self, directory: str = None, ttl: float = None, max_entries: int = None):
+        self.directory = directory or os.getenv("LLM_CACHE_DIR", ".llm_cache")
+        self.ttl = ttl if ttl is not None else float(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+        self.max_entries = max_entries or int(os.getenv("LLM_CACHE_MAX_ENTRIES", 10000))
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entries = sum(1 for _ in self._files())
+        # Cálculos en curso, para que peticiones idénticas simultáneas compartan una llamada
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(name: str, version: int, messages: list[dict]) -> str:
+        """Hash de la entrada exacta del prompt"""
+        payload = json.dumps({"name": name, "version": version, "messages": messages},
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _user_dir(self, username: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(username.encode("utf-8")).hexdigest()[:16])
+
+    def _files(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    yield os.path.join(root, name)
+
+    def _count(self, key: str, amount: int = 1):
+        with self._lock:
+            setattr(self, key, getattr(self, key) + amount)
+
+    def get(self, username: str, key: str):
+        """Devuelve el valor guardado, o None si no existe o ha caducado"""
+        path = os.path.join(self._user_dir(username), key + ".json")
+        try:
+            with open(path, encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            self._count("misses")
+            return None
+        if time.time() - record["created"] > self.ttl:
+            self._count("expirations")
+            self._count("misses")
+            self._remove(path)
+            return None
+        # La fecha de modificación marca el último uso, para el desalojo LRU
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._count("hits")
+        return record["value"]
+
+    def put(self, username: str, key: str, value):
+        user_dir = self._user_dir(username)
+        os.makedirs(user_dir, exist_ok=True)
+        path = os.path.join(user_dir, key + ".json")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"created": time.time(), "value": value}, f, ensure_ascii=False)
+        existed = os.path.exists(path)
+        os.replace(tmp_path, path)
+        if not existed:
+            self._count("_entries")
+        if self._entries > self.max_entries:
+            self._evict()
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        self._count("_entries", -1)
+
+    def _evict(self):
+        """Borrar las respuestas menos usadas hasta quedar en el 90% del máximo"""
+        files = []
+        for path in self._files():
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        files.sort()
+        target = int(self.max_entries * 0.9)
+        with self._lock:
+            self._entries = len(files)
+        for _, path in files[:max(0, len(files) - target)]:
+            self._remove(path)
+            self._count("evictions")
+
+    def invalidate(self, username: str):
+        """Borrar todas las respuestas guardadas de un usuario"""
+        user_dir = self._user_dir(username)
+        removed = sum(1 for name in os.listdir(user_dir) if name.endswith(".json")) if os.path.isdir(user_dir) else 0
+        shutil.rmtree(user_dir, ignore_errors=True)
+        if removed:
+            self._count("_entries", -removed)
+            self._count("invalidations")
+
+    async def get_or_compute(self, username: str, key: str, compute):
+        """
+        Devuelve el valor guardado para la clave o lo calcula con 'compute' (corrutina sin argumentos)
+        Si 'compute' devuelve None no se guarda nada, para no cachear respuestas inválidas
+        """
+        value = await asyncio.to_thread(self.get, username, key)
+        if value is not None:
+            return value
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+            if value is not None:
+                await asyncio.to_thread(self.put, username, key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Marcar la excepción como recuperada aunque nadie más esté esperando
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": self._entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
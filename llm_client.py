@@ -0,0 +1,187 @@
+import asyncio
+import os
+import random
+import time
+
+import httpx
+from dotenv import load_dotenv
+
+from metrics import record_llm_usage
+
+load_dotenv()
+
+# Respuesta del chat cuando el LLM no está disponible
+FALLBACK_RESPONSE = "Ahora mismo no puedo responderte. Inténtalo de nuevo en unos minutos."
+
+# Códigos HTTP que indican un fallo pasajero del proveedor
+TRANSIENT_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class LLMUnavailable(Exception):
+    """El LLM no ha respondido tras los reintentos, o el circuito está abierto"""
+
+
+class CircuitBreaker:
+    """
+    Tras 'threshold' fallos seguidos deja de llamar al proveedor durante 'cooldown' segundos.
+    Pasado ese tiempo deja pasar una llamada de prueba: si va bien se cierra, si no vuelve a abrirse.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def record_cancelled(self):
+        """
+        Una llamada cancelada (cliente desconectado, cierre) no dice nada del proveedor, pero si era
+        la de prueba cuenta como fallo: si no, el circuito se quedaría esperando una prueba que no acaba
+        """
+        if self.probing:
+            self.record_failure()
+
+
+class LLMClient:
+    """
+    Cliente de Mistral de larga duración: se crea una vez al arrancar la aplicación y reutiliza
+    las conexiones HTTP (keep-alive y sesiones TLS) entre llamadas.
+    Cada llamada tiene un plazo máximo, los fallos pasajeros se reintentan con espera exponencial
+    con jitter y, si el proveedor falla de forma continuada, el circuito se abre y las llamadas
+    fallan al momento con LLMUnavailable.
+    """
+
+    def __init__(self, api_key: str = None, model: str = None, server_url: str = None):
+        from mistralai import Mistral
+
+        self.model = model or os.getenv("MISTRAL_MODEL", "mistral-large-latest")
+        self.timeout = float(os.getenv("LLM_TIMEOUT", 60))
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", 2))
+        self.backoff_base = float(os.getenv("LLM_BACKOFF_BASE", 0.5))
+        self.backoff_max = float(os.getenv("LLM_BACKOFF_MAX", 8))
+        self.breaker = CircuitBreaker(
+            threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", 5)),
+            cooldown=float(os.getenv("LLM_BREAKER_COOLDOWN", 30))
+        )
+        max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", 20))
+        self.http = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        # MISTRAL_SERVER_URL apunta a otro servidor compatible (por ejemplo bench/fake_mistral.py)
+        server_url = server_url or os.getenv("MISTRAL_SERVER_URL")
+        self.client = Mistral(api_key=api_key or os.environ["MISTRAL_API_KEY"], async_client=self.http,
+                              **({"server_url": server_url} if server_url else {}))
+        self._stats = {"calls": 0, "failures": 0, "retries": 0, "rejected": 0}
+
+    @staticmethod
+    def is_transient(error: Exception) -> bool:
+        """Errores de red, plazos agotados y respuestas 429/5xx merecen un reintento"""
+        if isinstance(error, (httpx.TransportError, asyncio.TimeoutError)):
+            return True
+        return getattr(error, "status_code", None) in TRANSIENT_STATUS
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": espera aleatoria hasta el tope exponencial
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def _call(self, operation):
+        """Ejecuta 'operation' (corrutina sin argumentos) con plazo, reintentos y circuito"""
+        if not self.breaker.allow():
+            self._stats["rejected"] += 1
+            raise LLMUnavailable("Circuito abierto: el LLM ha fallado varias veces seguidas")
+        self._stats["calls"] += 1
+        attempt = 0
+        while True:
+            try:
+                result = await asyncio.wait_for(operation(), timeout=self.timeout)
+            except asyncio.CancelledError:
+                self.breaker.record_cancelled()
+                raise
+            except Exception as e:
+                if self.is_transient(e) and attempt < self.max_retries:
+                    await asyncio.sleep(self._backoff(attempt))
+                    attempt += 1
+                    self._stats["retries"] += 1
+                    continue
+                self._stats["failures"] += 1
+                self.breaker.record_failure()
+                raise LLMUnavailable(f"Error invocando mistral: {e!r}") from e
+            self.breaker.record_success()
+            return result
+
+    async def complete(self, messages: list[dict]) -> str:
+        """Respuesta completa del modelo a la conversación"""
+        response = await self._call(lambda: self.client.chat.complete_async(
+            model=self.model,
+            messages=messages,
+            timeout_ms=int(self.timeout * 1000)
+        ))
+        record_llm_usage(getattr(response, "usage", None))
+        return response.choices[0].message.content
+
+    async def stream(self, messages: list[dict]):
+        """
+        Fragmentos de texto de la respuesta según los va generando el modelo
+        Solo se reintenta la apertura del stream; un corte a mitad se propaga como LLMUnavailable
+        """
+        response = await self._call(lambda: self.client.chat.stream_async(
+            model=self.model,
+            messages=messages,
+            timeout_ms=int(self.timeout * 1000)
+        ))
+        # Al salir (fin, error o cancelación) se cierra la respuesta HTTP y la conexión vuelve al pool
+        async with response:
+            chunks = response.__aiter__()
+            while True:
+                try:
+                    # El plazo se aplica a cada fragmento, no a la respuesta entera
+                    chunk = await asyncio.wait_for(chunks.__anext__(), timeout=self.timeout)
+                except StopAsyncIteration:
+                    break
+                except Exception as e:
+                    self._stats["failures"] += 1
+                    self.breaker.record_failure()
+                    raise LLMUnavailable(f"Stream de mistral interrumpido: {e!r}") from e
+                # El último fragmento trae el recuento de tokens de toda la respuesta
+                record_llm_usage(getattr(chunk.data, "usage", None))
+                if not chunk.data.choices:
+                    continue
+                content = chunk.data.choices[0].delta.content
+                if isinstance(content, str) and content:
+                    yield content
+
+    def stats(self) -> dict:
+        return {**self._stats, "circuit": self.breaker.state}
+
+    async def aclose(self):
+        await self.http.aclose()
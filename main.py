@@ -1,44 +1,155 @@
+import time
+_import_start = time.perf_counter()
+
 import os
-import text2emotion as te
 import re
 import json
-import nltk
-from datetime import datetime
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import date, datetime
 
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import APIRouter, Depends, FastAPI, HTTPException, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 import uvicorn
 
-from access_bd import AccessBD
+from async_bd import AsyncAccessBD
+from auth import create_token, current_user
+from chat_writer import ChatHistoryWriter
+from context_builder import ContextBuilder
+from conversations import ConversationStore
+from cpu_pool import CPUPool, CPUPoolSaturated
+from emotion_engine import EmotionEngine, check_nltk_data
+from jobs import JobQueue, JobQueueFull
+from llm_cache import LLMCache
+from llm_client import FALLBACK_RESPONSE, LLMClient, LLMUnavailable
+from metrics import REGISTRY, MetricsMiddleware, background_task, stage
+from migrations import migrate, verify_indexes
+from profiling import ProfilingMiddleware
+from retrieval import DiaryRetriever
+from serve import memory_report
+from storage import Storage, create_storage
 
 load_dotenv()  # Carga las variables de entorno
 
-emotionai = FastAPI()
-
-db = AccessBD()
-
-nltk.download('punkt_tab')
-nltk.download('punkt')
+# ----------------------------------------------
+# Servicios del proceso: se crean en el arranque de la aplicación (lifespan), no al importar
+# ----------------------------------------------
+access_bd: Storage = None
+db: AsyncAccessBD = None
+# Caché de los análisis del LLM (eneagrama, Big Five, objetivos)
+llm_cache: LLMCache = None
+# Escritura por lotes del historial del chat, fuera del camino de la respuesta
+chat_writer: ChatHistoryWriter = None
+conversations: ConversationStore = None
+# Trabajos en segundo plano para los análisis largos (perfilado y objetivos)
+jobs: JobQueue = None
+# Cliente del LLM, uno por proceso
+llm: LLMClient = None
+# Índices TF-IDF del diario para recuperar las entradas relacionadas con cada mensaje del chat
+retriever: DiaryRetriever = None
+# Pool de procesos para bcrypt y el análisis de emociones (CPU_WORKERS=0 lo desactiva)
+cpu_pool: CPUPool = None
+# Análisis de emociones con memo; es CPU y se ejecuta en un pool acotado para no bloquear el event loop
+emotion_engine = EmotionEngine()
+# Texto del diario para los prompts, acotado a CONTEXT_MAX_TOKENS
+context_builder = ContextBuilder()
+emotion_executor: ThreadPoolExecutor = None
+
+# Tareas que siguen en marcha tras responder (se guardan para que no las recoja el GC)
+tareas_en_segundo_plano = set()
+
+def en_segundo_plano(tarea: asyncio.Task) -> asyncio.Task:
+    tareas_en_segundo_plano.add(tarea)
+    tarea.add_done_callback(tareas_en_segundo_plano.discard)
+    return tarea
+
+def comprobar_nltk():
+    """Comprueba sin red que los datos de NLTK están instalados; solo descarga si NLTK_AUTO_DOWNLOAD=1"""
+    missing = check_nltk_data(download=os.getenv("NLTK_AUTO_DOWNLOAD") == "1")
+    if missing:
+        raise RuntimeError(
+            f"Faltan datos de NLTK ({', '.join(missing)}). "
+            "Instálalos con 'python emotion_engine.py --download' o define NLTK_AUTO_DOWNLOAD=1"
+        )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global access_bd, db, chat_writer, conversations, jobs, llm_cache, llm, retriever, cpu_pool, emotion_executor
+    startup_start = time.perf_counter()
+    await asyncio.to_thread(comprobar_nltk)
+
+    access_bd = create_storage()
+    if os.getenv("MIGRATE_ON_STARTUP", "1") != "0":
+        # Idempotente: solo aplica las migraciones que falten
+        await asyncio.to_thread(migrate, access_bd)
+        for problema in await asyncio.to_thread(verify_indexes, access_bd):
+            print(f"Aviso de índices: {problema}")
+    db = AsyncAccessBD(access_bd)
+    chat_writer = ChatHistoryWriter(db)
+    await chat_writer.start()
+    conversations = ConversationStore(db, chat_writer)
+    llm_cache = LLMCache()
+    # Al escribir en el diario, las respuestas guardadas de ese usuario ya no sirven
+    access_bd.add_diary_listener(lambda username, diary_entry, version: llm_cache.invalidate(username))
+    retriever = DiaryRetriever(db)
+    access_bd.add_diary_listener(retriever.on_diary_change)
+    llm = LLMClient()
+    emotion_executor = ThreadPoolExecutor(
+        max_workers=int(os.getenv("EMOTION_WORKERS", 4)),
+        thread_name_prefix="emociones"
+    )
+    if os.getenv("CPU_WORKERS") != "0":
+        cpu_pool = CPUPool()
+        # Arrancar los procesos con NLTK ya cargado antes de aceptar peticiones
+        await asyncio.to_thread(cpu_pool.warm)
+        access_bd.cpu_pool = cpu_pool
+        emotion_engine.pool = cpu_pool
+    # En la BD por defecto, para que con varios workers cualquiera pueda responder por un trabajo
+    jobs = JobQueue(db if os.getenv("JOBS_PERSIST", "1") != "0" else None)
+    jobs.register("perfilado", calcular_perfilado)
+    jobs.register("objetivo", calcular_objetivos)
+    await jobs.start()
+
+    print(f"Arranque: imports {import_seconds:.2f}s, inicialización {time.perf_counter() - startup_start:.2f}s")
+    print(f"Memoria del worker: {memory_report()}")
+    yield
+    # Esperar a que terminen las tareas en curso y cerrar las conexiones
+    await jobs.close()
+    await llm.aclose()
+    emotion_executor.shutdown(wait=True)
+    # Los turnos que quedan en cola se escriben antes de cerrar la BD
+    await chat_writer.close()
+    db.close()
+    if cpu_pool is not None:
+        cpu_pool.shutdown(wait=True)
+        emotion_engine.pool = None
+
+async def cpu_pool_saturado(request, exc):
+    # Contrapresión: mejor rechazar que acumular peticiones esperando a la CPU
+    return JSONResponse(status_code=503, content={"detail": "Servidor ocupado, inténtalo de nuevo"},
+                        headers={"Retry-After": "1"})
+
+async def cola_de_trabajos_llena(request, exc):
+    return JSONResponse(status_code=503, content={"detail": "Demasiados análisis en cola, inténtalo más tarde"},
+                        headers={"Retry-After": "10"})
+
+router = APIRouter()
 
 # ----------------------------------------------
 # Modelos para Chat, Autenticación y Diario
 # ----------------------------------------------
-class Message(BaseModel):
-    role: str  # "user", "assistant", etc.
+class NewMessage(BaseModel):
+    # Solo el mensaje nuevo: el historial de la conversación lo guarda el servidor
     content: str
 
-class Conversation(BaseModel):
-    messages: list[Message]
-    username: str
-
 class UserAuth(BaseModel):
     username: str
     password: str
 
 class DiaryEntry(BaseModel):
-    username: str
-    password: str
     entry: str
     fecha: str = None  # Opcional; si no se proporciona, se usa la fecha actual.
     editar: bool = False  # Por defecto, no es edición.
@@ -46,57 +157,86 @@ class DiaryEntry(BaseModel):
 # ----------------------------------------------
 # Endpoint de Chat (usando la API oficial de Mistralai)
 # ----------------------------------------------
-def call_mistral_rag(conversation_messages: list[dict]) -> str:
-    from mistralai import Mistral
-    api_key = os.environ["MISTRAL_API_KEY"]
-    model = "mistral-large-latest"
-    client = Mistral(api_key=api_key)
-    chat_response = client.chat.complete(
-        model=model,
-        messages=conversation_messages
+async def call_mistral_rag(conversation_messages: list[dict]) -> str:
+    """Llama a Mistral con el cliente compartido; lanza LLMUnavailable si no responde"""
+    return await llm.complete(conversation_messages)
+
+# Versión de cada prompt de análisis: subirla al cambiar el prompt invalida la caché
+PROMPT_VERSIONS = {"eneagrama": 1, "big_five": 1, "objetivos": 1}
+
+def limpiar_json(respuesta: str):
+    """Quita los delimitadores markdown (```json ... ```) de la respuesta del LLM y la parsea"""
+    clean_response = re.sub(r"^```(?:json)?\s*", "", respuesta).strip()
+    clean_response = re.sub(r"\s*```$", "", clean_response)
+    return json.loads(clean_response)
+
+async def analisis_llm(username: str, nombre: str, prompt: str):
+    """
+    Análisis en JSON del LLM, servido desde la caché si el prompt (y por tanto el diario) no ha cambiado
+    Devuelve None si la respuesta no es un JSON válido
+    """
+    messages = [{"role": "system", "content": prompt}]
+    key = llm_cache.make_key(nombre, PROMPT_VERSIONS[nombre], messages)
+
+    async def calcular():
+        try:
+            with stage(f"llm_{nombre}"):
+                respuesta = await call_mistral_rag(messages)
+        except LLMUnavailable as e:
+            print(f"Análisis '{nombre}' sin respuesta del LLM: {e}")
+            return None
+        try:
+            return limpiar_json(respuesta)
+        except Exception as e:
+            print(f"Error parsing JSON ({nombre}):", e)
+            return None
+
+    return await llm_cache.get_or_compute(username, key, calcular)
+
+async def get_emotion(text: str) -> dict:
+    """Ejecuta el análisis de emociones fuera del event loop"""
+    loop = asyncio.get_running_loop()
+    with stage("emociones"):
+        return await loop.run_in_executor(emotion_executor, emotion_engine.analyze, text)
+
+@router.get("/chat")
+async def ventana_chat(username: str = Depends(current_user)):
+    # La conversación que ve el usuario al abrir el chat es la misma ventana que recibe la IA
+    # (10 turnos por defecto), servida desde memoria
+    return {"conversation": await conversations.get(username)}
+
+@router.get("/chat/historial")
+async def historial_chat(username: str = Depends(current_user),
+                         antes: str = Query(None, pattern=r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\|\d+$"),
+                         limite: int = Query(10, ge=1, le=100)):
+    # Turnos anteriores, paginados: 'antes' es el cursor 'siguiente' de la respuesta anterior
+    conversation_list, siguiente = await db.get_chat_page(username, antes, limite)
+    return {"conversation": conversation_list, "siguiente": siguiente}
+
+# Caracteres de cada entrada del diario que se añaden al contexto del chat
+MAX_EXTRACTO = int(os.getenv("RETRIEVAL_MAX_CHARS", 500))
+
+async def preparar_chat(mensaje: NewMessage, username: str):
+    """
+    Prepara la conversación que se envía a Mistral: la ventana guardada en el servidor más el
+    mensaje nuevo, con un mensaje de sistema con la emoción del mensaje, el perfil del usuario
+    y las entradas del diario relacionadas
+    :return: (mensajes para el LLM, emociones detectadas)
+    """
+    if not mensaje.content.strip():
+        raise HTTPException(status_code=400, detail="El mensaje está vacío")
+
+    # Historial, emociones del mensaje y entradas relacionadas a la vez
+    historial, emociones, relacionadas = await asyncio.gather(
+        conversations.get(username),
+        get_emotion(mensaje.content),
+        retriever.search(username, mensaje.content)
     )
-    return chat_response.choices[0].message.content
-
-def list_of_dicts_to_entries_text(entries: list) -> str:
-    """Convierte la lista de entradas del diario en un texto estructurado"""
-    text_entries = ""
-    for entry in entries:
-        date = entry["date"]
-        text = entry["entry"]
-        emotions = entry["emotions"]
-        text_entries += f"Fecha: {date}\n"
-        text_entries += f"Entrada: {text}\n"
-        text_entries += "Emociones:\n"
-        for emotion, value in emotions.items():
-            text_entries += f"- {emotion}: {value}\n"
-        text_entries += "\n"  # Línea vacía entre entradas
-    return text_entries
-
-@emotionai.get("/start_chat")
-async def start_chat(username : str = Query(...)):
-    #Vamos a intentar recuperar la conversación de la base de datos
-    #Tanto para que la vea el usuario como para que la IA pueda tener contexto
-    #Un máximo de diez mensajes, para no saturar la API de Mistral
-    # 10 del usuario, 10 de la IA
-    conversation_list = db.get_chat_history(username, 10)
-    return {"conversation": conversation_list}
-
-@emotionai.post("/chat")
-async def chat(conversation: Conversation):
-    if not conversation.messages:
-        raise HTTPException(status_code=400, detail="No hay mensajes en la conversación")
-    username = conversation.username
-    # Convertir mensajes a diccionarios
-    conversation_list = [msg.dict() for msg in conversation.messages]
-
-    # Analizar emociones del último mensaje del usuario
-    last_message = conversation.messages[-1]
-    emociones = {}
-    if last_message.role == "user":
-        emociones = te.get_emotion(last_message.content)
+    conversation_list = historial + [{"role": "user", "content": mensaje.content}]
     emocion_dominante = max(emociones, key=emociones.get, default="neutral")
-    # Crear un perfil emocional simple a partir del diario
-    perfil = perfilar(username)
+    # Perfil guardado del usuario: no se recalcula (ni se llama al LLM) en cada mensaje
+    with stage("perfil"):
+        perfil = await perfil_para_chat(username)
 
     # Crear un mensaje adicional para orientar a la IA
     mensaje_emocional = {
@@ -104,47 +244,88 @@ async def chat(conversation: Conversation):
         "content": f"Eres un chatbot emocional orientado a apoyar al usuario. El usuario de nombre {username} parece estar sintiendo '{emocion_dominante}' en su último mensaje. Ajusta tu respuesta para ser apropiada a esta emoción. Ten en cuenta esta característica del usuario que ha mostrado a lo largo del tiempo: '{perfil}'."
     } 
 
+    if relacionadas:
+        # Solo las entradas relevantes para este mensaje, no el diario entero
+        extractos = "\n".join(f"- {e['date']}: {e['entry'][:MAX_EXTRACTO]}" for e in relacionadas)
+        mensaje_emocional["content"] += f" Entradas de su diario relacionadas con lo que cuenta:\n{extractos}"
+
     # Insertar el mensaje de emoción al historial
     conversation_list.insert(0, mensaje_emocional)
+    return conversation_list, emociones
 
-    # Llamar a la API de Mistral con el historial actualizado
-    try:
-        respuesta = call_mistral_rag(conversation_list)
-    except Exception:
-        print(f"Error invocando mistral: {e}")
-
-    # Guardamos el último trozo de conversación en la base de datos
+def guardar_turno(username: str, mensaje: str, respuesta: str, emociones: dict):
+    """Añade el turno a la ventana de la conversación y lo encola para guardarlo en la base de datos por lotes"""
+    conversations.add_turn(username, mensaje, respuesta)
     piece_of_conversation = {
         "date" : datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "human_message" : last_message.content,
+        "human_message" : mensaje,
         "bot_message" : respuesta,
         "emotions" : emociones,
     }
+    chat_writer.add(username, piece_of_conversation)
+
+@router.post("/chat")
+async def chat(mensaje: NewMessage, username: str = Depends(current_user)):
+    conversation_list, emociones = await preparar_chat(mensaje, username)
 
-    db.insert_chat_history(username, piece_of_conversation)
+    # Llamar a la API de Mistral con el historial actualizado
+    try:
+        with stage("llm_chat"):
+            respuesta = await call_mistral_rag(conversation_list)
+    except LLMUnavailable as e:
+        print(e)
+        respuesta = FALLBACK_RESPONSE
+
+    guardar_turno(username, mensaje.content, respuesta, emociones)
     return {"respuesta": respuesta, "emociones": emociones}
 
-def perfilar(username: str) -> dict:
-    """Obtiene el perfil emocional del usuario a partir de su historial de diario."""
-    diary_entries = db.get_diary_entries(username)
+def evento_sse(data: dict, event: str = None) -> str:
+    """Formatea un evento Server-Sent Events"""
+    linea_evento = f"event: {event}\n" if event else ""
+    return f"{linea_evento}data: {json.dumps(data)}\n\n"
+
+@router.post("/chat/stream")
+async def chat_stream(mensaje: NewMessage, username: str = Depends(current_user)):
+    """
+    Igual que /chat, pero reenvía la respuesta de Mistral como Server-Sent Events según se genera
+    Eventos: 'data: {"delta": "..."}' por cada fragmento y un 'event: fin' con las emociones al terminar
+    """
+    conversation_list, emociones = await preparar_chat(mensaje, username)
+
+    async def eventos():
+        fragmentos = []
+        try:
+            try:
+                with stage("llm_chat_stream"):
+                    async for fragmento in llm.stream(conversation_list):
+                        fragmentos.append(fragmento)
+                        yield evento_sse({"delta": fragmento})
+            except LLMUnavailable as e:
+                print(e)
+                if not fragmentos:
+                    fragmentos.append(FALLBACK_RESPONSE)
+                    yield evento_sse({"delta": FALLBACK_RESPONSE})
+            yield evento_sse({"emociones": emociones}, event="fin")
+        finally:
+            # El turno se guarda al terminar el stream, aunque el cliente se haya desconectado
+            if fragmentos:
+                guardar_turno(username, mensaje.content, "".join(fragmentos), emociones)
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def resumir_emociones(agregados: dict) -> dict:
+    """Medias de cada emoción y tendencia dominante, a partir de los agregados del diario"""
     # Usamos claves con mayúscula inicial, ya que se almacenan así en la BD
     perfil = {"Happy": 0, "Sad": 0, "Angry": 0, "Surprise": 0, "Fear": 0}
-    if not diary_entries:
-        return {"perfil_emocional": perfil, "tendencia": {}, "eneagrama": {}}
-        
-    count = 0
-    for entry_data in diary_entries:
-        emociones = entry_data.get("emotions", {})  # Asumir que el campo se llama "emotions"
-        for emo in perfil.keys():
-            perfil[emo] += float(emociones.get(emo, 0))
-        count += 1
+    if not agregados:
+        return {"perfil_emocional": perfil, "tendencia": {}}
 
-    if count == 0:
-        return {"perfil_emocional": {}, "tendencia": "No hay datos suficientes"}
-
-    # Normalizar valores
     for emo in perfil:
-        perfil[emo] /= count
+        perfil[emo] = agregados["averages"][emo]
 
     emocion_dominante = max(perfil, key=perfil.get)
     tendencia = {
@@ -154,14 +335,58 @@ def perfilar(username: str) -> dict:
         "Surprise": "Tienes tendencia a la sorpresa",
         "Fear": "Tienes tendencia al miedo"
     }.get(emocion_dominante, "Personalidad equilibrada")
+    return {"perfil_emocional": perfil, "tendencia": tendencia}
+
+# Recálculos de perfil en segundo plano, como mucho uno por usuario a la vez
+perfiles_en_curso: dict[str, asyncio.Task] = {}
+
+def refrescar_perfil(username: str):
+    """Programa el recálculo del perfil guardado del usuario sin esperar a que termine"""
+    if username in perfiles_en_curso:
+        return
+    task = background_task(perfilar(username))
+    perfiles_en_curso[username] = task
 
-    # Usar este formato legible con una lista de diccionarios
-    entries_text = list_of_dicts_to_entries_text(diary_entries)
+    def terminado(task):
+        perfiles_en_curso.pop(username, None)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error recalculando el perfil de {username}: {task.exception()}")
+
+    task.add_done_callback(terminado)
+
+async def perfil_para_chat(username: str) -> dict:
+    """
+    Perfil del usuario para el chat, leído del perfil guardado
+    Si el diario ha cambiado desde que se guardó, se usan las medias actuales junto con el
+    último eneagrama conocido y se programa el recálculo en segundo plano
+    """
+    snapshot = await db.get_profile_snapshot(username)
+    if snapshot is not None and snapshot["fresh"]:
+        return snapshot["profile"]
+    agregados = await db.get_emotion_profile(username)
+    if agregados:
+        refrescar_perfil(username)
+    eneagrama = snapshot["profile"].get("eneagrama", {}) if snapshot is not None else {}
+    return {**resumir_emociones(agregados), "eneagrama": eneagrama}
+
+async def perfilar(username: str, entries_text: str = None) -> dict:
+    """
+    Obtiene el perfil emocional del usuario a partir de su historial de diario y lo guarda.
+    :param entries_text: Diario ya convertido a texto, si quien llama ya lo tiene
+    """
+    # Las medias salen de los agregados que se mantienen al escribir en el diario (O(1))
+    agregados = await db.get_emotion_profile(username)
+    resumen = resumir_emociones(agregados)
+    if not agregados:
+        return {**resumen, "eneagrama": {}}
+
+    if entries_text is None:
+        # Diario completo: lo que no cabe en el presupuesto se resume por semanas o meses
+        diary_entries = await db.get_diary_entries(username, limit=None)
+        entries_text = context_builder.build(diary_entries)
 
     # Ahora pasar esta cadena al LLM
-    eneagrama = call_mistral_rag([{
-        "role": "system",
-        "content": f"""
+    prompt = f"""
     Analiza las siguientes emociones y textos del diario y determina el tipo de eneagrama del usuario. Debes responder de forma elaborada, precisa y siempre siguiendo exactamente el siguiente formato JSON, sin ningún comentario adicional:
     No seas tan formal, sé más cercano y amigable con el usuario. Puedes hablar de tú a tú.
     Tipos de eneagrama:
@@ -183,59 +408,52 @@ def perfilar(username: str) -> dict:
     Utiliza los siguientes datos:
     {entries_text}
     """
-    }])
+    eneagrama_dict = await analisis_llm(username, "eneagrama", prompt)
+    if not eneagrama_dict:
+        # Respuesta no válida: se guarda el perfil igualmente, con el último eneagrama conocido, para
+        # que cada mensaje del chat no vuelva a llamar al LLM; se reintenta al cambiar el diario
+        snapshot = await db.get_profile_snapshot(username)
+        eneagrama_dict = snapshot["profile"].get("eneagrama", {}) if snapshot is not None else {}
 
-    clean_response = re.sub(r"^```(?:json)?\s*", "", eneagrama).strip()
-    clean_response = re.sub(r"\s*```$", "", clean_response)
-
-    try:
-        eneagrama_dict = json.loads(clean_response)
-    except Exception as e:
-        print("Error parsing JSON:", e)
-        eneagrama_dict = {}
-
-    return {"perfil_emocional": perfil, "tendencia": tendencia, "eneagrama": eneagrama_dict}
+    perfil = {**resumen, "eneagrama": eneagrama_dict}
+    await db.save_profile_snapshot(username, perfil, agregados["version"])
+    return perfil
 
 # ----------------------------------------------
 # Endpoint de Registro
 # ----------------------------------------------
-@emotionai.post("/register")
+@router.post("/register")
 async def register(user: UserAuth):
-    user_exit = db.check_user(user.username)
+    user_exit = await db.check_user(user.username)
     if user_exit:
         raise HTTPException(status_code=400, detail="El usuario ya existe")
-    db.register_user(user.username, user.password)
+    await db.register_user(user.username, user.password)
     return {"mensaje": "Usuario registrado exitosamente"}
 
 # ----------------------------------------------
-# Endpoint de Login (verifica contraseña hasheada)
+# Endpoint de Login (verifica contraseña hasheada y emite un token de sesión)
 # ----------------------------------------------
-@emotionai.post("/login")
+@router.post("/login")
 async def login(user: UserAuth):
-    print(user)
-    success = db.verify_user(user.username, user.password)
-    print(success)
+    success = await db.verify_user(user.username, user.password)
     if not success:
         raise HTTPException(status_code=400, detail="Credenciales inválidas")
-    return {"mensaje": "Login exitoso"}
+    # El resto de endpoints solo validan este token, bcrypt se ejecuta una vez por login
+    return {"mensaje": "Login exitoso", "token": create_token(user.username)}
 
 # ----------------------------------------------
 # Endpoint para agregar o actualizar la entrada del Diario
 # ----------------------------------------------
-@emotionai.post("/diario")
-async def agregar_diario(entry: DiaryEntry):
-    success = db.verify_user(entry.username, entry.password)
-    if not success:
-        raise HTTPException(status_code=400, detail="Credenciales inválidas")
-    
+@router.post("/diario")
+async def agregar_diario(entry: DiaryEntry, username: str = Depends(current_user)):
     target_date = entry.fecha if entry.fecha is not None else datetime.now().strftime("%Y-%m-%d")
-    entry_for_date = db.get_diary_entry(entry.username, target_date)
+    entry_for_date = await db.get_diary_entry(username, target_date)
 
     if entry.editar:
         if entry_for_date is None:
             raise HTTPException(status_code=400, detail="No existe una entrada previa para editar en esta fecha")
         new_text = entry.entry
-        new_emotions = te.get_emotion(new_text)
+        new_emotions = await get_emotion(new_text)
         entry_for_date["entry"] = new_text
         entry_for_date["emotions"] = new_emotions
         entry_for_date["date"] = target_date
@@ -243,35 +461,58 @@ async def agregar_diario(entry: DiaryEntry):
     else:
         if entry_for_date is not None:
             raise HTTPException(status_code=400, detail="Ya existe una entrada para esta fecha. Usa el modo edición.")
-        new_emotions = te.get_emotion(entry.entry)
+        new_emotions = await get_emotion(entry.entry)
         updated_entry = {"entry": entry.entry, "emotions": new_emotions, "date": target_date}
     
-    db.insert_diary_entry(entry.username, updated_entry)
+    await db.insert_diary_entry(username, updated_entry)
+    # El diario ha cambiado: recalcular el perfil guardado
+    refrescar_perfil(username)
     return {"mensaje": "Entrada actualizada en el diario", "registro": updated_entry}
 
 # ----------------------------------------------
 # Endpoint para obtener la entrada del Diario para un usuario (por fecha)
 # ----------------------------------------------
-@emotionai.get("/diario")
-async def obtener_diario(username: str = Query(...), password: str = Query(...)):
-    success = db.verify_user(username, password)
-    if not success:
-        raise HTTPException(status_code=400, detail="Credenciales inválidas")
-    diary = db.get_diary_entries(username)
-    if not diary:
+@router.get("/diario")
+async def obtener_diario(username: str = Depends(current_user),
+                         desde: date = None,
+                         hasta: date = None,
+                         cursor: date = None,
+                         limite: int = Query(50, ge=1, le=500)):
+    """
+    Entradas del diario entre 'desde' y 'hasta' (incluidas), de la más reciente hacia atrás
+    'siguiente' es el cursor para pedir la página anterior (se pasa como 'cursor'), o None si no hay más
+    """
+    diary, siguiente = await db.get_diary_page(
+        username,
+        since=desde and desde.isoformat(),
+        until=hasta and hasta.isoformat(),
+        before=cursor and cursor.isoformat(),
+        limit=limite
+    )
+    # Sin filtros, un diario vacío sigue siendo un 404; un rango sin entradas es una lista vacía
+    if not diary and desde is None and hasta is None and cursor is None:
         raise HTTPException(status_code=404, detail="No se encontraron entradas en el diario")
-    return {"diario": diary}
+    return {"diario": diary, "siguiente": siguiente}
 
 # ----------------------------------------------
 # Función para calcular los rasgos Big Five a partir de los diarios
 # ----------------------------------------------
-def calculate_big_five(username: str) -> dict:
-    diary_entries = db.get_diary_entries(username)
-    if not diary_entries:
-        raise HTTPException(status_code=404, detail="No se encontraron entradas en el diario")
-    
-    # Convertir las entradas del diario a un texto estructurado
-    text_context = list_of_dicts_to_entries_text(diary_entries)
+BIG_FIVE_VACIO = {
+    "Openness": 0,
+    "Conscientiousness": 0,
+    "Extraversion": 0,
+    "Agreeableness": 0,
+    "Neuroticism": 0
+}
+
+async def calculate_big_five(username: str, text_context: str = None) -> dict:
+    if text_context is None:
+        diary_entries = await db.get_diary_entries(username, limit=None)
+        if not diary_entries:
+            raise HTTPException(status_code=404, detail="No se encontraron entradas en el diario")
+        
+        # Convertir las entradas del diario a un texto estructurado
+        text_context = context_builder.build(diary_entries)
     
     # Definir el prompt para extraer los rasgos de personalidad (Big Five)
     prompt = f"""
@@ -301,24 +542,9 @@ def calculate_big_five(username: str) -> dict:
 
     
     # Llamar al modelo para obtener la evaluación
-    big_five_response = call_mistral_rag([{"role": "system", "content": prompt}])
-    
-
-    # Remove markdown code fences if present
-    clean_response = re.sub(r"^```(?:json)?\s*", "", big_five_response)
-    clean_response = re.sub(r"\s*```$", "", clean_response)
-
-   
-    try:
-        big_five = json.loads(clean_response)
-    except Exception as e:
-        big_five = {
-            "Openness": 0,
-            "Conscientiousness": 0,
-            "Extraversion": 0,
-            "Agreeableness": 0,
-            "Neuroticism": 0
-        }
+    big_five = await analisis_llm(username, "big_five", prompt)
+    if not big_five:
+        big_five = dict(BIG_FIVE_VACIO)
 
     
     return big_five
@@ -326,14 +552,65 @@ def calculate_big_five(username: str) -> dict:
 # ----------------------------------------------
 # Endpoint de Perfilado (incluye perfil emocional y Big Five)
 # ----------------------------------------------
-@emotionai.get("/perfilado")
-async def perfilado(username: str = Query(...), password: str = Query(...)):
-    
-    # Obtener perfil emocional
-    perfil_emocional_data = perfilar(username)
-    
-    # Calcular rasgos Big Five
-    big_five = calculate_big_five(username)
+# Segundos que se espera a los análisis del LLM antes de responder con lo que haya
+PERFILADO_TIMEOUT = float(os.getenv("PERFILADO_TIMEOUT", 30))
+
+async def calcular_perfilado(username: str, progreso=None, timeout: float = None) -> dict:
+    """
+    Perfil emocional y Big Five del usuario, calculados a la vez con una sola lectura del diario
+    :param progreso: El del trabajo en segundo plano, si lo hay
+    :param timeout: Segundos que se espera a los análisis; los que no terminan a tiempo siguen en
+                    segundo plano y se indican en 'pendientes'. None para esperarlos siempre
+    """
+    if progreso is not None:
+        await progreso(0.1, "Leyendo el diario")
+
+    # Leer el diario una sola vez y compartir el texto entre los dos análisis
+    diary_entries = await db.get_diary_entries(username, limit=None)
+    if not diary_entries:
+        raise HTTPException(status_code=404, detail="No se encontraron entradas en el diario")
+    entries_text = context_builder.build(diary_entries)
+    if progreso is not None:
+        await progreso(0.2, "Analizando el diario")
+
+    # Perfil emocional (el guardado si el diario no ha cambiado desde entonces) y Big Five, a la vez
+    tareas = {"big_five": asyncio.create_task(calculate_big_five(username, entries_text))}
+    snapshot = await db.get_profile_snapshot(username)
+    if snapshot is not None and snapshot["fresh"]:
+        perfil_emocional_data = snapshot["profile"]
+    elif username in perfiles_en_curso:
+        # Ya se está recalculando en segundo plano: esperar a ese cálculo
+        tareas["perfil"] = perfiles_en_curso[username]
+    else:
+        tareas["perfil"] = asyncio.create_task(perfilar(username, entries_text))
+
+    # Plazo común: la latencia es la del análisis más lento, no la suma
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout if timeout is not None else None
+    en_curso = set(tareas.values())
+    while en_curso and (deadline is None or loop.time() < deadline):
+        espera = deadline - loop.time() if deadline is not None else None
+        _, en_curso = await asyncio.wait(en_curso, timeout=espera, return_when=asyncio.FIRST_COMPLETED)
+        if en_curso and progreso is not None:
+            await progreso(0.6, "Terminando el análisis")
+
+    resultados = {}
+    pendientes = []
+    for nombre, tarea in tareas.items():
+        if not tarea.done():
+            # Se deja terminar en segundo plano para que la siguiente visita salga de la caché
+            pendientes.append(nombre)
+            en_segundo_plano(tarea)
+        elif tarea.cancelled() or tarea.exception() is not None:
+            print(f"Error en el análisis '{nombre}' de {username}")
+        else:
+            resultados[nombre] = tarea.result()
+
+    big_five = resultados.get("big_five", dict(BIG_FIVE_VACIO))
+    if "perfil" in resultados:
+        perfil_emocional_data = resultados["perfil"]
+    elif "perfil" in tareas:
+        perfil_emocional_data = {**resumir_emociones(await db.get_emotion_profile(username)), "eneagrama": {}}
     
     # Combinar ambos perfiles en la respuesta
     perfil_completo = {
@@ -343,19 +620,26 @@ async def perfilado(username: str = Query(...), password: str = Query(...)):
         "eneagrama": perfil_emocional_data.get("eneagrama", "")
     }
     
-    return {"perfil": perfil_completo}
+    return {"perfil": perfil_completo, "pendientes": pendientes}
 
+@router.get("/perfilado")
+async def perfilado(username: str = Depends(current_user)):
+    return await calcular_perfilado(username, timeout=PERFILADO_TIMEOUT)
+
+async def calcular_objetivos(username: str, progreso=None) -> dict:
+    """Objetivos personalizados a partir del diario; 'progreso' es el del trabajo, si lo hay"""
+    if progreso is not None:
+        await progreso(0.1, "Leyendo el diario")
 
-@emotionai.get("/Objetivo")
-async def objetivo(username: str = Query(...), password: str = Query(...)):
-    
     # Obtener entradas del diario del usuario
-    diary_entries = db.get_diary_entries(username)
+    diary_entries = await db.get_diary_entries(username, limit=None)
     if not diary_entries:
         raise HTTPException(status_code=404, detail="No se encontraron entradas en el diario")
     
-    # Convertir las entradas en un texto estructurado
-    entries_text = list_of_dicts_to_entries_text(diary_entries)
+    # Convertir las entradas en un texto estructurado, dentro del presupuesto de tokens
+    entries_text = context_builder.build(diary_entries)
+    if progreso is not None:
+        await progreso(0.3, "Generando objetivos")
     
     # Definir el prompt para generar objetivos personalizados
     prompt = f"""
@@ -381,20 +665,81 @@ async def objetivo(username: str = Query(...), password: str = Query(...)):
     """
     
     # Llamar al modelo para obtener los objetivos
-    respuesta_objetivo = call_mistral_rag([{"role": "system", "content": prompt}])
-    
-    # Eliminar posibles delimitadores markdown (por ejemplo, ```json ... ```)
-    clean_response = re.sub(r"^```(?:json)?\s*", "", respuesta_objetivo).strip()
-    clean_response = re.sub(r"\s*```$", "", clean_response)
-    
-    try:
-        objetivos = json.loads(clean_response)
-    except Exception as e:
-        print("Error parsing JSON in /Objetivo:", e)
+    objetivos = await analisis_llm(username, "objetivos", prompt)
+    if not objetivos:
         objetivos = {"objetivos": []}
     
     return {"objetivo": objetivos}
 
+@router.get("/Objetivo")
+async def objetivo(username: str = Depends(current_user)):
+    return await calcular_objetivos(username)
+
+# ----------------------------------------------
+# Análisis en segundo plano: se piden con POST, que responde enseguida con el trabajo,
+# y el resultado se consulta en /trabajo hasta que 'estado' es 'terminado' o 'error'
+# ----------------------------------------------
+@router.post("/perfilado", status_code=202)
+async def pedir_perfilado(username: str = Depends(current_user)):
+    return {"trabajo": await jobs.submit(username, "perfilado")}
+
+@router.post("/Objetivo", status_code=202)
+async def pedir_objetivo(username: str = Depends(current_user)):
+    return {"trabajo": await jobs.submit(username, "objetivo")}
+
+@router.get("/trabajo")
+async def estado_trabajo(trabajo_id: str = Query(..., alias="id", pattern=r"^[0-9a-f]{32}$"),
+                         username: str = Depends(current_user)):
+    trabajo = await jobs.get(trabajo_id, username)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return {"trabajo": trabajo}
+
+# ----------------------------------------------
+# Endpoint de estadísticas internas (pool de conexiones y cachés)
+# ----------------------------------------------
+@router.get("/stats")
+async def stats():
+    return {
+        "db_backend": access_bd.backend,
+        "db_pool": await db.pool_stats(),
+        "chat_writer": chat_writer.stats(),
+        "conversations": conversations.stats(),
+        "jobs": jobs.stats(),
+        "user_id_cache": await db.user_id_cache_stats(),
+        "llm_cache": llm_cache.stats(),
+        "llm": llm.stats(),
+        "emotions": emotion_engine.stats(),
+        "context": context_builder.stats(),
+        "retrieval": retriever.stats(),
+        "cpu_pool": cpu_pool.stats() if cpu_pool is not None else None,
+        # Cada worker responde con su propio proceso; 'pid' indica cuál ha contestado
+        "memoria": memory_report()
+    }
+
+
+# ----------------------------------------------
+# Métricas en formato Prometheus (por proceso: con varios workers, cada uno expone las suyas)
+# ----------------------------------------------
+@router.get("/metrics")
+async def metricas():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def create_app() -> FastAPI:
+    """Crea la aplicación; los servicios (BD, LLM, pools) se inicializan al arrancar, en lifespan"""
+    app = FastAPI(lifespan=lifespan)
+    app.add_exception_handler(CPUPoolSaturated, cpu_pool_saturado)
+    app.add_exception_handler(JobQueueFull, cola_de_trabajos_llena)
+    app.include_router(router)
+    app.add_middleware(MetricsMiddleware, endpoints=[route.path for route in router.routes])
+    # Perfilado bajo demanda (cabecera X-Profile o PROFILE_SAMPLE_RATE); desactivado por defecto
+    app.add_middleware(ProfilingMiddleware)
+    return app
+
+emotionai = create_app()
+import_seconds = time.perf_counter() - _import_start
+
 
 if __name__ == "__main__":
     uvicorn.run(emotionai, host="0.0.0.0", port=8000)
\ No newline at end of file
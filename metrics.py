@@ -0,0 +1,187 @@
+import asyncio
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Endpoint de la petición en curso; lo fija MetricsMiddleware y lo heredan las tareas y los hilos
+# que se lanzan desde ella (AsyncAccessBD copia el contexto al ejecutar en su pool), salvo las
+# que se crean con background_task
+BACKGROUND = "segundo_plano"
+endpoint_var = contextvars.ContextVar("endpoint", default=BACKGROUND)
+
+# Límites de los buckets en segundos: de consultas rápidas a llamadas largas al LLM
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Contador con etiquetas, seguro entre hilos"""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Histograma con etiquetas y buckets fijos, seguro entre hilos"""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # Por cada combinación de etiquetas: [cuentas por bucket, suma, total]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = format_labels(self.labels, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Métricas del proceso, en el formato de texto de Prometheus"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        metric = Counter(name, documentation, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.histogram(
+    "emotionai_request_seconds", "Duración de las peticiones HTTP, incluido el cuerpo en streaming",
+    ("endpoint", "method", "status"))
+STAGE_SECONDS = REGISTRY.histogram(
+    "emotionai_stage_seconds", "Duración de cada etapa del procesado de una petición",
+    ("endpoint", "stage"))
+DB_SECONDS = REGISTRY.histogram(
+    "emotionai_db_query_seconds", "Duración de cada operación de AccessBD, incluida la espera por un hilo",
+    ("endpoint", "query"))
+DB_ERRORS = REGISTRY.counter(
+    "emotionai_db_errors_total", "Operaciones de AccessBD que han lanzado una excepción",
+    ("endpoint", "query"))
+LLM_TOKENS = REGISTRY.counter(
+    "emotionai_llm_tokens_total", "Tokens de los prompts y las respuestas del LLM",
+    ("endpoint", "kind"))
+
+
+@contextmanager
+def stage(name: str):
+    """Medir un bloque como etapa del endpoint en curso (vale también alrededor de un await)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint_var.get(), stage=name)
+
+
+def background_task(coro) -> asyncio.Task:
+    """Crear una tarea que sigue después de responder: lo que mida va a 'segundo_plano', no al endpoint que la lanza"""
+    token = endpoint_var.set(BACKGROUND)
+    try:
+        return asyncio.create_task(coro)
+    finally:
+        endpoint_var.reset(token)
+
+
+def record_llm_usage(usage):
+    """Sumar los tokens de un objeto 'usage' de Mistral (si la respuesta lo trae)"""
+    if usage is None:
+        return
+    endpoint = endpoint_var.get()
+    LLM_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, endpoint=endpoint, kind="prompt")
+    LLM_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, endpoint=endpoint, kind="completion")
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI que mide cada petición y fija el endpoint para las etapas que se midan dentro
+    Las rutas que no son de la aplicación se agrupan como 'otra', para no crear una serie por URL
+    """
+
+    def __init__(self, app, endpoints: list):
+        self.app = app
+        self.endpoints = set(endpoints)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        endpoint = scope["path"] if scope["path"] in self.endpoints else "otra"
+        token = endpoint_var.set(endpoint)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, method=scope["method"],
+                                    status=status)
+            endpoint_var.reset(token)
@@ -0,0 +1,375 @@
+import argparse
+import fcntl
+from contextlib import closing
+
+# ----------------------------------------------
+# Migraciones del esquema, en orden. Cada una es (versión, descripción, pasos) y cada paso es una
+# sentencia SQL o una función (access_bd, cursor). Los pasos deben poder repetirse sin efecto, porque
+# en MySQL cada DDL confirma por su cuenta y una migración que falla a medias se vuelve a ejecutar.
+# Una migración ya publicada no se modifica: los cambios van en una nueva.
+# SQLITE_MIGRATIONS repite las mismas versiones con los tipos y la sintaxis de SQLite.
+# ----------------------------------------------
+
+
+def create_index(table: str, name: str, columns: str):
+    """Paso que crea un índice si no existe (MySQL no tiene CREATE INDEX IF NOT EXISTS)"""
+    def step(access_bd, cursor):
+        cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        """, (table, name))
+        if cursor.fetchone()[0] == 0:
+            cursor.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+    return step
+
+
+def backfill_emotion_aggregates(access_bd, cursor):
+    # En la conexión de la migración: otra del pool podría no quedar libre (DB_POOL_SIZE=1)
+    access_bd.rebuild_emotion_aggregates(cursor)
+
+
+MIGRATIONS = [
+    (1, "Tablas de usuarios, diario e historial del chat", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(255) UNIQUE,
+            password VARCHAR(255) NOT NULL,
+            ngrama INT DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS diary_entries (
+            user_id INT,
+            date DATE,
+            entry TEXT,
+            happy DECIMAL(3,2),
+            angry DECIMAL(3,2),
+            surprise DECIMAL(3,2),
+            sad DECIMAL(3,2),
+            fear DECIMAL(3,2),
+            UNIQUE (user_id, date),
+            PRIMARY KEY (user_id, date),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chat_history (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT,
+            date DATETIME,
+            human_message TEXT,
+            bot_message TEXT,
+            happy DECIMAL(3,2),
+            angry DECIMAL(3,2),
+            surprise DECIMAL(3,2),
+            sad DECIMAL(3,2),
+            fear DECIMAL(3,2),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        """,
+    ]),
+    (2, "Agregados de emociones por usuario y perfiles guardados", [
+        # Sumas y número de entradas por usuario, mantenidas en la misma transacción que el diario.
+        # 'version' cuenta las escrituras del diario y sirve para saber si un perfil está al día
+        """
+        CREATE TABLE IF NOT EXISTS emotion_aggregates (
+            user_id INT PRIMARY KEY,
+            entries INT NOT NULL DEFAULT 0,
+            version INT NOT NULL DEFAULT 0,
+            happy_sum DECIMAL(12,2) NOT NULL DEFAULT 0,
+            angry_sum DECIMAL(12,2) NOT NULL DEFAULT 0,
+            surprise_sum DECIMAL(12,2) NOT NULL DEFAULT 0,
+            sad_sum DECIMAL(12,2) NOT NULL DEFAULT 0,
+            fear_sum DECIMAL(12,2) NOT NULL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        """,
+        # Último perfil calculado (medias, tendencia y eneagrama) y versión del diario de la que sale
+        """
+        CREATE TABLE IF NOT EXISTS profile_snapshots (
+            user_id INT PRIMARY KEY,
+            diary_version INT NOT NULL,
+            profile TEXT NOT NULL,
+            updated_at DATETIME NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        """,
+        # Diarios escritos antes de que existieran los agregados
+        backfill_emotion_aggregates,
+    ]),
+    (3, "Índice (user_id, date) para leer el historial del chat", [
+        # Sirve a WHERE user_id = ? ORDER BY date DESC, id DESC LIMIT ? sin ordenar en memoria
+        # (InnoDB añade la clave primaria, id, al final de cada índice secundario)
+        create_index("chat_history", "idx_chat_history_user_date", "user_id, date"),
+    ]),
+    (4, "Trabajos en segundo plano (perfilado y objetivos)", [
+        # Fechas en segundos desde epoch, como las guarda JobQueue
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id CHAR(32) PRIMARY KEY,
+            user_id INT NOT NULL,
+            kind VARCHAR(32) NOT NULL,
+            status VARCHAR(16) NOT NULL,
+            progress DOUBLE NOT NULL DEFAULT 0,
+            message VARCHAR(255),
+            result MEDIUMTEXT,
+            error VARCHAR(255),
+            created_at DOUBLE NOT NULL,
+            updated_at DOUBLE NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        """,
+        # Para borrar los trabajos antiguos sin recorrer la tabla
+        create_index("jobs", "idx_jobs_updated_at", "updated_at"),
+    ]),
+]
+
+SQLITE_MIGRATIONS = [
+    (1, "Tablas de usuarios, diario e historial del chat", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE,
+            password TEXT NOT NULL,
+            ngrama INTEGER DEFAULT 0
+        )
+        """,
+        # Las fechas se guardan como texto ISO, que se ordena y compara igual que la fecha
+        """
+        CREATE TABLE IF NOT EXISTS diary_entries (
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            date TEXT NOT NULL,
+            entry TEXT,
+            happy REAL,
+            angry REAL,
+            surprise REAL,
+            sad REAL,
+            fear REAL,
+            PRIMARY KEY (user_id, date)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS chat_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER REFERENCES users(id),
+            date TEXT,
+            human_message TEXT,
+            bot_message TEXT,
+            happy REAL,
+            angry REAL,
+            surprise REAL,
+            sad REAL,
+            fear REAL
+        )
+        """,
+    ]),
+    (2, "Agregados de emociones por usuario y perfiles guardados", [
+        """
+        CREATE TABLE IF NOT EXISTS emotion_aggregates (
+            user_id INTEGER PRIMARY KEY REFERENCES users(id),
+            entries INTEGER NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0,
+            happy_sum REAL NOT NULL DEFAULT 0,
+            angry_sum REAL NOT NULL DEFAULT 0,
+            surprise_sum REAL NOT NULL DEFAULT 0,
+            sad_sum REAL NOT NULL DEFAULT 0,
+            fear_sum REAL NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS profile_snapshots (
+            user_id INTEGER PRIMARY KEY REFERENCES users(id),
+            diary_version INTEGER NOT NULL,
+            profile TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+        """,
+        backfill_emotion_aggregates,
+    ]),
+    (3, "Índice (user_id, date) para leer el historial del chat", [
+        # SQLite también añade el rowid (id) al final del índice
+        "CREATE INDEX IF NOT EXISTS idx_chat_history_user_date ON chat_history (user_id, date)",
+    ]),
+    (4, "Trabajos en segundo plano (perfilado y objetivos)", [
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            progress REAL NOT NULL DEFAULT 0,
+            message TEXT,
+            result TEXT,
+            error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_jobs_updated_at ON jobs (updated_at)",
+    ]),
+]
+
+# Índice que debe usar cada consulta frecuente (las de get_user_id, get_diary_page y get_chat_page)
+HOT_QUERIES = [
+    ("usuario por nombre", "users", "username",
+     "SELECT id FROM users WHERE username = %(username)s"),
+    ("página del diario", "diary_entries", "PRIMARY",
+     "SELECT date, entry FROM diary_entries WHERE user_id = %(user_id)s ORDER BY date DESC LIMIT 50"),
+    ("página del chat", "chat_history", "idx_chat_history_user_date",
+     "SELECT human_message, bot_message, date, id FROM chat_history WHERE user_id = %(user_id)s "
+     "ORDER BY date DESC, id DESC LIMIT 10"),
+]
+
+LOCK_NAME = "emotionai_migrations"
+
+
+def current_version(cursor) -> int:
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    return cursor.fetchone()[0]
+
+
+def migrate(access_bd, lock_timeout: int = 60) -> list[int]:
+    """
+    Aplicar las migraciones pendientes
+    Un bloqueo con nombre evita que varios workers migren a la vez al arrancar
+    :return: Versiones aplicadas
+    """
+    if access_bd.backend == "sqlite":
+        return migrate_sqlite(access_bd)
+    applied = []
+    with access_bd.pool.connection() as connection, closing(connection.cursor()) as cursor:
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, lock_timeout))
+        if cursor.fetchone()[0] != 1:
+            raise RuntimeError("No se pudo obtener el bloqueo de migraciones")
+        try:
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT PRIMARY KEY,
+                description VARCHAR(255) NOT NULL,
+                applied_at DATETIME NOT NULL
+            )
+            """)
+            version = current_version(cursor)
+            for number, description, steps in MIGRATIONS:
+                if number <= version:
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(access_bd, cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, description, applied_at) VALUES (%s, %s, NOW())",
+                    (number, description)
+                )
+                connection.commit()
+                applied.append(number)
+                print(f"Migración {number} aplicada: {description}")
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+            cursor.fetchall()
+    return applied
+
+
+def migrate_sqlite(access_bd) -> list[int]:
+    """
+    Aplicar las migraciones pendientes en SQLite
+    La versión se guarda en PRAGMA user_version y un bloqueo sobre un fichero junto a la base de
+    datos hace de GET_LOCK. Cada migración se confirma antes de subir la versión.
+    """
+    applied = []
+    with open(access_bd.path + ".migrations.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with access_bd.pool.connection() as connection, closing(connection.cursor()) as cursor:
+            cursor.execute("PRAGMA user_version")
+            version = cursor.fetchone()[0]
+            for number, description, steps in SQLITE_MIGRATIONS:
+                if number <= version:
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(access_bd, cursor)
+                    else:
+                        cursor.execute(step)
+                connection.commit()
+                cursor.execute(f"PRAGMA user_version = {int(number)}")
+                applied.append(number)
+                print(f"Migración {number} aplicada: {description}")
+    return applied
+
+
+def verify_indexes(access_bd) -> list[str]:
+    """
+    Comprobar con EXPLAIN que las consultas frecuentes usan su índice y no ordenan en memoria
+    Se usa un usuario real, porque con valores inexistentes MySQL no llega a elegir índice
+    :return: Lista de problemas (vacía si todo está bien)
+    """
+    if access_bd.backend == "sqlite":
+        return verify_indexes_sqlite(access_bd)
+    problems = []
+    with access_bd.pool.connection() as connection, closing(connection.cursor(dictionary=True)) as cursor:
+        cursor.execute("SELECT id, username FROM users LIMIT 1")
+        user = cursor.fetchone()
+        if user is None:
+            return problems
+        values = {"user_id": user["id"], "username": user["username"]}
+        for name, table, expected, query in HOT_QUERIES:
+            cursor.execute("EXPLAIN " + query, values)
+            plan = [row for row in cursor.fetchall() if row["table"] == table]
+            if not plan or plan[0]["key"] != expected:
+                used = plan[0]["key"] if plan else None
+                problems.append(f"{name}: usa el índice {used} en lugar de {expected}")
+            elif "filesort" in (plan[0]["Extra"] or ""):
+                problems.append(f"{name}: ordena en memoria (filesort) con el índice {expected}")
+    return problems
+
+
+def verify_indexes_sqlite(access_bd) -> list[str]:
+    """Lo mismo con EXPLAIN QUERY PLAN: cada consulta debe buscar por índice y no usar un B-tree temporal"""
+    problems = []
+    with access_bd.pool.connection() as connection, closing(connection.cursor()) as cursor:
+        values = {"user_id": 0, "username": ""}
+        for name, table, expected, query in HOT_QUERIES:
+            cursor.execute("EXPLAIN QUERY PLAN " + query.replace("%(username)s", ":username")
+                           .replace("%(user_id)s", ":user_id"), values)
+            details = [row[3] for row in cursor.fetchall()]
+            if not any(table in detail and "USING" in detail for detail in details):
+                problems.append(f"{name}: recorre la tabla {table} sin índice ({'; '.join(details)})")
+            elif any("TEMP B-TREE" in detail for detail in details):
+                problems.append(f"{name}: ordena en memoria (B-tree temporal)")
+    return problems
+
+
+if __name__ == '__main__':
+    from storage import create_storage
+
+    parser = argparse.ArgumentParser(description="Migraciones del esquema de EmotionAI")
+    parser.add_argument("--status", action="store_true", help="Mostrar la versión actual sin migrar")
+    parser.add_argument("--verify", action="store_true", help="Comprobar los índices de las consultas frecuentes")
+    args = parser.parse_args()
+
+    access_bd = create_storage()
+    try:
+        if args.status and access_bd.backend == "sqlite":
+            with access_bd.pool.connection() as connection, closing(connection.cursor()) as cursor:
+                cursor.execute("PRAGMA user_version")
+                print(f"Versión del esquema: {cursor.fetchone()[0]} de {SQLITE_MIGRATIONS[-1][0]}")
+        elif args.status:
+            with access_bd.pool.connection() as connection, closing(connection.cursor()) as cursor:
+                cursor.execute("SHOW TABLES LIKE 'schema_migrations'")
+                if not cursor.fetchall():
+                    raise SystemExit("Esquema sin migrar: ejecuta 'python migrations.py'")
+                print(f"Versión del esquema: {current_version(cursor)} de {MIGRATIONS[-1][0]}")
+        else:
+            applied = migrate(access_bd)
+            print(f"Esquema en la versión {MIGRATIONS[-1][0]}" + ("" if applied else " (sin cambios)"))
+        if args.verify:
+            problems = verify_indexes(access_bd)
+            for problem in problems:
+                print(problem)
+            if problems:
+                raise SystemExit(1)
+            print("Las consultas frecuentes usan sus índices")
+    finally:
+        access_bd.close()
@@ -0,0 +1,5 @@
+# Importar este módulo carga text2emotion sin que NLTK descargue nada (ver emotion_engine.load_text2emotion).
+# Es lo que precarga el forkserver de CPUPool, que solo admite nombres de módulos
+from emotion_engine import load_text2emotion
+
+load_text2emotion()
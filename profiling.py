@@ -0,0 +1,119 @@
+import asyncio
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from datetime import datetime
+
+
+class ProfilingMiddleware:
+    """
+    Middleware ASGI que perfila peticiones sueltas bajo demanda.
+    Se perfila una petición si trae la cabecera X-Profile con el valor de PROFILE_TOKEN, o al azar
+    con probabilidad PROFILE_SAMPLE_RATE. Por cada una se guarda el perfil completo y un resumen de
+    texto (tiempo real, tiempo de CPU y las funciones más costosas) en PROFILE_DIR, conservando solo
+    los PROFILE_KEEP más recientes. Apagado, el coste por petición es una comparación.
+    Usa pyinstrument si está instalado, porque atribuye bien el tiempo de las corrutinas; si no,
+    cProfile, que también cuenta lo que ejecuten a la vez otras peticiones del mismo event loop.
+    Solo se perfila una petición a la vez: un perfilador por hilo.
+    """
+
+    HEADER = b"x-profile"
+
+    def __init__(self, app, sample_rate: float = None, token: str = None, directory: str = None, keep: int = None):
+        self.app = app
+        self.sample_rate = sample_rate if sample_rate is not None else float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+        self.token = (token or os.getenv("PROFILE_TOKEN") or "").encode()
+        self.directory = directory or os.getenv("PROFILE_DIR", ".profiles")
+        self.keep = keep or int(os.getenv("PROFILE_KEEP", 50))
+        self.top = int(os.getenv("PROFILE_TOP_FRAMES", 25))
+        self._busy = threading.Lock()
+
+    def wanted(self, scope) -> bool:
+        if self.token:
+            for name, value in scope["headers"]:
+                if name == self.HEADER and value == self.token:
+                    return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (self.sample_rate or self.token) or not self.wanted(scope):
+            await self.app(scope, receive, send)
+            return
+        if not self._busy.acquire(blocking=False):
+            # Ya hay otra petición perfilándose
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{scope['path'].strip('/').replace('/', '_') or 'raiz'}"
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = [*message["headers"], (b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        profiler = self._start()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            if hasattr(profiler, "output_text"):
+                profiler.stop()
+            else:
+                profiler.disable()
+            self._busy.release()
+            await asyncio.to_thread(self._save, profiler, profile_id, scope, wall, cpu)
+
+    @staticmethod
+    def _start():
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+        profiler = Profiler(async_mode="enabled")
+        profiler.start()
+        return profiler
+
+    def _save(self, profiler, profile_id: str, scope, wall: float, cpu: float):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, profile_id)
+        header = (f"{scope['method']} {scope['path']}\n"
+                  f"Tiempo real: {wall * 1000:.1f} ms, CPU del proceso: {cpu * 1000:.1f} ms "
+                  f"({cpu / wall * 100 if wall else 0:.0f}%)\n\n")
+        if hasattr(profiler, "output_text"):
+            with open(base + ".html", "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+            summary = profiler.output_text(unicode=True, color=False)
+        else:
+            profiler.dump_stats(base + ".prof")
+            stream = io.StringIO()
+            stats = pstats.Stats(profiler, stream=stream)
+            stats.sort_stats("cumulative").print_stats(self.top)
+            stream.write("\n")
+            stats.sort_stats("tottime").print_stats(self.top)
+            summary = stream.getvalue()
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(header + summary)
+        print(f"Perfil guardado en {base}.txt ({wall * 1000:.0f} ms)")
+        self._rotate()
+
+    def _rotate(self):
+        """Borrar los perfiles más antiguos, dejando los 'keep' más recientes"""
+        profiles = {}
+        for name in os.listdir(self.directory):
+            profiles.setdefault(name.rsplit(".", 1)[0], []).append(os.path.join(self.directory, name))
+        # Los nombres empiezan por la fecha, así que el orden alfabético es el cronológico
+        for profile_id in sorted(profiles)[:-self.keep]:
+            for path in profiles[profile_id]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
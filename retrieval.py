@@ -0,0 +1,214 @@
+import asyncio
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from lru_cache import LRUCache
+from metrics import stage
+
+# Palabras de 3 o más letras; las más cortas casi nunca distinguen una entrada de otra
+TOKEN_RE = re.compile(r"[^\W\d_]{3,}")
+
+
+def load_stopwords() -> frozenset:
+    """Palabras vacías de NLTK en español e inglés (ya se instalan para text2emotion)"""
+    try:
+        from nltk.corpus import stopwords
+        return frozenset(stopwords.words("spanish")) | frozenset(stopwords.words("english"))
+    except (ImportError, LookupError):
+        return frozenset()
+
+
+_stopwords = None
+
+
+def get_stopwords() -> frozenset:
+    """Las palabras vacías se cargan en el primer uso, no al importar el módulo"""
+    global _stopwords
+    if _stopwords is None:
+        _stopwords = load_stopwords()
+    return _stopwords
+
+
+def tokenize(text: str) -> list[str]:
+    stopwords = get_stopwords()
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in stopwords]
+
+
+class DiaryIndex:
+    """
+    Índice TF-IDF de las entradas del diario de un usuario, con búsqueda por similitud coseno.
+    Cada fecha es un documento: volver a escribir una fecha sustituye su entrada.
+    Las frecuencias se actualizan al momento; la matriz de NumPy se reconstruye, en la siguiente
+    búsqueda, solo si algo ha cambiado.
+    """
+
+    def __init__(self, entries: list = ()):
+        self._lock = threading.Lock()
+        self.dates = []
+        self.texts = []
+        self.terms = []
+        self.rows = {}
+        self.df = Counter()
+        self._matrix = None
+        self._vocabulary = None
+        self._idf = None
+        for entry in entries:
+            self.upsert(entry["date"], entry["entry"])
+
+    def __len__(self):
+        return len(self.dates)
+
+    def upsert(self, date: str, text: str):
+        """Añadir o sustituir la entrada de una fecha"""
+        terms = Counter(tokenize(text))
+        with self._lock:
+            row = self.rows.get(date)
+            if row is None:
+                self.rows[date] = len(self.dates)
+                self.dates.append(date)
+                self.texts.append(text)
+                self.terms.append(terms)
+            else:
+                self.df.subtract(self.terms[row].keys())
+                self.texts[row] = text
+                self.terms[row] = terms
+            self.df.update(terms.keys())
+            self._matrix = None
+
+    def _build(self):
+        """Matriz documentos x términos con pesos (1 + log tf) * idf y filas normalizadas"""
+        vocabulary = {term: column for column, term in enumerate(t for t, n in self.df.items() if n > 0)}
+        documents = len(self.dates)
+        idf = np.zeros(len(vocabulary), dtype=np.float32)
+        for term, column in vocabulary.items():
+            idf[column] = math.log((1 + documents) / (1 + self.df[term])) + 1
+        matrix = np.zeros((documents, len(vocabulary)), dtype=np.float32)
+        for row, terms in enumerate(self.terms):
+            for term, count in terms.items():
+                matrix[row, vocabulary[term]] = 1 + math.log(count)
+        matrix *= idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+        self._vocabulary, self._idf, self._matrix = vocabulary, idf, matrix
+
+    def search(self, query: str, k: int = 3, min_score: float = 0.05) -> list[dict]:
+        """
+        Las k entradas más parecidas a 'query', de más a menos parecida
+        :return: Lista de {"date", "entry", "score"}
+        """
+        with self._lock:
+            if not self.dates:
+                return []
+            if self._matrix is None:
+                self._build()
+            vector = np.zeros(len(self._vocabulary), dtype=np.float32)
+            for term, count in Counter(tokenize(query)).items():
+                column = self._vocabulary.get(term)
+                if column is not None:
+                    vector[column] = 1 + math.log(count)
+            vector *= self._idf
+            norm = np.linalg.norm(vector)
+            if norm == 0:
+                return []
+            scores = self._matrix @ (vector / norm)
+            k = min(k, len(scores))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            return [
+                {"date": self.dates[row], "entry": self.texts[row], "score": float(scores[row])}
+                for row in best if scores[row] >= min_score
+            ]
+
+
+class DiaryRetriever:
+    """
+    Índices del diario por usuario, en memoria y sin servicios externos.
+    El índice de un usuario se construye la primera vez que se consulta (con todo su diario) y
+    después se mantiene con cada escritura en el diario (add_diary_listener de AccessBD).
+    Con varios workers las escrituras que atiende otro no llegan al listener: pasados 'ttl'
+    segundos se compara la versión del diario (la de los agregados de emociones) con la del
+    índice, y si ha cambiado se reconstruye.
+    :param db: AsyncAccessBD
+    :param max_users: Número máximo de índices en memoria
+    :param ttl: Segundos que se usa un índice sin comprobar si el diario ha cambiado
+    """
+
+    def __init__(self, db, max_users: int = None, ttl: float = None):
+        self.db = db
+        self.ttl = ttl if ttl is not None else float(os.getenv("RETRIEVAL_TTL", 300))
+        # username -> [índice, versión del diario, última comprobación]
+        self.indexes = LRUCache(max_users or int(os.getenv("RETRIEVAL_MAX_USERS", 256)))
+        self._lock = threading.Lock()
+        # Usuarios cuyo índice se está construyendo, y si su diario ha cambiado mientras tanto
+        self._building = {}
+        self._tasks = {}
+
+    def on_diary_change(self, username: str, diary_entry: dict, version: int):
+        """Listener del diario: actualiza el índice si está cargado"""
+        with self._lock:
+            if username in self._building:
+                self._building[username] = True
+            cached = self.indexes.get(username)
+            if cached is not None:
+                cached[0].upsert(diary_entry["date"], diary_entry["entry"])
+                # Si es la escritura siguiente a la del índice, ya está incluida; si hay un salto,
+                # otro worker escribió entre medias y la próxima comprobación lo reconstruirá
+                if version == cached[1] + 1:
+                    cached[1] = version
+
+    async def _version(self, username: str) -> int:
+        """Versión del diario del usuario; cambia con cada escritura, la atienda el worker que la atienda"""
+        profile = await self.db.get_emotion_profile(username)
+        return profile["version"] if profile else 0
+
+    async def _load(self, username: str) -> DiaryIndex:
+        while True:
+            with self._lock:
+                self._building[username] = False
+            try:
+                # La versión se lee antes que las entradas: si cambia entre medias, se reconstruirá
+                version = await self._version(username)
+                entries = await self.db.get_diary_entries(username, limit=None)
+                index = await asyncio.to_thread(DiaryIndex, entries)
+            finally:
+                with self._lock:
+                    changed = self._building.pop(username)
+            # Si el diario cambió durante la lectura, la copia puede no incluir ese cambio
+            if not changed:
+                self.indexes.put(username, [index, version, time.monotonic()])
+                return index
+
+    async def _refresh(self, username: str, cached: list) -> DiaryIndex:
+        """Seguir con el índice si el diario no ha cambiado desde que se construyó; si no, reconstruirlo"""
+        if await self._version(username) == cached[1]:
+            cached[2] = time.monotonic()
+            return cached[0]
+        return await self._load(username)
+
+    async def get_index(self, username: str) -> DiaryIndex:
+        cached = self.indexes.get(username)
+        if cached is not None and time.monotonic() - cached[2] < self.ttl:
+            return cached[0]
+        # Peticiones simultáneas del mismo usuario comparten una sola construcción o comprobación
+        task = self._tasks.get(username)
+        if task is None:
+            task = asyncio.create_task(self._load(username) if cached is None else self._refresh(username, cached))
+            self._tasks[username] = task
+            task.add_done_callback(lambda _: self._tasks.pop(username, None))
+        return await asyncio.shield(task)
+
+    async def search(self, username: str, query: str, k: int = None) -> list[dict]:
+        """Entradas del diario del usuario más relacionadas con 'query'"""
+        k = k or int(os.getenv("RETRIEVAL_TOP_K", 3))
+        with stage("recuperacion"):
+            index = await self.get_index(username)
+            return await asyncio.to_thread(index.search, query, k)
+
+    def stats(self) -> dict:
+        return {"users": self.indexes.stats()}
@@ -0,0 +1,88 @@
+import argparse
+import gc
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def memory_report() -> dict:
+    """
+    Memoria del proceso actual en KB, leída de /proc (solo Linux)
+    'Pss' reparte las páginas compartidas entre los procesos que las usan, así que la suma del Pss
+    de todos los workers es la memoria real; 'Shared_Clean' es lo que se comparte copy-on-write
+    """
+    report = {"pid": os.getpid()}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty"):
+                    report[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return report
+
+
+def preload_nlp():
+    """Cargar text2emotion, su léxico y los corpus de NLTK en el proceso maestro, antes del fork"""
+    from emotion_engine import score_emotions
+    score_emotions("warm up")
+
+
+def run_gunicorn(workers: int, host: str, port: int):
+    from gunicorn.app.base import BaseApplication
+
+    class EmotionAIApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("worker_class", "uvicorn.workers.UvicornWorker")
+            # La app se importa en el maestro: lo que se carga aquí lo comparten todos los workers
+            self.cfg.set("preload_app", True)
+            self.cfg.set("timeout", int(os.getenv("WORKER_TIMEOUT", 120)))
+            self.cfg.set("post_worker_init", self.post_worker_init)
+
+        def load(self):
+            preload_nlp()
+            from main import create_app
+            app = create_app()
+            # Sacar los objetos ya cargados del recolector: si no, al recorrerlos tocaría sus
+            # páginas y se perdería la compartición copy-on-write tras el fork
+            gc.collect()
+            gc.freeze()
+            return app
+
+        @staticmethod
+        def post_worker_init(worker):
+            # El pool de BD, el cliente del LLM y los pools de tareas se crean después, en el
+            # lifespan de cada worker, así que ningún socket se comparte entre procesos
+            print(f"Worker {worker.pid} listo, memoria: {memory_report()}")
+
+    EmotionAIApplication().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor de EmotionAI")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", os.getenv("WEB_CONCURRENCY", 1))),
+                        help="Número de procesos (por defecto WORKERS o WEB_CONCURRENCY)")
+    parser.add_argument("--host", default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", 8000)))
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        import uvicorn
+        uvicorn.run("main:emotionai", host=args.host, port=args.port)
+        return
+
+    if not os.getenv("JWT_SECRET"):
+        print("Aviso: sin JWT_SECRET los tokens dejan de valer cada vez que se reinicia el servidor")
+    # Con varios workers el paralelismo de CPU ya lo dan los propios workers (con el léxico
+    # compartido); un pool de procesos por worker multiplicaría los procesos
+    os.environ.setdefault("CPU_WORKERS", "0")
+    run_gunicorn(args.workers, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
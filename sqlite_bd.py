@@ -0,0 +1,133 @@
+import os
+import sqlite3
+
+from access_bd import AccessBD
+
+
+class SQLiteCursor(sqlite3.Cursor):
+    """Cursor que acepta los marcadores %s de las consultas de AccessBD (SQLite usa ?)"""
+
+    def execute(self, sql, parameters=()):
+        return super().execute(sql.replace("%s", "?"), parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return super().executemany(sql.replace("%s", "?"), seq_of_parameters)
+
+
+class SQLiteConnection(sqlite3.Connection):
+    def cursor(self, factory=SQLiteCursor):
+        return super().cursor(factory)
+
+
+class SQLiteBD(AccessBD):
+    """
+    Almacenamiento en un fichero SQLite, para despliegues de un solo nodo y pruebas de carga
+    sin ida y vuelta por la red hasta un servidor de base de datos.
+    Reutiliza las consultas de AccessBD y solo redefine la conexión y las sentencias con sintaxis
+    de MySQL. Con WAL las lecturas no esperan a las escrituras, así que el pool de conexiones sigue
+    sirviendo; las escrituras se serializan en el propio SQLite (busy_timeout).
+    """
+
+    backend = "sqlite"
+    integrity_error = sqlite3.IntegrityError
+
+    # SQLite no tiene FOR UPDATE: el bloqueo lo toma begin_write con BEGIN IMMEDIATE
+    SELECT_DIARY_FOR_UPDATE = """
+    SELECT happy, angry, surprise, sad, fear
+    FROM diary_entries
+    WHERE user_id = %s AND date = %s
+    """
+
+    UPSERT_DIARY_ENTRY = """
+    INSERT INTO diary_entries (user_id, date, entry, happy, angry, surprise, sad, fear)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (user_id, date) DO UPDATE SET
+    entry = excluded.entry,
+    happy = excluded.happy,
+    angry = excluded.angry,
+    surprise = excluded.surprise,
+    sad = excluded.sad,
+    fear = excluded.fear
+    """
+
+    ADD_EMOTION_AGGREGATES = """
+    INSERT INTO emotion_aggregates (user_id, entries, version, happy_sum, angry_sum, surprise_sum, sad_sum, fear_sum)
+    VALUES (%s, %s, 1, %s, %s, %s, %s, %s)
+    ON CONFLICT (user_id) DO UPDATE SET
+    entries = entries + excluded.entries,
+    version = version + 1,
+    happy_sum = happy_sum + excluded.happy_sum,
+    angry_sum = angry_sum + excluded.angry_sum,
+    surprise_sum = surprise_sum + excluded.surprise_sum,
+    sad_sum = sad_sum + excluded.sad_sum,
+    fear_sum = fear_sum + excluded.fear_sum
+    """
+
+    # En SQLite todas las asignaciones ven los valores antiguos de la fila
+    UPSERT_PROFILE_SNAPSHOT = """
+    INSERT INTO profile_snapshots (user_id, diary_version, profile, updated_at)
+    VALUES (%s, %s, %s, datetime('now', 'localtime'))
+    ON CONFLICT (user_id) DO UPDATE SET
+    profile = CASE WHEN excluded.diary_version >= diary_version THEN excluded.profile ELSE profile END,
+    updated_at = CASE WHEN excluded.diary_version >= diary_version THEN excluded.updated_at ELSE updated_at END,
+    diary_version = MAX(diary_version, excluded.diary_version)
+    """
+
+    # El WHERE evita la ambigüedad entre ON CONFLICT y un JOIN ... ON del SELECT
+    REBUILD_EMOTION_AGGREGATES = """
+    INSERT INTO emotion_aggregates (user_id, entries, version, happy_sum, angry_sum, surprise_sum, sad_sum, fear_sum)
+    SELECT user_id, COUNT(*), 1,
+           COALESCE(SUM(happy), 0), COALESCE(SUM(angry), 0), COALESCE(SUM(surprise), 0),
+           COALESCE(SUM(sad), 0), COALESCE(SUM(fear), 0)
+    FROM diary_entries
+    WHERE true
+    GROUP BY user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+    entries = excluded.entries,
+    version = version + 1,
+    happy_sum = excluded.happy_sum,
+    angry_sum = excluded.angry_sum,
+    surprise_sum = excluded.surprise_sum,
+    sad_sum = excluded.sad_sum,
+    fear_sum = excluded.fear_sum
+    """
+
+    UPSERT_JOB = """
+    INSERT INTO jobs (id, user_id, kind, status, progress, message, result, error, created_at, updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (id) DO UPDATE SET
+    status = excluded.status,
+    progress = excluded.progress,
+    message = excluded.message,
+    result = excluded.result,
+    error = excluded.error,
+    updated_at = excluded.updated_at
+    """
+
+    def __init__(self, path: str = None, pool_size: int = None):
+        self.path = path or os.getenv('SQLITE_PATH', 'emotionai.db')
+        super().__init__(pool_size)
+
+    def get_db_connection(self):
+        # Cada conexión la usa un solo hilo a la vez, pero no siempre el mismo (la reparte el pool)
+        connection = sqlite3.connect(self.path, timeout=self.pool.timeout, check_same_thread=False,
+                                     factory=SQLiteConnection)
+        for pragma in (
+            "journal_mode = WAL",          # Lectores y un escritor a la vez, sin bloquearse
+            "synchronous = NORMAL",        # Con WAL no se pierde consistencia, solo el último commit si se va la luz
+            "foreign_keys = ON",
+            f"busy_timeout = {int(self.pool.timeout * 1000)}",
+            f"cache_size = -{int(os.getenv('SQLITE_CACHE_KB', 65536))}",
+            f"mmap_size = {int(os.getenv('SQLITE_MMAP_BYTES', 268435456))}",
+            "temp_store = MEMORY",
+        ):
+            connection.execute(f"PRAGMA {pragma}")
+        return connection
+
+    def ping_connection(self, connection):
+        """Las conexiones a un fichero no caducan"""
+        connection.execute("SELECT 1")
+
+    def begin_write(self, cursor):
+        """Tomar ya el bloqueo de escritura, para que nadie cambie lo que se lee antes de escribir"""
+        cursor.execute("BEGIN IMMEDIATE")
@@ -0,0 +1,108 @@
+import os
+from abc import ABC, abstractmethod
+
+from dotenv import load_dotenv
+
+# Emociones de text2emotion, en el mismo orden que las columnas de las tablas
+EMOTIONS = ("Happy", "Angry", "Surprise", "Sad", "Fear")
+
+
+class Storage(ABC):
+    """
+    Operaciones de almacenamiento que usa la aplicación, sin depender del motor de base de datos.
+    Implementaciones: AccessBD (MySQL) y SQLiteBD (SQLite embebido, sin servidor).
+    Además de estos métodos, cada implementación tiene un pool de conexiones ('pool'), la caché de
+    ids de usuario (get_user_id, user_id_cache_stats), los avisos de cambios del diario
+    (add_diary_listener) y 'cpu_pool' para ejecutar bcrypt fuera del proceso.
+    """
+
+    # Nombre del motor: "mysql" o "sqlite" (lo usan las migraciones)
+    backend = None
+
+    # Usuarios
+    @abstractmethod
+    def register_user(self, username: str, password: str): ...
+
+    @abstractmethod
+    def change_password(self, username: str, new_password: str): ...
+
+    @abstractmethod
+    def check_user(self, username: str) -> bool: ...
+
+    @abstractmethod
+    def verify_user(self, username: str, password: str) -> bool: ...
+
+    # Diario, agregados de emociones y perfiles
+    @abstractmethod
+    def insert_diary_entry(self, user: str, diary_entry: dict): ...
+
+    @abstractmethod
+    def get_diary_entries(self, user: str, limit: int = 50) -> list: ...
+
+    @abstractmethod
+    def get_diary_page(self, user: str, since: str = None, until: str = None, before: str = None,
+                       limit: int = 50) -> tuple[list, str]: ...
+
+    @abstractmethod
+    def get_diary_entry(self, user: str, date: str) -> dict: ...
+
+    @abstractmethod
+    def get_emotion_profile(self, user: str) -> dict: ...
+
+    @abstractmethod
+    def get_profile_snapshot(self, user: str) -> dict: ...
+
+    @abstractmethod
+    def save_profile_snapshot(self, user: str, profile: dict, diary_version: int): ...
+
+    @abstractmethod
+    def rebuild_emotion_aggregates(self, cursor=None): ...
+
+    # Historial del chat
+    @abstractmethod
+    def insert_chat_history(self, user: str, chat_history: dict): ...
+
+    @abstractmethod
+    def insert_chat_history_batch(self, turns: list) -> int: ...
+
+    @abstractmethod
+    def get_chat_history(self, user: str, limit: int = None) -> list: ...
+
+    @abstractmethod
+    def get_chat_page(self, user: str, before: str = None, limit: int = 10) -> tuple[list, str]: ...
+
+    @abstractmethod
+    def get_last_chat_id(self, user: str) -> int: ...
+
+    # Trabajos en segundo plano
+    @abstractmethod
+    def save_job(self, job: dict): ...
+
+    @abstractmethod
+    def get_job(self, job_id: str) -> dict: ...
+
+    @abstractmethod
+    def delete_jobs(self, before: float) -> int: ...
+
+    # Mantenimiento
+    @abstractmethod
+    def pool_stats(self) -> dict: ...
+
+    @abstractmethod
+    def close(self): ...
+
+
+def create_storage(backend: str = None) -> Storage:
+    """
+    Crear el almacenamiento configurado en DB_BACKEND: "mysql" (por defecto) o "sqlite"
+    Con SQLite la base de datos es el fichero SQLITE_PATH y no hace falta servidor
+    """
+    load_dotenv()
+    backend = (backend or os.getenv("DB_BACKEND", "mysql")).lower()
+    if backend == "mysql":
+        from access_bd import AccessBD
+        return AccessBD()
+    if backend == "sqlite":
+        from sqlite_bd import SQLiteBD
+        return SQLiteBD()
+    raise ValueError(f"DB_BACKEND desconocido: {backend} (usa 'mysql' o 'sqlite')")
@@ -0,0 +1,67 @@
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+import uvicorn
+from fastapi.testclient import TestClient
+
+# Los módulos de la aplicación están en la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.fake_mistral import create_app as create_fake_mistral
+
+# Emociones fijas que devuelve el análisis en las pruebas de la API
+EMOCIONES = {"Happy": 0.5, "Angry": 0.0, "Surprise": 0.0, "Sad": 0.5, "Fear": 0.0}
+
+
+@pytest.fixture
+def storage(tmp_path):
+    """Almacenamiento SQLite en un fichero temporal, con el esquema ya migrado"""
+    from migrations import migrate
+    from sqlite_bd import SQLiteBD
+
+    storage = SQLiteBD(str(tmp_path / "emotionai.db"), pool_size=2)
+    migrate(storage)
+    yield storage
+    storage.close()
+
+
+@pytest.fixture(scope="module")
+def fake_mistral():
+    """bench.fake_mistral en un puerto libre, sin latencia ni espera entre tokens"""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    app = create_fake_mistral(latency=0, tokens_per_second=0, reply_tokens=12, error_rate=0, seed=0)
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{sock.getsockname()[1]}"
+    server.should_exit = True
+    thread.join()
+
+
+@pytest.fixture
+def client(fake_mistral, tmp_path, monkeypatch):
+    """La aplicación completa sobre SQLite y fake_mistral, con la sesión de un usuario ya iniciada"""
+    import main
+
+    monkeypatch.setenv("DB_BACKEND", "sqlite")
+    monkeypatch.setenv("SQLITE_PATH", str(tmp_path / "emotionai.db"))
+    monkeypatch.setenv("CPU_WORKERS", "0")
+    monkeypatch.setenv("MISTRAL_API_KEY", "test")
+    monkeypatch.setenv("MISTRAL_SERVER_URL", fake_mistral)
+    monkeypatch.setenv("LLM_CACHE_DIR", str(tmp_path / "llm_cache"))
+    monkeypatch.setenv("CHAT_SPOOL_DIR", str(tmp_path / "chat_spool"))
+    # Emociones fijas, para no depender de los corpus de NLTK
+    monkeypatch.setattr(main, "comprobar_nltk", lambda: None)
+    monkeypatch.setattr(main.emotion_engine, "analyze", lambda text: dict(EMOCIONES))
+    with TestClient(main.create_app()) as client:
+        client.post("/register", json={"username": "ana", "password": "secreta"})
+        token = client.post("/login", json={"username": "ana", "password": "secreta"}).json()["token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+        yield client
@@ -0,0 +1,32 @@
+import json
+
+from conftest import EMOCIONES
+
+
+def leer_eventos(response) -> list[tuple[str, dict]]:
+    eventos = []
+    for bloque in response.text.strip().split("\n\n"):
+        lineas = dict(linea.split(": ", 1) for linea in bloque.split("\n"))
+        eventos.append((lineas.get("event", "message"), json.loads(lineas["data"])))
+    return eventos
+
+
+def test_chat_stream_end_to_end(client):
+    import main
+
+    for mensaje in ("hola", "sigo aquí"):
+        response = client.post("/chat/stream", json={"content": mensaje})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        eventos = leer_eventos(response)
+        *deltas, (evento, fin) = eventos
+        assert evento == "fin" and fin == {"emociones": EMOCIONES}
+        respuesta = "".join(data["delta"] for _, data in deltas)
+        assert len(deltas) == 12 and respuesta != main.FALLBACK_RESPONSE
+
+    # Los dos streams terminan sin errores y sus turnos quedan en la ventana de la conversación
+    assert main.llm.stats()["failures"] == 0
+    assert main.llm.stats()["circuit"] == "closed"
+    conversacion = client.get("/chat").json()["conversation"]
+    assert [m["content"] for m in conversacion if m["role"] == "user"] == ["hola", "sigo aquí"]
+    assert conversacion[-1]["content"] == respuesta
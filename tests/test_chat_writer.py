@@ -0,0 +1,103 @@
+import asyncio
+import json
+import os
+import threading
+
+from chat_writer import ChatHistoryWriter
+
+
+class FakeDB:
+    """Sustituto de AsyncAccessBD que guarda los lotes y puede fallar a voluntad"""
+
+    def __init__(self, failing: bool = False):
+        self.batches = []
+        self.failing = failing
+
+    async def insert_chat_history_batch(self, turns: list) -> int:
+        if self.failing:
+            raise ConnectionError("BD caída")
+        self.batches.append(list(turns))
+        return len(turns)
+
+
+def turno(i: int) -> dict:
+    return {"date": "2024-03-01 10:00:00", "human_message": f"pregunta {i}", "bot_message": f"respuesta {i}",
+            "emotions": {}}
+
+
+def test_turns_are_written_in_batches(tmp_path):
+    async def scenario():
+        db = FakeDB()
+        writer = ChatHistoryWriter(db, batch_size=3, flush_interval=10, spool_dir=str(tmp_path))
+        await writer.start()
+        for i in range(7):
+            writer.add("ana", turno(i))
+        await asyncio.sleep(0.05)
+        # Dos lotes llenos; el séptimo turno espera a llenar otro lote o a que pase el intervalo
+        assert [len(batch) for batch in db.batches] == [3, 3]
+        await writer.close()
+        assert [len(batch) for batch in db.batches] == [3, 3, 1]
+        assert writer.stats()["written"] == 7 and writer.stats()["batches"] == 3
+
+    asyncio.run(scenario())
+
+
+def test_partial_batch_is_flushed_after_the_interval(tmp_path):
+    async def scenario():
+        db = FakeDB()
+        writer = ChatHistoryWriter(db, batch_size=50, flush_interval=0.05, spool_dir=str(tmp_path))
+        await writer.start()
+        writer.add("ana", turno(0))
+        await asyncio.sleep(0.2)
+        assert db.batches == [[("ana", turno(0))]]
+        await writer.close()
+
+    asyncio.run(scenario())
+
+
+def test_failed_batches_are_spooled_and_replayed(tmp_path, monkeypatch):
+    monkeypatch.setenv("CHAT_WRITE_RETRIES", "0")
+
+    async def scenario():
+        db = FakeDB(failing=True)
+        writer = ChatHistoryWriter(db, batch_size=2, flush_interval=0, spool_dir=str(tmp_path))
+        await writer.start()
+        writer.add("ana", turno(0))
+        writer.add("ana", turno(1))
+        await writer.close()
+        assert writer.stats()["spooled"] == 2
+        assert os.listdir(tmp_path) == [f"{os.getpid()}.jsonl"]
+
+        # Al arrancar de nuevo con la BD disponible se recuperan los turnos del fichero
+        db.failing = False
+        writer = ChatHistoryWriter(db, spool_dir=str(tmp_path))
+        await writer.start()
+        await writer.close()
+        assert db.batches == [[("ana", turno(0)), ("ana", turno(1))]]
+        assert writer.stats()["replayed"] == 2
+        assert os.listdir(tmp_path) == []
+
+    asyncio.run(scenario())
+
+
+def test_overflow_is_spooled_off_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setenv("CHAT_QUEUE_MAX", "1")
+
+    async def scenario():
+        # Sin start(): nadie vacía la cola, así que el segundo turno no cabe
+        writer = ChatHistoryWriter(FakeDB(), spool_dir=str(tmp_path))
+        hilos = []
+        spool = writer._spool
+        monkeypatch.setattr(writer, "_spool", lambda batch: (hilos.append(threading.current_thread()), spool(batch)))
+        writer.add("ana", turno(0))
+        writer.add("ana", turno(1))
+        # El turno desbordado sigue visible para la conversación hasta que está en el fichero
+        assert writer.pending("ana") == [turno(0), turno(1)]
+        assert hilos == []
+        await writer.close()
+        assert hilos and threading.main_thread() not in hilos
+        assert writer.pending("ana") == [turno(0)]
+        with open(writer.spool_path, encoding="utf-8") as f:
+            assert [json.loads(line) for line in f] == [{"username": "ana", "turn": turno(1)}]
+
+    asyncio.run(scenario())
@@ -0,0 +1,122 @@
+import asyncio
+
+from async_bd import AsyncAccessBD
+from chat_writer import ChatHistoryWriter
+from conversations import ConversationStore
+
+EMOCIONES = {"Happy": 0.1, "Angry": 0.0, "Surprise": 0.0, "Sad": 0.0, "Fear": 0.0}
+
+
+def turno(i: int) -> dict:
+    return {"date": "2024-03-01 10:00:00", "human_message": f"pregunta {i}", "bot_message": f"respuesta {i}",
+            "emotions": EMOCIONES}
+
+
+def preguntas(conversation: list) -> list:
+    return [message["content"] for message in conversation if message["role"] == "user"]
+
+
+def test_window_keeps_turns_of_the_same_second_in_order(storage):
+    storage.register_user("ana", "secreta")
+    storage.insert_chat_history_batch([("ana", turno(i)) for i in range(3)])
+
+    async def scenario():
+        db = AsyncAccessBD(storage)
+        store = ConversationStore(db, window=4)
+        assert preguntas(await store.get("ana")) == ["pregunta 1", "pregunta 2"]
+        store.add_turn("ana", "pregunta 3", "respuesta 3")
+        conversation = await store.get("ana")
+        assert preguntas(conversation) == ["pregunta 2", "pregunta 3"]
+        assert conversation[-1] == {"role": "assistant", "content": "respuesta 3"}
+        db.executor.shutdown(wait=True)
+
+    asyncio.run(scenario())
+
+
+def test_window_includes_turns_not_yet_written(storage, tmp_path):
+    storage.register_user("ana", "secreta")
+    storage.insert_chat_history_batch([("ana", turno(0)), ("ana", turno(1))])
+
+    async def scenario():
+        db = AsyncAccessBD(storage)
+        writer = ChatHistoryWriter(db, flush_interval=10, spool_dir=str(tmp_path / "spool"))
+        # El turno 1 ya está en la BD y sigue en el writer (se escribió durante la lectura); el 2 aún no
+        writer.add("ana", turno(1))
+        writer.add("ana", turno(2))
+        store = ConversationStore(db, writer)
+        assert preguntas(await store.get("ana")) == ["pregunta 0", "pregunta 1", "pregunta 2"]
+
+        await writer.start()
+        await writer.close()
+        assert writer.pending("ana") == []
+        store = ConversationStore(db, writer)
+        assert preguntas(await store.get("ana")) == ["pregunta 0", "pregunta 1", "pregunta 1", "pregunta 2"]
+        db.executor.shutdown(wait=True)
+
+    asyncio.run(scenario())
+
+
+def test_turns_finished_during_the_load_are_not_lost(storage):
+    storage.register_user("ana", "secreta")
+
+    async def scenario():
+        db = AsyncAccessBD(storage)
+        store = ConversationStore(db)
+        loading = asyncio.create_task(store.get("ana"))
+        while "ana" not in store._pending:
+            await asyncio.sleep(0)
+        store.add_turn("ana", "pregunta 0", "respuesta 0")
+        assert preguntas(await loading) == ["pregunta 0"]
+        db.executor.shutdown(wait=True)
+
+    asyncio.run(scenario())
+
+
+def test_workers_see_each_others_turns_after_the_ttl(storage, tmp_path):
+    storage.register_user("ana", "secreta")
+
+    async def scenario():
+        db = AsyncAccessBD(storage)
+        # Dos workers con su propia ventana y su propio writer sobre la misma BD
+        workers = []
+        for name in ("a", "b"):
+            writer = ChatHistoryWriter(db, flush_interval=0, spool_dir=str(tmp_path / name))
+            await writer.start()
+            workers.append((ConversationStore(db, writer, ttl=0.2), writer))
+        for store, _ in workers:
+            assert await store.get("ana") == []
+
+        for i, ((store, writer), (other, _)) in enumerate((workers, workers[::-1])):
+            store.add_turn("ana", f"pregunta {i}", f"respuesta {i}")
+            writer.add("ana", turno(i))
+            # El otro worker sigue atendiendo al usuario sin pausas más largas que el TTL
+            for _ in range(10):
+                conversation = await other.get("ana")
+                await asyncio.sleep(0.05)
+            assert preguntas(conversation) == [f"pregunta {n}" for n in range(i + 1)]
+        for _, writer in workers:
+            await writer.close()
+        db.executor.shutdown(wait=True)
+
+    asyncio.run(scenario())
+
+
+def test_window_is_not_reread_while_nothing_new_is_saved(storage, monkeypatch):
+    storage.register_user("ana", "secreta")
+    storage.insert_chat_history_batch([("ana", turno(0))])
+
+    async def scenario():
+        db = AsyncAccessBD(storage)
+        store = ConversationStore(db, ttl=0)
+        assert preguntas(await store.get("ana")) == ["pregunta 0"]
+        pages = []
+        get_chat_page = storage.get_chat_page
+        monkeypatch.setattr(storage, "get_chat_page", lambda *args: pages.append(args) or get_chat_page(*args))
+        assert preguntas(await store.get("ana")) == ["pregunta 0"]
+        assert pages == []
+        storage.insert_chat_history_batch([("ana", turno(1))])
+        assert preguntas(await store.get("ana")) == ["pregunta 0", "pregunta 1"]
+        assert len(pages) == 1
+        db.executor.shutdown(wait=True)
+
+    asyncio.run(scenario())
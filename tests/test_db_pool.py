@@ -0,0 +1,119 @@
+import threading
+
+import pytest
+
+from db_pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.in_transaction = False
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(**kwargs):
+    created = []
+
+    def factory():
+        conn = FakeConnection()
+        created.append(conn)
+        return conn
+
+    return ConnectionPool(factory, **kwargs), created
+
+
+def test_reuses_idle_connections():
+    pool, created = make_pool(size=2)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert first is second
+    assert len(created) == 1
+    assert pool.stats()["checkouts"] == 2
+
+
+def test_rolls_back_on_exception():
+    pool, created = make_pool(size=1)
+    with pytest.raises(ValueError):
+        with pool.connection():
+            raise ValueError
+    assert created[0].rollbacks == 1
+    assert pool.stats()["in_use"] == 0
+
+
+def test_reset_on_release_ends_open_transactions():
+    def reset(conn):
+        if conn.in_transaction:
+            conn.rollback()
+
+    pool, created = make_pool(size=1, reset=reset)
+    with pool.connection() as conn:
+        conn.in_transaction = True
+    assert created[0].rollbacks == 1
+    with pool.connection():
+        pass
+    assert created[0].rollbacks == 1
+
+
+def test_pings_only_after_idle_threshold():
+    pings = []
+    pool, _ = make_pool(size=1, ping=pings.append, ping_after=60)
+    for _ in range(3):
+        with pool.connection():
+            pass
+    assert pings == []
+
+    pool.ping_after = 0
+    with pool.connection() as conn:
+        pass
+    assert pings == [conn]
+
+
+def test_broken_connection_is_replaced():
+    def ping(conn):
+        raise OSError("conexión caída")
+
+    pool, created = make_pool(size=1, ping=ping, ping_after=0)
+    with pool.connection():
+        pass
+    with pool.connection() as conn:
+        assert conn is created[1]
+    assert created[0].closed
+    assert pool.stats()["reconnects"] == 1
+
+
+def test_timeout_when_exhausted():
+    pool, _ = make_pool(size=1, timeout=0.05)
+    held = pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    pool.release(held)
+    assert pool.stats()["timeouts"] == 1
+
+
+def test_threads_never_exceed_size():
+    pool, created = make_pool(size=3)
+    barrier = threading.Barrier(6)
+
+    def worker():
+        barrier.wait()
+        for _ in range(50):
+            with pool.connection():
+                pass
+
+    threads = [threading.Thread(target=worker) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(created) <= 3
+    assert pool.stats()["in_use"] == 0
@@ -0,0 +1,55 @@
+import pytest
+
+
+def entrada(date: str, happy: float, sad: float, texto: str = "texto") -> dict:
+    return {"date": date, "entry": texto,
+            "emotions": {"Happy": happy, "Angry": 0.0, "Surprise": 0.0, "Sad": sad, "Fear": 0.0}}
+
+
+@pytest.fixture
+def ana(storage):
+    storage.register_user("ana", "secreta")
+    return storage
+
+
+def test_new_entries_update_the_averages(ana):
+    assert ana.get_emotion_profile("ana") is None
+    ana.insert_diary_entry("ana", entrada("2024-01-01", 1.0, 0.0))
+    ana.insert_diary_entry("ana", entrada("2024-01-02", 0.5, 0.5))
+    profile = ana.get_emotion_profile("ana")
+    assert profile["entries"] == 2 and profile["version"] == 2
+    assert profile["averages"]["Happy"] == pytest.approx(0.75)
+    assert profile["averages"]["Sad"] == pytest.approx(0.25)
+
+
+def test_rewriting_a_date_applies_only_the_difference(ana):
+    ana.insert_diary_entry("ana", entrada("2024-01-01", 1.0, 0.0))
+    ana.insert_diary_entry("ana", entrada("2024-01-01", 0.0, 1.0, "otro texto"))
+    profile = ana.get_emotion_profile("ana")
+    assert profile["entries"] == 1 and profile["version"] == 2
+    assert profile["averages"]["Happy"] == pytest.approx(0.0)
+    assert profile["averages"]["Sad"] == pytest.approx(1.0)
+
+
+def test_rebuild_matches_incremental_aggregates(ana):
+    for day, happy in enumerate((0.3, 0.6, 0.9), start=1):
+        ana.insert_diary_entry("ana", entrada(f"2024-01-0{day}", happy, 1 - happy))
+    incremental = ana.get_emotion_profile("ana")
+    ana.rebuild_emotion_aggregates()
+    rebuilt = ana.get_emotion_profile("ana")
+    assert rebuilt["entries"] == incremental["entries"]
+    assert rebuilt["version"] > incremental["version"]
+    for emotion, value in incremental["averages"].items():
+        assert rebuilt["averages"][emotion] == pytest.approx(value)
+
+
+def test_snapshot_is_fresh_until_the_diary_changes(ana):
+    ana.insert_diary_entry("ana", entrada("2024-01-01", 1.0, 0.0))
+    version = ana.get_emotion_profile("ana")["version"]
+    ana.save_profile_snapshot("ana", {"eneagrama": {"tipo": 4}}, version)
+    assert ana.get_profile_snapshot("ana") == {"profile": {"eneagrama": {"tipo": 4}}, "fresh": True}
+    ana.insert_diary_entry("ana", entrada("2024-01-02", 0.0, 1.0))
+    assert ana.get_profile_snapshot("ana")["fresh"] is False
+    # Un perfil calculado con una versión anterior no sustituye al guardado
+    ana.save_profile_snapshot("ana", {"eneagrama": {"tipo": 1}}, version - 1)
+    assert ana.get_profile_snapshot("ana")["profile"] == {"eneagrama": {"tipo": 4}}
@@ -0,0 +1,88 @@
+import sys
+
+import nltk
+import pytest
+
+import emotion_engine
+
+
+@pytest.fixture
+def sin_text2emotion(monkeypatch):
+    """Forzar que text2emotion se vuelva a importar"""
+    monkeypatch.setattr(emotion_engine, "_text2emotion", None)
+    monkeypatch.delitem(sys.modules, "text2emotion", raising=False)
+
+
+def test_text2emotion_import_does_not_download_when_data_is_installed(sin_text2emotion, monkeypatch):
+    def download(*args, **kwargs):
+        raise AssertionError("nltk.download no debería llamarse")
+
+    monkeypatch.setattr(emotion_engine, "check_nltk_data", lambda download=False: [])
+    monkeypatch.setattr(nltk, "download", download)
+    te = emotion_engine.load_text2emotion()
+    assert hasattr(te, "get_emotion")
+    assert nltk.download is download
+    assert emotion_engine.load_text2emotion() is te
+
+
+def test_text2emotion_import_downloads_missing_data(sin_text2emotion, monkeypatch):
+    downloads = []
+    monkeypatch.setattr(emotion_engine, "check_nltk_data", lambda download=False: ["punkt"])
+    monkeypatch.setattr(nltk, "download", lambda package, *args, **kwargs: downloads.append(package))
+    emotion_engine.load_text2emotion()
+    assert "punkt" in downloads
+
+
+def test_analyze_is_memoized(monkeypatch):
+    calls = []
+
+    def score(texts):
+        calls.append(list(texts))
+        return [{"Happy": 1.0} for _ in texts]
+
+    engine = emotion_engine.EmotionEngine(cache_size=8)
+    monkeypatch.setattr(engine, "_score", score)
+    assert engine.analyze("hola mundo") == {"Happy": 1.0}
+    assert engine.analyze("hola mundo") == {"Happy": 1.0}
+    # El memo es por texto exacto: otros espacios son otro texto
+    assert engine.analyze_batch(["hola  mundo", "adiós", "adiós", "hola mundo"]) == [{"Happy": 1.0}] * 4
+    assert calls == [["hola mundo"], ["hola  mundo", "adiós"]]
+
+
+class SinStopwords:
+    @staticmethod
+    def words(*args):
+        return []
+
+
+class SinLematizar:
+    def lemmatize(self, word, pos=None):
+        return word
+
+
+@pytest.fixture
+def text2emotion(monkeypatch):
+    """text2emotion ya importado; sin los corpus de NLTK, con tokenizador, stopwords y lematizador mínimos"""
+    missing = emotion_engine.check_nltk_data()
+    monkeypatch.setattr(emotion_engine, "check_nltk_data", lambda download=False: [])
+    te = emotion_engine.load_text2emotion()
+    if missing:
+        monkeypatch.setattr(te, "word_tokenize", str.split)
+        monkeypatch.setattr(te, "stopwords", SinStopwords)
+        monkeypatch.setattr(te, "WordNetLemmatizer", SinLematizar)
+    return te
+
+
+@pytest.mark.parametrize("text", [
+    "I am not  sad today",
+    "I am not\nsad today",
+    "I am not\tsad today",
+    "I am  not sad today  ",
+    "I am not sad today",
+])
+def test_analyze_matches_get_emotion(text2emotion, text):
+    engine = emotion_engine.EmotionEngine(cache_size=8)
+    assert engine.analyze(text) == text2emotion.get_emotion(text)
+    assert engine.analyze_batch([text, " ".join(text.split())]) == [
+        text2emotion.get_emotion(text), text2emotion.get_emotion(" ".join(text.split()))
+    ]
@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from async_bd import AsyncAccessBD
+from jobs import JobQueue, JobQueueFull
+
+
+async def esperar(queue: JobQueue, job_id: str, username: str = "ana") -> dict:
+    for _ in range(200):
+        job = await queue.get(job_id, username)
+        if job["estado"] in ("terminado", "error"):
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError("El trabajo no ha terminado")
+
+
+def test_job_runs_and_reports_progress():
+    async def scenario():
+        queue = JobQueue(workers=1)
+        avances = []
+        release = asyncio.Event()
+
+        async def perfilado(username, progreso):
+            await progreso(0.5, "a medias")
+            avances.append((await queue.get(job["id"], username))["progreso"])
+            await release.wait()
+            return {"usuario": username}
+
+        queue.register("perfilado", perfilado)
+        await queue.start()
+        job = await queue.submit("ana", "perfilado")
+        assert job["estado"] == "pendiente"
+        await asyncio.sleep(0.05)
+        release.set()
+        job = await esperar(queue, job["id"])
+        assert avances == [0.5]
+        assert job["estado"] == "terminado" and job["progreso"] == 1.0 and job["resultado"] == {"usuario": "ana"}
+        # Otro usuario no ve el trabajo
+        assert await queue.get(job["id"], "luis") is None
+        await queue.close()
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_submissions_share_a_job():
+    async def scenario():
+        queue = JobQueue(workers=1)
+        release = asyncio.Event()
+
+        async def perfilado(username, progreso):
+            await release.wait()
+            return {}
+
+        queue.register("perfilado", perfilado)
+        await queue.start()
+        first = await queue.submit("ana", "perfilado")
+        second = await queue.submit("ana", "perfilado")
+        assert first["id"] == second["id"]
+        release.set()
+        await esperar(queue, first["id"])
+        # Terminado el anterior, una nueva petición crea otro trabajo
+        assert (await queue.submit("ana", "perfilado"))["id"] != first["id"]
+        assert queue.stats()["deduplicated"] == 1
+        await queue.close()
+
+    asyncio.run(scenario())
+
+
+def test_errors_are_reported():
+    async def scenario():
+        queue = JobQueue(workers=1)
+
+        async def no_encontrado(username, progreso):
+            raise HTTPException(status_code=404, detail="Sin entradas")
+
+        async def roto(username, progreso):
+            raise ValueError("fallo")
+
+        queue.register("objetivo", no_encontrado)
+        queue.register("perfilado", roto)
+        await queue.start()
+        objetivo = await esperar(queue, (await queue.submit("ana", "objetivo"))["id"])
+        perfilado = await esperar(queue, (await queue.submit("ana", "perfilado"))["id"])
+        assert objetivo["estado"] == "error" and objetivo["error"] == "Sin entradas"
+        assert perfilado["estado"] == "error" and perfilado["error"] == "Error interno"
+        await queue.close()
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_rejects_new_jobs():
+    async def scenario():
+        queue = JobQueue(workers=1, max_pending=1)
+        queue.register("perfilado", lambda username, progreso: asyncio.sleep(0))
+        await queue.submit("ana", "perfilado")
+        with pytest.raises(JobQueueFull):
+            await queue.submit("luis", "perfilado")
+        assert queue.stats()["rejected"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_persisted_jobs_are_visible_to_other_workers(storage):
+    storage.register_user("ana", "secreta")
+
+    async def scenario():
+        db = AsyncAccessBD(storage)
+        queue = JobQueue(db, workers=1)
+
+        async def objetivo(username, progreso):
+            return {"objetivos": ["dormir más"]}
+
+        queue.register("objetivo", objetivo)
+        await queue.start()
+        job = await esperar(queue, (await queue.submit("ana", "objetivo"))["id"])
+        await queue.close()
+
+        # Otro proceso, sin el trabajo en memoria, lo lee de la base de datos
+        other = JobQueue(db, workers=1)
+        assert await other.get(job["id"], "ana") == job
+        assert await other.get(job["id"], "luis") is None
+        db.executor.shutdown(wait=True)
+
+    asyncio.run(scenario())
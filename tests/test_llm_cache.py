@@ -0,0 +1,73 @@
+import asyncio
+
+from llm_cache import LLMCache
+
+MESSAGES = [{"role": "system", "content": "prompt"}]
+
+
+def test_key_depends_on_name_version_and_messages():
+    key = LLMCache.make_key("eneagrama", 1, MESSAGES)
+    assert key == LLMCache.make_key("eneagrama", 1, [dict(m) for m in MESSAGES])
+    assert key != LLMCache.make_key("eneagrama", 2, MESSAGES)
+    assert key != LLMCache.make_key("big_five", 1, MESSAGES)
+    assert key != LLMCache.make_key("eneagrama", 1, [{"role": "system", "content": "otro"}])
+
+
+def test_put_get_and_invalidate(tmp_path):
+    cache = LLMCache(str(tmp_path))
+    key = LLMCache.make_key("eneagrama", 1, MESSAGES)
+    assert cache.get("ana", key) is None
+    cache.put("ana", key, {"tipo": 4})
+    cache.put("luis", key, {"tipo": 7})
+    assert cache.get("ana", key) == {"tipo": 4}
+    cache.invalidate("ana")
+    assert cache.get("ana", key) is None
+    assert cache.get("luis", key) == {"tipo": 7}
+    assert cache.stats()["entries"] == 1
+
+
+def test_expired_entries_are_removed(tmp_path):
+    cache = LLMCache(str(tmp_path), ttl=0)
+    cache.put("ana", "clave", 1)
+    assert cache.get("ana", "clave") is None
+    assert cache.stats()["expirations"] == 1 and cache.stats()["entries"] == 0
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = LLMCache(str(tmp_path), max_entries=10)
+    for i in range(11):
+        cache.put("ana", f"clave{i}", i)
+    assert cache.stats()["entries"] == 9
+    assert cache.stats()["evictions"] == 2
+
+
+def test_concurrent_computations_share_one_call(tmp_path):
+    async def scenario():
+        cache = LLMCache(str(tmp_path))
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"tipo": 4}
+
+        results = await asyncio.gather(*(cache.get_or_compute("ana", "clave", compute) for _ in range(5)))
+        assert results == [{"tipo": 4}] * 5
+        assert len(calls) == 1
+        assert await cache.get_or_compute("ana", "clave", compute) == {"tipo": 4}
+        assert len(calls) == 1
+
+    asyncio.run(scenario())
+
+
+def test_none_is_not_cached(tmp_path):
+    async def scenario():
+        cache = LLMCache(str(tmp_path))
+
+        async def invalid():
+            return None
+
+        assert await cache.get_or_compute("ana", "clave", invalid) is None
+        assert cache.stats()["entries"] == 0
+
+    asyncio.run(scenario())
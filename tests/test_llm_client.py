@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from llm_client import CircuitBreaker, LLMClient, LLMUnavailable
+
+
+def make_client(monkeypatch, **env):
+    for name, value in {"LLM_MAX_RETRIES": "0", "LLM_BREAKER_THRESHOLD": "1", "LLM_BREAKER_COOLDOWN": "0",
+                        **env}.items():
+        monkeypatch.setenv(name, value)
+    return LLMClient(api_key="test", server_url="http://127.0.0.1:9")
+
+
+def test_breaker_opens_after_threshold_and_probes_once():
+    breaker = CircuitBreaker(threshold=2, cooldown=0)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_breaker_rejects_while_open():
+    breaker = CircuitBreaker(threshold=1, cooldown=60)
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_cancelled_probe_releases_the_breaker():
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_cancelled()
+    assert not breaker.probing
+    assert breaker.allow()
+
+
+def test_cancelled_call_while_half_open(monkeypatch):
+    async def scenario():
+        client = make_client(monkeypatch)
+
+        async def fail():
+            raise ValueError("fallo")
+
+        with pytest.raises(LLMUnavailable):
+            await client._call(fail)
+        assert client.breaker.state == "half-open"
+
+        # La llamada de prueba se cancela (por ejemplo, el cliente SSE se desconecta)
+        probe = asyncio.create_task(client._call(lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        async def ok():
+            return "bien"
+
+        assert await client._call(ok) == "bien"
+        assert client.breaker.state == "closed"
+        await client.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_transient_errors_are_retried(monkeypatch):
+    async def scenario():
+        client = make_client(monkeypatch, LLM_MAX_RETRIES="2", LLM_BACKOFF_BASE="0", LLM_BREAKER_THRESHOLD="5")
+        attempts = []
+
+        async def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise asyncio.TimeoutError
+            return "bien"
+
+        assert await client._call(flaky) == "bien"
+        assert client.stats()["retries"] == 2
+        await client.aclose()
+
+    asyncio.run(scenario())
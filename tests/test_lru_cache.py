@@ -0,0 +1,34 @@
+from lru_cache import LRUCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_counts_hits_and_misses():
+    cache = LRUCache(4)
+    cache.put("a", 1)
+    cache.get("a")
+    cache.get("x")
+    assert cache.stats() == {"size": 1, "maxsize": 4, "hits": 1, "misses": 1, "evictions": 0, "hit_rate": 0.5}
+
+
+def test_user_id_is_resolved_once(storage):
+    storage.register_user("ana", "secreta")
+    storage.user_ids.clear()
+    for _ in range(3):
+        assert storage.get_diary_entries("ana") == []
+    stats = storage.user_id_cache_stats()
+    assert stats["misses"] == 1 and stats["hits"] == 2
+
+
+def test_unknown_user_is_not_cached(storage):
+    assert storage.get_emotion_profile("nadie") is None
+    assert len(storage.user_ids) == 0
@@ -0,0 +1,49 @@
+import asyncio
+
+from metrics import BACKGROUND, Histogram, background_task, endpoint_var
+
+
+def test_background_tasks_do_not_inherit_the_endpoint():
+    async def current_endpoint():
+        return endpoint_var.get()
+
+    async def endpoint():
+        endpoint_var.set("/chat")
+        normal = asyncio.create_task(current_endpoint())
+        background = background_task(current_endpoint())
+        # El endpoint de la petición no cambia al lanzar la tarea
+        assert endpoint_var.get() == "/chat"
+        return await normal, await background
+
+    assert asyncio.run(endpoint()) == ("/chat", BACKGROUND)
+
+
+def test_profile_refresh_is_measured_as_background(monkeypatch):
+    import main
+
+    seen = []
+
+    async def perfilar(username, entries_text=None):
+        seen.append(endpoint_var.get())
+
+    async def chat():
+        endpoint_var.set("/chat")
+        main.refrescar_perfil("ana")
+        await main.perfiles_en_curso["ana"]
+
+    monkeypatch.setattr(main, "perfilar", perfilar)
+    asyncio.run(chat())
+    assert seen == [BACKGROUND]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latencia", "Prueba", ("endpoint",), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, endpoint="/chat")
+    assert histogram.render()[2:] == [
+        'latencia_bucket{endpoint="/chat",le="0.1"} 1',
+        'latencia_bucket{endpoint="/chat",le="1"} 2',
+        'latencia_bucket{endpoint="/chat",le="+Inf"} 3',
+        'latencia_sum{endpoint="/chat"} 5.55',
+        'latencia_count{endpoint="/chat"} 3',
+    ]
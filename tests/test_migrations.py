@@ -0,0 +1,30 @@
+from contextlib import closing
+
+import migrations
+from sqlite_bd import SQLiteBD
+
+
+def test_backfill_runs_on_the_migration_connection(tmp_path, monkeypatch):
+    # Con una sola conexión en el pool, un paso que pidiera otra se quedaría esperando
+    monkeypatch.setenv("DB_POOL_TIMEOUT", "2")
+    storage = SQLiteBD(str(tmp_path / "emotionai.db"), pool_size=1)
+    monkeypatch.setattr(migrations, "SQLITE_MIGRATIONS", migrations.SQLITE_MIGRATIONS[:1])
+    assert migrations.migrate(storage) == [1]
+    # Diario escrito antes de que existieran los agregados
+    with storage.pool.connection() as connection, closing(connection.cursor()) as cursor:
+        cursor.execute("INSERT INTO users (username, password) VALUES ('ana', 'x')")
+        cursor.executemany(
+            "INSERT INTO diary_entries (user_id, date, entry, happy, angry, surprise, sad, fear) "
+            "VALUES (1, %s, 'texto', %s, 0, 0, %s, 0)",
+            [("2024-01-01", 1.0, 0.0), ("2024-01-02", 0.0, 1.0)]
+        )
+        connection.commit()
+
+    monkeypatch.undo()
+    assert migrations.migrate(storage) == [2, 3, 4]
+    profile = storage.get_emotion_profile("ana")
+    assert profile["entries"] == 2
+    assert profile["averages"]["Happy"] == 0.5 and profile["averages"]["Sad"] == 0.5
+    assert migrations.migrate(storage) == []
+    assert migrations.verify_indexes(storage) == []
+    storage.close()
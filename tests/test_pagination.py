@@ -0,0 +1,52 @@
+import pytest
+
+EMOCIONES = {"Happy": 0.1, "Angry": 0.0, "Surprise": 0.0, "Sad": 0.0, "Fear": 0.0}
+
+
+@pytest.fixture
+def ana(storage):
+    storage.register_user("ana", "secreta")
+    return storage
+
+
+def fechas(entries: list) -> list:
+    return [entry["date"] for entry in entries]
+
+
+def test_diary_pages_walk_back_without_gaps(ana):
+    for day in range(1, 8):
+        ana.insert_diary_entry("ana", {"date": f"2024-03-0{day}", "entry": f"día {day}", "emotions": EMOCIONES})
+
+    page, cursor = ana.get_diary_page("ana", limit=3)
+    assert fechas(page) == ["2024-03-05", "2024-03-06", "2024-03-07"] and cursor == "2024-03-05"
+    page, cursor = ana.get_diary_page("ana", before=cursor, limit=3)
+    assert fechas(page) == ["2024-03-02", "2024-03-03", "2024-03-04"]
+    page, cursor = ana.get_diary_page("ana", before=cursor, limit=3)
+    assert fechas(page) == ["2024-03-01"] and cursor is None
+
+
+def test_diary_date_range(ana):
+    for day in range(1, 8):
+        ana.insert_diary_entry("ana", {"date": f"2024-03-0{day}", "entry": f"día {day}", "emotions": EMOCIONES})
+    page, cursor = ana.get_diary_page("ana", since="2024-03-02", until="2024-03-04")
+    assert fechas(page) == ["2024-03-02", "2024-03-03", "2024-03-04"] and cursor is None
+
+
+def test_chat_pages_keep_turns_of_the_same_second_in_order(ana):
+    turns = [("ana", {"date": "2024-03-01 10:00:00", "human_message": f"pregunta {i}",
+                      "bot_message": f"respuesta {i}", "emotions": EMOCIONES}) for i in range(5)]
+    assert ana.insert_chat_history_batch(turns) == 5
+
+    preguntas = []
+    cursor = None
+    while True:
+        page, cursor = ana.get_chat_page("ana", cursor, limit=2)
+        preguntas = [m["content"] for m in page if m["role"] == "user"] + preguntas
+        if cursor is None:
+            break
+    assert preguntas == [f"pregunta {i}" for i in range(5)]
+
+
+def test_unknown_user_has_no_pages(storage):
+    assert storage.get_diary_page("nadie") == ([], None)
+    assert storage.get_chat_page("nadie") == ([], None)
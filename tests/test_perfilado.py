@@ -0,0 +1,70 @@
+import time
+
+from conftest import EMOCIONES
+
+TRAITS = {"Openness", "Conscientiousness", "Extraversion", "Agreeableness", "Neuroticism"}
+
+
+def esperar_trabajo(client, trabajo: dict) -> dict:
+    for _ in range(200):
+        trabajo = client.get("/trabajo", params={"id": trabajo["id"]}).json()["trabajo"]
+        if trabajo["estado"] in ("terminado", "error"):
+            return trabajo
+        time.sleep(0.02)
+    raise AssertionError("El trabajo no ha terminado")
+
+
+def test_endpoint_and_job_return_the_same_profile(client):
+    assert client.get("/perfilado").status_code == 404
+    client.post("/diario", json={"entry": "Hoy ha sido un buen día", "fecha": "2024-03-01"})
+    client.post("/diario", json={"entry": "Algo triste por la tarde", "fecha": "2024-03-02"})
+
+    response = client.get("/perfilado")
+    assert response.status_code == 200
+    directo = response.json()
+    assert directo["pendientes"] == []
+    assert set(directo["perfil"]["big_five"]) == TRAITS
+    assert directo["perfil"]["perfil_emocional"] == EMOCIONES
+
+    response = client.post("/perfilado")
+    assert response.status_code == 202
+    trabajo = esperar_trabajo(client, response.json()["trabajo"])
+    assert trabajo["estado"] == "terminado" and trabajo["progreso"] == 1.0
+    resultado = trabajo["resultado"]
+    assert resultado["pendientes"] == []
+    # El eneagrama puede salir de un recálculo posterior a la segunda entrada; el resto es idéntico
+    for clave in ("perfil_emocional", "tendencia", "big_five"):
+        assert resultado["perfil"][clave] == directo["perfil"][clave]
+    assert resultado["perfil"]["eneagrama"]["eneagrama_type"].startswith("Eneatipo")
+
+
+def test_job_errors_and_unknown_jobs(client):
+    trabajo = esperar_trabajo(client, client.post("/Objetivo").json()["trabajo"])
+    assert trabajo["estado"] == "error" and trabajo["error"] == "No se encontraron entradas en el diario"
+    assert client.get("/trabajo", params={"id": "0" * 32}).status_code == 404
+    assert client.get("/trabajo", params={"id": "no-es-un-id"}).status_code == 422
+
+
+def test_invalid_enneagram_is_not_requested_again_on_every_message(client, monkeypatch):
+    import main
+
+    llamadas = []
+
+    async def call_mistral_rag(messages):
+        if "eneagrama_type" in messages[0]["content"]:
+            llamadas.append(messages)
+            return "Esto no es JSON"
+        return "Respuesta del chat"
+
+    monkeypatch.setattr(main, "call_mistral_rag", call_mistral_rag)
+    client.post("/diario", json={"entry": "Hoy ha sido un buen día", "fecha": "2024-03-01"})
+    for _ in range(2):
+        while main.perfiles_en_curso:
+            time.sleep(0.01)
+        assert client.post("/chat", json={"content": "hola"}).json()["respuesta"] == "Respuesta del chat"
+    while main.perfiles_en_curso:
+        time.sleep(0.01)
+    # El recálculo tras escribir en el diario, y ninguno más por los mensajes del chat
+    assert len(llamadas) == 1
+    perfil = client.get("/perfilado").json()["perfil"]
+    assert perfil["eneagrama"] == {} and perfil["perfil_emocional"] == EMOCIONES
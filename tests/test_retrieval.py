@@ -0,0 +1,82 @@
+import asyncio
+
+from async_bd import AsyncAccessBD
+from retrieval import DiaryIndex, DiaryRetriever
+
+EMOCIONES = {"Happy": 0.1, "Angry": 0.0, "Surprise": 0.0, "Sad": 0.0, "Fear": 0.0}
+
+
+def test_index_ranks_related_entries_first():
+    index = DiaryIndex([
+        {"date": "2024-03-01", "entry": "Hoy fui a correr por el parque con mi perro"},
+        {"date": "2024-03-02", "entry": "Examen de matemáticas muy difícil, estoy nervioso"},
+        {"date": "2024-03-03", "entry": "Mañana otro examen, sigo nervioso por las notas"},
+    ])
+    results = index.search("nervioso por el examen", k=2)
+    assert {r["date"] for r in results} == {"2024-03-02", "2024-03-03"}
+    # Reescribir una fecha sustituye su entrada
+    index.upsert("2024-03-01", "Nervioso antes del examen final")
+    assert len(index) == 3
+    assert "2024-03-01" in {r["date"] for r in index.search("examen final", k=1)}
+
+
+def test_index_follows_writes_from_other_workers(storage):
+    storage.register_user("ana", "secreta")
+
+    async def scenario():
+        db = AsyncAccessBD(storage)
+        # Dos workers: el segundo escribe y el primero no recibe el aviso del listener
+        retriever = DiaryRetriever(db, ttl=0)
+        await db.insert_diary_entry("ana", {"date": "2024-03-01", "entry": "Paseo por la playa", "emotions": EMOCIONES})
+        assert [r["date"] for r in await retriever.search("ana", "playa")] == ["2024-03-01"]
+        await db.insert_diary_entry("ana", {"date": "2024-03-02", "entry": "Concierto de jazz", "emotions": EMOCIONES})
+        assert [r["date"] for r in await retriever.search("ana", "jazz")] == ["2024-03-02"]
+        db.executor.shutdown(wait=True)
+
+    asyncio.run(scenario())
+
+
+def test_index_is_reused_while_the_diary_does_not_change(storage):
+    storage.register_user("ana", "secreta")
+    storage.insert_diary_entry("ana", {"date": "2024-03-01", "entry": "Paseo por la playa", "emotions": EMOCIONES})
+
+    async def scenario():
+        db = AsyncAccessBD(storage)
+        retriever = DiaryRetriever(db, ttl=0)
+        first = await retriever.get_index("ana")
+        assert await retriever.get_index("ana") is first
+        db.executor.shutdown(wait=True)
+
+    asyncio.run(scenario())
+
+
+def test_local_writes_do_not_rebuild_the_index(storage, monkeypatch):
+    storage.register_user("ana", "secreta")
+    storage.insert_diary_entry("ana", {"date": "2024-03-01", "entry": "Paseo por la playa", "emotions": EMOCIONES})
+
+    async def scenario():
+        db = AsyncAccessBD(storage)
+        retriever = DiaryRetriever(db, ttl=0)
+        storage.add_diary_listener(retriever.on_diary_change)
+        lecturas = []
+        get_diary_entries = storage.get_diary_entries
+
+        def contar(*args, **kwargs):
+            lecturas.append(args)
+            return get_diary_entries(*args, **kwargs)
+
+        monkeypatch.setattr(storage, "get_diary_entries", contar)
+        await retriever.search("ana", "playa")
+        assert len(lecturas) == 1
+        # La escritura de este worker llega por el listener: pasado el TTL no se vuelve a leer el diario
+        await db.insert_diary_entry("ana", {"date": "2024-03-02", "entry": "Concierto de jazz", "emotions": EMOCIONES})
+        assert [r["date"] for r in await retriever.search("ana", "jazz")] == ["2024-03-02"]
+        assert len(lecturas) == 1
+        # Una escritura de otro worker (sin aviso) sí obliga a reconstruirlo
+        storage.diary_listeners.clear()
+        await db.insert_diary_entry("ana", {"date": "2024-03-03", "entry": "Cena con amigos", "emotions": EMOCIONES})
+        assert [r["date"] for r in await retriever.search("ana", "amigos")] == ["2024-03-03"]
+        assert len(lecturas) == 2
+        db.executor.shutdown(wait=True)
+
+    asyncio.run(scenario())